@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+"""
+Benchmark of Kerminal command dispatch, in commands per second, for a batch of
+";"-separated commands. Dispatch through the cached command grammars is
+compared against calling docopt directly, which re-parses the command
+docstring on every invocation.
+
+Usage:
+  python benchmarks/bench_commands.py [<repetitions>]
+"""
+
+from docopt import docopt
+
+import os
+import queue
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from kerminal.capabilities import Capabilities
+from kerminal.commands import KerminalCommands, command_grammar
+from kerminal.communication import SubscriptionManager, \
+                                   OrderedSetWithSubscriptionHook
+
+BATCH = ('throttle 50; stage; action 3; sas on; rcs off; gear down; '
+         'lights on; brakes off; fbw --yaw=0.5 --pitch=-0.25; rate 500; '
+         'sa prograde; log add v.altitude o.ApA; log remove o.ApA; '
+         'help stage; text')
+
+
+class BenchStream(object):
+    def __init__(self):
+        self.connected = True
+        self.msg_queue = queue.Queue()
+        self.data_log_on = False
+        self.capabilities = Capabilities(cache_file=None)
+        self.subscription_manager = SubscriptionManager(self.msg_queue)
+        self.data_log_vars = OrderedSetWithSubscriptionHook(self.subscription_manager)
+
+    def add_callback(self, callback_func):
+        pass
+
+
+class BenchApp(object):
+    def __init__(self):
+        self.stream = BenchStream()
+
+
+class BenchForm(object):
+    def __init__(self):
+        self.parent_app = BenchApp()
+
+    def info(self, msg):
+        pass
+
+    warning = error = critical = info
+
+    def show_text(self, msg=None):
+        pass
+
+    def show_smart(self):
+        pass
+
+
+def uncached_grammar(doc):
+    class Grammar(object):
+        def parse(self, argv, **kwargs):
+            return docopt(doc, argv=argv, **kwargs)
+    return Grammar()
+
+
+def run(repetitions, grammar_func):
+    import kerminal.commands as commands
+    commands.command_grammar, original = grammar_func, commands.command_grammar
+    try:
+        form = BenchForm()
+        controller = KerminalCommands(form, form)
+        start = time.perf_counter()
+        for _ in range(repetitions):
+            controller.process_command_complete(BATCH, None)
+        elapsed = time.perf_counter() - start
+    finally:
+        commands.command_grammar = original
+    return repetitions * len(BATCH.split(';')) / elapsed
+
+
+if __name__ == '__main__':
+    repetitions = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    uncached = run(repetitions, uncached_grammar)
+    cached = run(repetitions, command_grammar)
+    print('docopt per call : {:10.0f} commands/s'.format(uncached))
+    print('cached grammars : {:10.0f} commands/s'.format(cached))
+    print('speedup         : {:10.1f}x'.format(cached / uncached))
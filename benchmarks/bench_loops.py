@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+"""
+Benchmark of the event loops available to Kerminal's connection (see
+kerminal.communication.EVENT_LOOPS), in frames per second handled and their
+latency, for increasing numbers of subscribed values.
+
+A stand-in server, in a process of its own, sends frames of the given number of
+values at a fixed rate, each stamped with the time it was sent. A CommsThread
+receives them on the loop under test, and a watcher records when each frame is
+handled. A loop which cannot keep up handles fewer frames than are sent, and
+its latency grows as they queue. Each trial runs in a fresh interpreter.
+
+Usage:
+  python benchmarks/bench_loops.py [<seconds>] [<rate>]
+"""
+
+import importlib.util
+import json
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+#Values in each frame, for each trial
+VALUE_COUNTS = [10, 100, 1000]
+
+#Seconds the connection runs before frames are counted
+WARM_UP = 1.0
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('localhost', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError('stand-in server did not start')
+
+
+def serve(port, values, rate):
+    """
+    Runs the stand-in server, sending each client frames of values at rate.
+    """
+    import asyncio
+    from autobahn.asyncio.websocket import WebSocketServerProtocol,\
+                                           WebSocketServerFactory
+    from kerminal.telemachus_api import plotables
+
+    names = (list(plotables) + ['bench.value{0}'.format(i) for i in range(values)])[:values]
+    #Only the time of sending changes, so the rest of a frame is made once
+    rest = json.dumps({name: float(i) for i, name in enumerate(names)})[1:]
+
+    class BenchServerProtocol(WebSocketServerProtocol):
+
+        def onOpen(self):
+            self.task = asyncio.ensure_future(self.send_frames())
+
+        def onClose(self, wasClean, code, reason):
+            task = getattr(self, 'task', None)
+            if task is not None:
+                task.cancel()
+
+        async def send_frames(self):
+            start = time.monotonic()
+            sent = 0
+            while True:
+                due = int((time.monotonic() - start) * rate) + 1
+                while sent < due:
+                    frame = '{{"bench.sent":{0!r},{1}'.format(time.time(), rest)
+                    self.sendMessage(frame.encode('utf-8'))
+                    sent += 1
+                await asyncio.sleep(1 / rate)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    factory = WebSocketServerFactory('ws://localhost:{0}'.format(port))
+    factory.protocol = BenchServerProtocol
+    loop.run_until_complete(loop.create_server(factory, 'localhost', port))
+    loop.run_forever()
+
+
+def trial(kind, values, seconds, rate):
+    """
+    Returns the results of one loop receiving frames of values for seconds.
+    """
+    from functools import partial
+    from kerminal import communication
+
+    port = free_port()
+    server = multiprocessing.Process(target=serve, args=(port, values, rate))
+    server.daemon = True
+    server.start()
+    wait_for_port(port)
+
+    latencies = []
+
+    def handled(key, sent):
+        latencies.append(time.time() - sent)
+
+    stream = communication.CommsThread(port=port,
+                                       loop_factory=partial(communication.new_event_loop, kind))
+    stream.capabilities.cache_file = None
+    stream.add_watcher('bench.sent', handled)
+    stream.start()
+    stream.make_connection.set()
+    stream.connect_event.wait(10)
+    if not stream.connected:
+        raise RuntimeError('could not connect to the stand-in server')
+    loop = type(stream.loop).__module__.split('.')[0]
+
+    time.sleep(WARM_UP)
+    del latencies[:]
+    time.sleep(seconds)
+    measured = sorted(latencies)
+    stream.close_connection()
+    server.terminate()
+
+    count = len(measured)
+    return {'loop': loop,
+            'values': values,
+            'fps': count / seconds,
+            'p50': measured[count // 2] * 1000 if count else None,
+            'p99': measured[int(count * 0.99)] * 1000 if count else None}
+
+
+def run_trial(kind, values, seconds, rate):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [ROOT, env.get('PYTHONPATH')]))
+    result = subprocess.run([sys.executable, __file__, '--trial', kind,
+                             str(values), str(seconds), str(rate)],
+                            env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    if result.returncode:
+        return None
+    return json.loads(result.stdout.decode('utf-8').splitlines()[-1])
+
+
+def available_loops():
+    kinds = ['asyncio']
+    if importlib.util.find_spec('uvloop') is None:
+        print('uvloop is not installed, only asyncio is measured\n')
+    else:
+        kinds.append('uvloop')
+    return kinds
+
+
+def _ms(value):
+    return '{:8.2f}'.format(value) if value is not None else '       -'
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--trial']:
+        kind, values, seconds, rate = sys.argv[2:6]
+        print(json.dumps(trial(kind, int(values), float(seconds), float(rate))))
+        sys.exit()
+
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    rate = float(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    kinds = available_loops()
+    print('{0:g} frames per second sent for {1:g} s\n'.format(rate, seconds))
+    print('loop      values  frames/s   p50 ms   p99 ms')
+    for kind in kinds:
+        for values in VALUE_COUNTS:
+            result = run_trial(kind, values, seconds, rate)
+            if result is None:
+                print('{:<9} {:>6}  failed'.format(kind, values))
+                continue
+            print('{:<9} {:>6} {:9.0f} {} {}'.format(result['loop'], values,
+                                                     result['fps'],
+                                                     _ms(result['p50']),
+                                                     _ms(result['p99'])))
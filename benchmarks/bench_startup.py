@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+"""
+Benchmark of Kerminal's start up, in milliseconds, each step measured in fresh
+interpreters (the median of several) less the start up of the interpreter
+itself:
+
+  --version            "kerminal --version", which should be nearly instant
+  import kerminal      the package alone
+  communication        the communication thread, without the networking stack
+  network stack        asyncio and autobahn, imported on the first connection
+  user interface       the application, forms and panel classes
+  start up (no UI)     all of the above but the network stack, as at launch
+
+Steps whose dependencies are not installed are reported as unavailable.
+
+Usage:
+  python benchmarks/bench_startup.py [<repetitions>]
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SCRIPT = os.path.join(ROOT, 'scripts', 'kerminal')
+
+STEPS = [('--version', [SCRIPT, '--version']),
+         ('import kerminal', ['-c', 'import kerminal']),
+         ('communication', ['-c', 'import kerminal.communication']),
+         ('network stack', ['-c', 'import kerminal.communication as c; c.import_network()']),
+         ('user interface', ['-c', 'import kerminal.application']),
+         ('start up (no UI)', ['-c', 'import kerminal.communication as c; '
+                                     'c.CommsThread(); import kerminal.commands']),
+         ]
+
+
+def measure(args, repetitions):
+    """
+    Returns the median wall time in seconds of running the interpreter with
+    args, or None if it fails.
+    """
+    env = dict(os.environ, PYTHONPATH=ROOT, PYTHONDONTWRITEBYTECODE='')
+    times = []
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable] + args, env=env,
+                                stdout=subprocess.DEVNULL,
+                                stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+        if result.returncode:
+            return None
+    return statistics.median(times)
+
+
+if __name__ == '__main__':
+    repetitions = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    baseline = measure(['-c', 'pass'], repetitions)
+    print('interpreter      : {:8.1f} ms'.format(baseline * 1000))
+    for name, args in STEPS:
+        elapsed = measure(args, repetitions)
+        if elapsed is None:
+            print('{:<17}:  unavailable'.format(name))
+        else:
+            print('{:<17}: {:8.1f} ms'.format(name, (elapsed - baseline) * 1000))
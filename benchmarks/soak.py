@@ -0,0 +1,492 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+"""
+Soak test of Kerminal: a headless Kerminal is driven for a long session against
+a local stand-in for the Telemachus server, while its memory is watched for
+anything which grows without bound.
+
+The stand-in server answers subscriptions, the version and api listing and
+MechJeb actions, and drops the connection every so often. Kerminal meanwhile
+runs a repeating cycle of commands adding and removing log variables, alerts,
+triggers, scheduled commands and rolling statistics.
+
+Throughout the session the harness samples the heap (with tracemalloc) and the
+size of each structure touched for every frame: the waiting callbacks, the
+watchers, the subscription counts, the live data, the api registry, and so on.
+After a warm-up the rest of the session is cut into windows; a structure grows
+without bound if its largest value rises in every window, or if its smallest
+value never falls from one window to the next and ends higher than it began.
+The heap grows without bound if its smallest value does so by more than the
+growth tolerated (per frame, and at the least), and the count of live objects
+of a type (those the garbage collector tracks, which are the containers) if it
+never falls from one window to the next. Each window must last two cycles of
+the churned commands and two dropped connections, or growth is not judged at
+all. The report then lists the allocation sites which grew the most since the
+warm-up.
+
+The user interface (and so its widgets' feeds) is not exercised; growth in
+functools.partial objects in the counts per type is the sign to look for there.
+
+Run it as "python benchmarks/soak.py"; the exit status is 1 if anything grew
+without bound, or if a command of the cycle raised an exception.
+
+Usage:
+  soak.py [options]
+
+Options:
+  --duration=<s>         Length of the session in seconds [default: 7200]
+  --warm-up=<s>          Seconds before the baseline is taken [default: 120]
+  --sample=<s>           Seconds between samples [default: 30]
+  --rate=<ms>            Interval of the server's messages [default: 100]
+  --churn=<s>            Seconds between churned commands [default: 1]
+  --reconnect=<s>        Seconds between dropped connections, 0 for none
+                         [default: 600]
+  --windows=<n>          Windows after the warm-up [default: 4]
+  --frames=<n>           Depth of the allocation tracebacks [default: 5]
+  --sites=<n>            Allocation sites reported [default: 15]
+  --max-growth=<bytes>   Heap growth per frame tolerated [default: 8]
+  --min-growth=<bytes>   Heap growth tolerated however few the frames, for
+                         buffers caught part full [default: 65536]
+  --min-objects=<n>      Growth in the objects of a type tolerated
+                         [default: 100]
+  --port=<port>          Port of the stand-in server [default: 8095]
+"""
+
+from docopt import docopt
+
+import asyncio
+import gc
+import json
+import linecache
+import logging
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from autobahn.asyncio.websocket import WebSocketServerProtocol,\
+                                       WebSocketServerFactory
+
+from kerminal import communication
+from kerminal.headless import HeadlessDaemon
+from kerminal.telemachus_api import API
+
+STAND_IN_VERSION = '1.6.0.0'
+
+#Commands run in turn, throughout the session; those changing the log
+#variables are run only when they would change something (see Soak.change_log)
+CHURN = ['log add o.ApA o.PeA',
+         'alert v.altitude > 1000',
+         'when v.altitude > 1e12 do stage',
+         'at +1 throttle 50',
+         'sa prograde',
+         'log add v.altitude:rate10s',
+         'rate {rate}',
+         'log remove o.ApA o.PeA',
+         'alert clear',
+         'when clear',
+         'log remove v.altitude:rate10s',
+         'telemetry',
+         ]
+
+#(name, size) of the structures touched for each frame, sampled as the
+#session runs; module globals are looked up afresh, being rebound
+STRUCTURES = [
+    ('callbacks', lambda d: len(communication.CALLBACKS)),
+    ('watchers', lambda d: sum(len(w) for w in communication.WATCHERS.values())),
+    ('subscriptions', lambda d: len(d.stream.subscription_manager.map)),
+    ('log variables', lambda d: len(d.stream.data_log_vars)),
+    ('outbound queue', lambda d: d.stream.msg_queue.qsize()),
+    ('live data', lambda d: len(d.stream.data)),
+    ('api registry', lambda d: len(API.variables)),
+    ('scheduled', lambda d: len(d.stream.scheduler)),
+    ('triggers', lambda d: len(d.stream.triggers)),
+    ('alerts', lambda d: len(d.stream.alerts)),
+    ('rolling keys', lambda d: len(d.stream.rolling.active)),
+    ('rolling windows', lambda d: len(d.stream.rolling.windows)),
+    ('connection listeners', lambda d: len(d.stream.connection_listeners)),
+    ]
+
+
+def stand_in_value(key, count):
+    """
+    A plausible value for an api variable, changing from frame to frame.
+    """
+    if key in ('t.universalTime', 'v.missionTime'):  # Clocks only go forward
+        return time.time()
+    variable = API.get(key)
+    type_ = 'float' if variable is None else variable.type
+    if type_ == 'float':
+        return 1000 * math.sin(count / 50 + len(key)) + 2000
+    if type_ == 'int':
+        return count
+    if type_ == 'bool':
+        return (count // 50) % 2 == 0
+    if type_ == 'str':
+        return 'Soak'
+    return None
+
+
+class StandInProtocol(WebSocketServerProtocol):
+    """
+    One connection to the stand-in server, sending the subscribed keys at the
+    requested rate.
+    """
+
+    def onOpen(self):
+        self.keys = set()
+        self.replies = {}  # key -> value sent once, with the next frame
+        self.interval = 0.5
+        self.count = 0
+        self.factory.clients.add(self)
+        self.task = asyncio.ensure_future(self.send_frames())
+
+    def onMessage(self, payload, isBinary):
+        msg = json.loads(payload.decode('utf-8'))
+        self.keys.update(msg.get('+', []))
+        self.keys.difference_update(msg.get('-', []))
+        if 'rate' in msg:
+            self.interval = max(int(msg['rate']), 10) / 1000
+        for action in msg.get('run', []):
+            if action.startswith('mj.'):
+                self.replies[action] = 0  # SmartASS success
+
+    def onClose(self, wasClean, code, reason):
+        self.factory.clients.discard(self)
+        task = getattr(self, 'task', None)
+        if task is not None:
+            task.cancel()
+
+    def frame(self):
+        self.count += 1
+        frame = {}
+        for key in self.keys:
+            if key == 'a.version':
+                frame[key] = STAND_IN_VERSION
+            elif key == 'a.api':
+                frame[key] = [{'apistring': k} for k in sorted(API.variables)]
+            else:
+                frame[key] = stand_in_value(key, self.count)
+        frame.update(self.replies)
+        self.replies = {}
+        return frame
+
+    async def send_frames(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.sendMessage(json.dumps(self.frame()).encode('utf-8'))
+
+
+class StandInServer(threading.Thread):
+    """
+    The stand-in for Telemachus, on an event loop of its own.
+    """
+    def __init__(self, port):
+        super(StandInServer, self).__init__()
+        self.daemon = True
+        self.port = port
+        self.loop = None
+        self.ready = threading.Event()
+
+    def run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        factory = WebSocketServerFactory('ws://localhost:{0}'.format(self.port))
+        factory.protocol = StandInProtocol
+        factory.clients = set()
+        self.factory = factory
+        self.loop.run_until_complete(self.loop.create_server(factory, 'localhost',
+                                                             self.port))
+        self.ready.set()
+        self.loop.run_forever()
+
+    def drop_connections(self):
+        def drop():
+            for client in list(self.factory.clients):
+                client.sendClose()
+        self.loop.call_soon_threadsafe(drop)
+
+
+def count_types():
+    counts = {}
+    for obj in gc.get_objects():
+        kind = type(obj)
+        if kind.__module__ == 'tracemalloc':  # The harness's own snapshots
+            continue
+        counts[kind.__qualname__] = counts.get(kind.__qualname__, 0) + 1
+    return counts
+
+
+def slope(xs, ys):
+    """
+    The least squares slope of ys against xs.
+    """
+    n = len(xs)
+    mean_x, mean_y = sum(xs) / n, sum(ys) / n
+    spread = sum((x - mean_x) ** 2 for x in xs)
+    if not spread:
+        return 0.0
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / spread
+
+
+def split(values, windows):
+    size = len(values) // windows
+    return [values[i * size:(i + 1) * size] for i in range(windows if size else 0)]
+
+
+def floor_rises(values, windows, minimum=1):
+    """
+    Whether the smallest of the values never falls from one window to the
+    next, and rises by at least minimum overall: growth which is never given
+    back, however slowly it comes.
+    """
+    minima = [min(part) for part in split(values, windows)]
+    if len(minima) < 2:
+        return False
+    rising = all(b >= a for a, b in zip(minima, minima[1:]))
+    return rising and minima[-1] - minima[0] >= minimum
+
+
+def grows(values, windows, minimum=1):
+    """
+    Whether the largest of the values rises in every one of the windows (and
+    by at least minimum overall), or their floor rises (see floor_rises); the
+    values being those after the warm-up.
+    """
+    maxima = [max(part) for part in split(values, windows)]
+    if len(maxima) < 2:
+        return False
+    if all(b > a for a, b in zip(maxima, maxima[1:])):
+        return maxima[-1] - values[0] >= minimum
+    return floor_rises(values, windows, minimum)
+
+
+class Soak(object):
+
+    def __init__(self, args):
+        self.duration = float(args['--duration'])
+        self.warm_up = float(args['--warm-up'])
+        self.interval = float(args['--sample'])
+        self.rate = int(args['--rate'])
+        self.churn_interval = float(args['--churn'])
+        self.reconnect = float(args['--reconnect'])
+        self.windows = int(args['--windows'])
+        self.trace_frames = int(args['--frames'])
+        self.sites = int(args['--sites'])
+        self.max_growth = float(args['--max-growth'])
+        self.min_growth = float(args['--min-growth'])
+        self.min_objects = int(args['--min-objects'])
+        self.port = int(args['--port'])
+        self.directory = tempfile.mkdtemp(prefix='kerminal-soak-')
+
+        self.samples = []  # (elapsed, frames, heap bytes, structure sizes)
+        self.type_counts = []  # counts by type at the baseline and each window
+        self.baseline = None  # tracemalloc snapshot at the end of the warm-up
+        self.failures = []
+        self.raised = []  # The churned commands which raised an exception
+
+    def start(self):
+        self.server = StandInServer(self.port)
+        self.server.start()
+        self.server.ready.wait()
+        self.daemon = HeadlessDaemon(port=self.port,
+                                     log_vars=['v.altitude', 'v.verticalSpeed'],
+                                     rate=self.rate,
+                                     plugins=False)
+        stream = self.daemon.stream
+        stream.capabilities.cache_file = None  # Leave the user's cache be
+        stream.data_log_file = os.path.join(self.directory, 'data.csv')
+        stream.data_log_on = True
+        stream.start()
+        self.daemon.request_connection()
+
+    def execute(self, command):
+        """
+        Runs a command line as the control socket would, but lets an exception
+        through rather than turning it into a reply. The replies are dropped.
+        """
+        with self.daemon.command_lock:
+            try:
+                self.daemon.action_controller.process_command_complete(command, None)
+            finally:
+                self.daemon.form.collect()
+
+    def change_log(self, change, variables):
+        """
+        Adds or removes those of the log variables which are not yet, or are
+        still, logged. The log command refuses either while logging is on, and
+        log off and log on while not connected, so logging is turned off around
+        the change, which waits for a connection if need be.
+        """
+        stream = self.daemon.stream
+        variables = [v for v in variables
+                     if (v in stream.data_log_vars) == (change == 'remove')]
+        if not variables:
+            return
+        if stream.data_log_on:
+            if not stream.connected:
+                return
+            self.execute('log off')
+        self.execute('log {0} {1}'.format(change, ' '.join(variables)))
+        if stream.connected:
+            self.execute('log on')
+
+    def churn(self, number):
+        command = CHURN[number % len(CHURN)].format(rate=self.rate)
+        words = command.split()
+        try:
+            if words[:2] in (['log', 'add'], ['log', 'remove']):
+                self.change_log(words[1], words[2:])
+            else:
+                self.execute(command)
+        except Exception:
+            if command not in self.raised:  # Each is reported once
+                print('\nCommand "{0}" raised:'.format(command))
+                traceback.print_exc(file=sys.stdout)
+                self.raised.append(command)
+
+    def sample(self, elapsed):
+        frames = self.daemon.stream.metrics.frames_received
+        #Each connection leaves its event loop to the garbage collector, which
+        #would otherwise decide the heap's floor, and any traceback printed
+        #fills the linecache, which is not Kerminal's
+        gc.collect()
+        linecache.clearcache()
+        heap = tracemalloc.get_traced_memory()[0]
+        sizes = tuple(size(self.daemon) for _, size in STRUCTURES)
+        self.samples.append((elapsed, frames, heap, sizes))
+        print('{0:8.0f} s {1:9} frames {2:9.2f} MB  '.format(elapsed, frames,
+                                                           heap / 1e6) +
+              ' '.join(str(s) for s in sizes))
+        sys.stdout.flush()
+
+    def run(self):
+        tracemalloc.start(self.trace_frames)
+        self.start()
+        begin = time.monotonic()
+        window_length = (self.duration - self.warm_up) / self.windows
+        checkpoints = [self.warm_up + i * window_length for i in range(self.windows + 1)]
+        next_sample = next_churn = 0.0
+        next_drop = self.reconnect or math.inf
+        churned = 0
+        print('Sizes: ' + ', '.join(name for name, _ in STRUCTURES))
+        while True:
+            elapsed = time.monotonic() - begin
+            if elapsed >= self.duration:
+                break
+            stream = self.daemon.stream
+            if not stream.connected and not stream.make_connection.is_set():
+                self.daemon.request_connection()
+            if elapsed >= next_churn:
+                self.churn(churned)
+                churned += 1
+                next_churn += self.churn_interval
+            if elapsed >= next_drop:
+                self.server.drop_connections()
+                next_drop += self.reconnect
+            if checkpoints and elapsed >= checkpoints[0]:
+                checkpoints.pop(0)
+                gc.collect()
+                self.type_counts.append(count_types())
+                #Before the sample, which then counts the snapshot's memory too
+                if self.baseline is None:
+                    self.baseline = tracemalloc.take_snapshot()
+            if elapsed >= next_sample:
+                self.sample(elapsed)
+                next_sample += self.interval
+            time.sleep(min(0.1, self.churn_interval))
+        self.sample(time.monotonic() - begin)
+        gc.collect()
+        self.type_counts.append(count_types())
+        final = tracemalloc.take_snapshot()
+        self.daemon.shutdown()
+        return self.report(final)
+
+    def report(self, final):
+        after = [s for s in self.samples if s[0] >= self.warm_up]
+        if len(after) < 2 * self.windows or self.baseline is None:
+            print('\nToo few samples after the warm-up to judge growth')
+            return 1
+        elapsed, frames, heap, sizes = zip(*after)
+        #The sizes rise and fall with the churn and the connections, so each
+        #window must see them through, for its floor to be comparable
+        cycle = max(len(CHURN) * self.churn_interval, self.reconnect)
+        window = (elapsed[-1] - elapsed[0]) / self.windows
+        if window < 2 * cycle:
+            print('\nWindows of {0:.0f} s are too short to judge growth, they '
+                  'must be of at least {1:.0f} s'.format(window, 2 * cycle))
+            return 1
+        frame_count = frames[-1] - frames[0]
+
+        print('\nStructure              after warm-up      final        max  verdict')
+        for i, (name, _) in enumerate(STRUCTURES):
+            values = [s[i] for s in sizes]
+            verdict = 'GROWING' if grows(values, self.windows) else 'ok'
+            if verdict != 'ok':
+                self.failures.append(name)
+            print('{0:<22} {1:>13} {2:>10} {3:>10}  {4}'.format(name, values[0],
+                  values[-1], max(values), verdict))
+
+        #Buffers fill and empty between samples, so only the heap's floor is
+        #judged, by the growth tolerated
+        per_frame = slope(frames, heap)
+        verdict = 'ok'
+        tolerated = max(self.max_growth * frame_count, self.min_growth)
+        if per_frame > self.max_growth and floor_rises(heap, self.windows, tolerated):
+            verdict = 'GROWING'
+            self.failures.append('heap')
+        print('\nHeap: {0:.2f} MB after warm-up, {1:.2f} MB final, {2:.1f} bytes '
+              'per frame over {3} frames  {4}'.format(heap[0] / 1e6, heap[-1] / 1e6,
+                                                      per_frame, frame_count, verdict))
+
+        print('\nType                               after warm-up      final  verdict')
+        growth = []
+        for name, count in self.type_counts[-1].items():
+            counts = [c.get(name, 0) for c in self.type_counts]
+            if count - counts[0] > 0:
+                growth.append((count - counts[0], name, counts))
+        for difference, name, counts in sorted(growth, reverse=True)[:self.sites]:
+            #Counted after collecting garbage, so any rise which is never
+            #given back is growth
+            rising = all(b >= a for a, b in zip(counts, counts[1:]))
+            verdict = 'ok'
+            if rising and difference >= self.min_objects:
+                verdict = 'GROWING'
+                self.failures.append(name)
+            print('{0:<34} {1:>13} {2:>10}  {3}'.format(name[:34], counts[0],
+                                                       counts[-1], verdict))
+
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__),
+                   tracemalloc.Filter(False, __file__),
+                   tracemalloc.Filter(False, '<frozen importlib._bootstrap>')]
+        key = 'traceback' if self.trace_frames > 1 else 'lineno'
+        changes = final.filter_traces(filters).compare_to(
+            self.baseline.filter_traces(filters), key)
+        print('\nAllocation sites grown the most since the warm-up:')
+        for change in [c for c in changes if c.size_diff > 0][:self.sites]:
+            print('\n{0:+.1f} KB in {1:+} blocks, {2:.1f} KB in all'.format(
+                  change.size_diff / 1e3, change.count_diff, change.size / 1e3))
+            for line in change.traceback.format(most_recent_first=True):
+                print('  ' + line.strip())
+
+        if self.raised:
+            print('\nFAILED, commands raised: ' + ', '.join(self.raised))
+        if self.failures:
+            print('\nFAILED, growing without bound: ' + ', '.join(self.failures))
+        if self.raised or self.failures:
+            return 1
+        print('\nPASSED')
+        return 0
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    logging.basicConfig(level=logging.WARNING)
+    sys.exit(Soak(args).run())
@@ -10,5 +10,12 @@ log = logging.getLogger('kerminal')
 
 __version__ = '0.1.2'
 
-from .application import KerminalApp
+
+def __getattr__(name):
+    #The application, and the user interface with it, is only imported when
+    #used, so that importing kerminal (as for its version) is quick
+    if name == 'KerminalApp':
+        from .application import KerminalApp
+        return KerminalApp
+    raise AttributeError('module {0!r} has no attribute {1!r}'.format(__name__, name))
 
@@ -0,0 +1,283 @@
+# encoding: utf-8
+
+"""
+Limit alerts on the live data, as in "v.geeForce > 6", raised with a severity
+(warning, error or critical) when their condition becomes true and cleared when
+it becomes false again.
+
+A condition is one or more comparisons of an api variable with a number,
+joined by "and", such as "v.heightFromTerrain < 100 and v.verticalSpeed < -20".
+A threshold ending in "%" compares a resource with its maximum, as in
+"r.resource[ElectricCharge] < 20%". Each comparison has a hysteresis band: once
+true it only becomes false when its value has moved the band's width back past
+the threshold, so a value hovering near the threshold does not flap.
+
+The comparisons of all alerts are packed into arrays, evaluated together for
+each message; with NumPy this is a handful of vector operations however many
+alerts there are, and the only Python loops are over the distinct api
+variables read and over the alerts which change.
+"""
+
+import collections
+import itertools
+import math
+import re
+import threading
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+SEVERITIES = ('warning', 'error', 'critical')
+
+#The maximum of a resource, which "%" thresholds are relative to
+_MAXIMA = {'r.resource': 'r.resourceMax',
+           'r.resourceCurrent': 'r.resourceCurrentMax'}
+
+_clause = re.compile(r'^(?P<key>[^\s<>=]+)\s*(?P<op><=|>=|<|>)\s*'
+                     r'(?P<threshold>[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)'
+                     r'(?P<percent>%?)$')
+
+_conjunction = re.compile(r'\s+and\s+')
+
+Clause = collections.namedtuple('Clause', ['key', 'op', 'threshold', 'maximum'])
+
+
+def parse_clause(text):
+    """
+    Returns the Clause for a comparison such as "v.geeForce > 6". Raises
+    ValueError if it cannot be understood.
+    """
+    match = _clause.match(text.strip())
+    if match is None:
+        raise ValueError('"{0}" is not a comparison of an api variable with a '
+                         'number'.format(text.strip()))
+    key = match.group('key')
+    maximum = None
+    if match.group('percent'):
+        base, bracket, arg = key.partition('[')
+        if not bracket or base not in _MAXIMA:
+            raise ValueError('"%" thresholds are only for resources, such as '
+                             'r.resource[ElectricCharge]')
+        maximum = '{0}[{1}'.format(_MAXIMA[base], arg)
+    return Clause(key, match.group('op'), float(match.group('threshold')), maximum)
+
+
+def parse_condition(text):
+    """
+    Returns the list of Clauses in a condition. Raises ValueError if it cannot
+    be understood.
+    """
+    text = text.strip()
+    if not text:
+        raise ValueError('empty condition')
+    return [parse_clause(part) for part in _conjunction.split(text)]
+
+
+def _number(value):
+    #Values not yet received, or not numbers, never satisfy a comparison
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return math.nan
+
+
+class Alert(object):
+    def __init__(self, number, condition, severity, band, notify):
+        if severity not in SEVERITIES:
+            raise ValueError('severity must be one of {0}'.format(', '.join(SEVERITIES)))
+        if not band >= 0:
+            raise ValueError('band must not be negative')
+        self.number = number
+        self.condition = condition
+        self.severity = severity
+        self.band = band
+        self.notify = notify
+        self.clauses = parse_condition(condition)
+        self.keys = set()
+        for clause in self.clauses:
+            self.keys.add(clause.key)
+            if clause.maximum is not None:
+                self.keys.add(clause.maximum)
+        self.raised = False
+        self.states = [False] * len(self.clauses)
+
+    def values(self, data):
+        """
+        Returns the current values of the alert's comparisons, for display.
+        """
+        values = []
+        for clause in self.clauses:
+            value = _number(data.get(clause.key))
+            if clause.maximum is not None:
+                maximum = _number(data.get(clause.maximum))
+                value = 100 * value / maximum if maximum else math.nan
+            values.append(value)
+        return values
+
+
+class AlertEngine(object):
+    """
+    The set of active Alerts, packed for evaluation. Alerts may be added and
+    removed from any thread, `evaluate` is called by the communication thread.
+    """
+    def __init__(self):
+        self.alerts = collections.OrderedDict()  # number -> Alert
+        self.counter = itertools.count(1)
+        self.lock = threading.Lock()
+        self._pack()
+
+    def __len__(self):
+        return len(self.alerts)
+
+    def add(self, condition, severity='warning', band=0.0, notify=None):
+        """
+        Adds an alert, called with (alert, raised) as it is raised and
+        cleared. Raises ValueError if the condition cannot be understood.
+        """
+        alert = Alert(next(self.counter), condition, severity, band, notify)
+        with self.lock:
+            self._store()
+            self.alerts[alert.number] = alert
+            self._pack()
+        return alert
+
+    def remove(self, number):
+        with self.lock:
+            if number not in self.alerts:
+                return False
+            self._store()
+            del self.alerts[number]
+            self._pack()
+            return True
+
+    def clear(self):
+        with self.lock:
+            self.alerts.clear()
+            self._pack()
+
+    def reset(self):
+        """
+        Clears every alert without notice, as for a new connection.
+        """
+        with self.lock:
+            for alert in self.alerts.values():
+                alert.raised = False
+                alert.states = [False] * len(alert.clauses)
+            self._pack()
+
+    def pending(self):
+        with self.lock:
+            self._store()
+            return list(self.alerts.values())
+
+    def keys(self):
+        with self.lock:
+            return list(self.columns)
+
+    def subscribed_keys(self):
+        #Each alert subscribes to its own inputs
+        with self.lock:
+            return [key for alert in self.alerts.values() for key in alert.keys]
+
+    def _store(self):
+        #The evaluation state lives in the packed arrays, and is written back
+        #to the alerts before they are repacked
+        states = [bool(s) for s in self.states]
+        raised = [bool(r) for r in self.raised]
+        for i, alert in enumerate(self.order):
+            alert.raised = raised[i]
+            start = self.starts[i]
+            alert.states = states[start:start + len(alert.clauses)]
+
+    def _pack(self):
+        self.order = list(self.alerts.values())
+        self.columns = []
+        column_index = {}
+        value_column, maximum_column, threshold, release, inclusive, scale = \
+            [], [], [], [], [], []
+        starts, states, raised = [], [], []
+        for alert in self.order:
+            starts.append(len(value_column))
+            raised.append(alert.raised)
+            states.extend(alert.states)
+            for clause in alert.clauses:
+                for key in (clause.key, clause.maximum):
+                    if key is not None and key not in column_index:
+                        column_index[key] = len(self.columns)
+                        self.columns.append(key)
+                #Comparisons are made "greater than" by negating values and
+                #thresholds of "less than" ones
+                s = 1.0 if clause.op.startswith('>') else -1.0
+                value_column.append(column_index[clause.key])
+                #Plain values are divided by the constant 1 after the columns
+                maximum_column.append(-1 if clause.maximum is None
+                                      else column_index[clause.maximum])
+                threshold.append(s * clause.threshold)
+                release.append(s * clause.threshold - alert.band)
+                inclusive.append(clause.op.endswith('='))
+                scale.append(s if clause.maximum is None else 100 * s)
+        ones = len(self.columns)
+        maximum_column = [ones if c < 0 else c for c in maximum_column]
+        self.starts = starts
+        if numpy is not None:
+            self.value_column = numpy.array(value_column, dtype=numpy.intp)
+            self.maximum_column = numpy.array(maximum_column, dtype=numpy.intp)
+            self.threshold = numpy.array(threshold, dtype=float)
+            self.release = numpy.array(release, dtype=float)
+            self.inclusive = numpy.array(inclusive, dtype=bool)
+            self.scale = numpy.array(scale, dtype=float)
+            self.states = numpy.array(states, dtype=bool)
+            self.raised = numpy.array(raised, dtype=bool)
+            self.rule_starts = numpy.array(starts, dtype=numpy.intp)
+        else:
+            self.value_column = value_column
+            self.maximum_column = maximum_column
+            self.threshold = threshold
+            self.release = release
+            self.inclusive = inclusive
+            self.scale = scale
+            self.states = states
+            self.raised = raised
+            self.rule_starts = starts
+
+    def evaluate(self, data):
+        """
+        Evaluates every alert against the data, returning a list of
+        (alert, raised) for those raised or cleared by it.
+        """
+        with self.lock:
+            if not self.order:
+                return []
+            values = [_number(data.get(key)) for key in self.columns]
+            values.append(1.0)
+            if numpy is not None:
+                raised = self._evaluate_array(values)
+                changed = numpy.flatnonzero(raised != self.raised).tolist()
+            else:
+                raised = self._evaluate_list(values)
+                changed = [i for i, r in enumerate(raised) if r != self.raised[i]]
+            self.raised = raised
+            return [(self.order[i], bool(raised[i])) for i in changed]
+
+    def _evaluate_array(self, values):
+        values = numpy.array(values, dtype=float)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            x = values[self.value_column] * self.scale / values[self.maximum_column]
+        above = (x > self.threshold) | (self.inclusive & (x == self.threshold))
+        #A comparison is released once past the band; nan (missing) releases
+        held = (x > self.release) | (self.inclusive & (x == self.release))
+        self.states = (self.states | above) & held
+        return numpy.logical_and.reduceat(self.states, self.rule_starts)
+
+    def _evaluate_list(self, values):
+        states = self.states
+        for i, column in enumerate(self.value_column):
+            maximum = values[self.maximum_column[i]]
+            x = values[column] * self.scale[i] / maximum if maximum else math.nan
+            inclusive = self.inclusive[i]
+            above = x > self.threshold[i] or (inclusive and x == self.threshold[i])
+            held = x > self.release[i] or (inclusive and x == self.release[i])
+            states[i] = (states[i] or above) and held
+        ends = self.rule_starts[1:] + [len(states)]
+        return [all(states[start:end]) for start, end in zip(self.rule_starts, ends)]
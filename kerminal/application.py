@@ -15,10 +15,44 @@ log = logging.getLogger('npyscreen2.kerminal')
 
 
 class KerminalApp(npyscreen2.App):
-    def __init__(self):
+    def __init__(self, relay=None, segment=None, metrics=None, plugins=True,
+                 comms_process=False, loop_factory=None):
         super(KerminalApp, self).__init__(keypress_timeout_default=1)
+        #Keyword arguments for CommsThread.start_relay, or None
+        self.relay = relay
+        #The index file of the shared memory segment, or None
+        self.segment = segment
+        #Keyword arguments for CommsThread.start_metrics, or None
+        self.metrics = metrics
+        #Whether to load the installed plugins
+        self.load_plugins = plugins
+        #Whether to hold the connection in a separate process
+        self.comms_process = comms_process
+        #Makes the event loops, see CommsThread
+        self.loop_factory = loop_factory
 
     def on_start(self):
-        self.stream = CommsThread()
+        if self.comms_process:
+            from .comms_process import ProcessCommsThread
+            self.stream = ProcessCommsThread(loop_factory=self.loop_factory)
+        else:
+            self.stream = CommsThread(loop_factory=self.loop_factory)
+        if self.load_plugins:
+            self.stream.plugins.discover()
         self.stream.start()
         self.main_form = self.add_form(KerminalForm, 'MAIN')
+        self.stream.plugins.start(self.stream, self.main_form.action_controller)
+        if self.relay is not None:
+            relay = self.stream.start_relay(**self.relay)
+            if relay.error is not None:
+                self.main_form.error('Relay not started: {0}'.format(relay.error))
+        if self.segment is not None:
+            try:
+                self.stream.start_segment(self.segment)
+            except (OSError, RuntimeError) as e:
+                self.main_form.error('Shared memory not started: {0}'.format(e))
+        if self.metrics is not None:
+            try:
+                self.stream.start_metrics(**self.metrics)
+            except OSError as e:
+                self.main_form.error('Metrics not started: {0}'.format(e))
@@ -0,0 +1,161 @@
+# encoding: utf-8
+
+"""
+The api variables supported by the connected Telemachus server.
+
+On connecting, the server's version is requested and, unless the api listing
+for that version is already cached on disk, the listing itself. The version
+last seen at each address is remembered too. Until the version of the
+connection is confirmed, only the variables that version supports are sent to
+the server (or none, if there is no such version); the server may have been
+upgraded since, so the others are sent once the capabilities are confirmed.
+"""
+
+import json
+import logging
+import os
+import threading
+
+log = logging.getLogger('kerminal.capabilities')
+
+DEFAULT_CACHE_FILE = os.path.join(os.path.expanduser('~'), '.kerminal',
+                                  'capabilities.json')
+
+#Variables used to discover the capabilities, and those handled locally
+ALWAYS_SUPPORTED = frozenset(['a.version', 'a.api', 'sys.time'])
+
+
+def api_keys(listing):
+    """
+    Returns the set of api variables named in the server's response to a.api,
+    a list of entries which are either dicts with an "apistring" or strings.
+    """
+    keys = set()
+    for entry in listing:
+        if isinstance(entry, dict):
+            entry = entry.get('apistring')
+        if isinstance(entry, str) and entry:
+            keys.add(entry.split('[', 1)[0])
+    return keys
+
+
+class Capabilities(object):
+    """
+    The set of api variables supported by the server. Until it is known every
+    variable is assumed to be supported, though only those expected to be
+    supported are allowed to be sent (see `expect`).
+    """
+    def __init__(self, cache_file=DEFAULT_CACHE_FILE):
+        self.cache_file = cache_file
+        self.version = None
+        self.supported = None  # frozenset of base api variables, or None
+        self.expected = None  # Those expected until supported is known
+        #Variables computed locally, supported whatever the server
+        self.local = set(ALWAYS_SUPPORTED)
+        self.lock = threading.Lock()
+
+    @property
+    def known(self):
+        return self.supported is not None
+
+    def _member(self, key, supported):
+        if key in self.local:
+            return True
+        #Rolling statistics, as "v.altitude:rate10s", follow their variable
+        key = key.split(':', 1)[0]
+        if key in self.local:
+            return True
+        return key in supported or key.split('[', 1)[0] in supported
+
+    def supports(self, key):
+        supported = self.supported
+        return supported is None or self._member(key, supported)
+
+    def allows(self, key):
+        """
+        Returns True if key may be sent to the server now: if it is supported,
+        or while that is not known, if it is expected to be.
+        """
+        supported, expected = self.supported, self.expected
+        if supported is None and expected is not None:
+            return self._member(key, expected)
+        return self.supports(key)
+
+    def filter(self, keys):
+        return [key for key in keys if self.supports(key)]
+
+    def reset(self):
+        self.version = None
+        self.supported = None
+        self.expected = None
+
+    def _read_cache(self):
+        if self.cache_file is None or not os.path.isfile(self.cache_file):
+            return {'versions': {}, 'servers': {}}
+        try:
+            with open(self.cache_file, 'r') as inf:
+                cache = json.load(inf)
+        except (OSError, ValueError) as e:
+            log.warning('Could not read capability cache: {0}'.format(e))
+            return {'versions': {}, 'servers': {}}
+        cache.setdefault('versions', {})
+        cache.setdefault('servers', {})
+        return cache
+
+    def _write_cache(self, cache):
+        if self.cache_file is None:
+            return
+        temp_file = self.cache_file + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            with open(temp_file, 'w') as outf:
+                json.dump(cache, outf)
+            os.replace(temp_file, self.cache_file)
+        except OSError as e:
+            log.warning('Could not write capability cache: {0}'.format(e))
+
+    def expect(self, server):
+        """
+        Forgets the capabilities of any earlier connection, as a new one is
+        made to server (as "host:port"), and expects those of the version last
+        seen there, if they are cached, until the server confirms its version.
+        Returns that version, or None.
+        """
+        with self.lock:
+            self.reset()
+            cache = self._read_cache()
+            version = cache['servers'].get(server)
+            #Nothing is sent before the version is confirmed, if not cached
+            self.expected = frozenset(cache['versions'].get(version, ()))
+            return version
+
+    def load(self, version, server):
+        """
+        Applies the cached capabilities of version, remembering it as the
+        version at server. Returns False if the version is not cached.
+        """
+        with self.lock:
+            cache = self._read_cache()
+            keys = cache['versions'].get(version)
+            if keys is None:
+                return False
+            self.version, self.supported = version, frozenset(keys)
+            if cache['servers'].get(server) != version:
+                cache['servers'][server] = version
+                self._write_cache(cache)
+            return True
+
+    def update(self, version, server, listing):
+        """
+        Applies the capabilities in the server's api listing, caching them for
+        version (unless it is None).
+        """
+        keys = api_keys(listing)
+        with self.lock:
+            self.version, self.supported = version, frozenset(keys)
+            if version is None:
+                return
+            cache = self._read_cache()
+            cache['versions'][version] = sorted(keys)
+            cache['servers'][server] = version
+            self._write_cache(cache)
@@ -7,7 +7,10 @@ kerminal.commands handles the execution of commands in the Kerminal Command Line
 from .. import __version__
 
 
-from docopt import docopt, DocoptExit
+from docopt import DocoptExit, Dict, Option, AnyOptions, Command, TokenStream, \
+                   printable_usage, parse_defaults, parse_pattern, formal_usage,\
+                   parse_argv, extras
+from functools import lru_cache
 #from functools import wraps, partial
 import logging
 #import os
@@ -24,6 +27,46 @@ log = logging.getLogger('kerminal.commands')
 from functools import wraps
 
 
+class CommandGrammar(object):
+    """
+    The docopt usage grammar of a command docstring, parsed a single time so
+    that each invocation of the command only has to match its arguments.
+
+    The parse method behaves like docopt.docopt, which would otherwise re-parse
+    the whole docstring on every call.
+    """
+    def __init__(self, doc):
+        self.doc = doc
+        self.usage = printable_usage(doc)
+        self.options = parse_defaults(doc)
+        self.pattern = parse_pattern(formal_usage(self.usage), self.options)
+        pattern_options = set(self.pattern.flat(Option))
+        for ao in self.pattern.flat(AnyOptions):
+            ao.children = list(set(self.options) - pattern_options)
+        self.pattern.fix()
+
+    def parse(self, argv, help=True, version=None, options_first=False):
+        DocoptExit.usage = self.usage
+        #parse_argv may append unknown options, so it must get its own list
+        argv = parse_argv(TokenStream(argv, DocoptExit), list(self.options),
+                          options_first)
+        extras(help, version, argv, self.doc)
+        matched, left, collected = self.pattern.match(argv)
+        if matched and left == []:
+            #Defaults come from the shared pattern, lists must not be shared
+            return Dict((a.name, list(a.value) if type(a.value) is list else a.value)
+                        for a in (self.pattern.flat() + collected))
+        raise DocoptExit()
+
+
+@lru_cache(maxsize=None)
+def command_grammar(doc):
+    """
+    Returns the CommandGrammar for a command docstring, parsing it on first use.
+    """
+    return CommandGrammar(doc)
+
+
 def invalid_if_not_connected(f):
     @wraps(f)
     def wrapper(args, widget_proxy, form, stream):
@@ -32,12 +75,17 @@ def invalid_if_not_connected(f):
             return
         else:
             return f(args, widget_proxy, form, stream)
+    #Marks commands which communicate with the server
+    wrapper.requires_connection = True
     return wrapper
 
 
 from . import mechjeb
 from . import basic
 from . import logs
+from . import schedule
+from . import alerts
+from . import plugins
 
 
 class KerminalCommands(object):
@@ -54,6 +102,8 @@ class KerminalCommands(object):
 
         self._commands = {'abort': basic.abort,
                           'action': basic.action,
+                          'alert': alerts.alert,
+                          'at': schedule.at,
                           'brakes': basic.brakes,
                           'connect': basic.connect,
                           'disconnect': basic.disconnect,
@@ -63,6 +113,7 @@ class KerminalCommands(object):
                           'help': self.helps,
                           'lights': basic.lights,
                           'log': logs.logs,
+                          'plugins': plugins.plugins,
                           'rate': basic.rate,
                           'rcs': basic.rcs,
                           'sas': basic.sas,
@@ -72,35 +123,83 @@ class KerminalCommands(object):
                           'text': basic.text,
                           'telemetry': basic.telemetry,
                           'throttle': basic.throttle,
+                          'when': schedule.when,
                           'quit': basic.quits,
                           'exit': basic.quits,  # overlaps with quit
                           }
 
+        #Commands added by plugins, listed separately in help
+        self._plugin_commands = []
+
+        self._completer = None
+
+    def add_commands(self, commands):
+        """
+        Adds commands, as {name: command function}, from plugins. Commands
+        already defined are not replaced.
+        """
+        for name, command_func in commands.items():
+            if name in self._commands:
+                log.warning('Plugin command "{0}" conflicts with an existing command'.format(name))
+                continue
+            self._commands[name] = command_func
+            self._plugin_commands.append(name)
+        self._completer = None  # Rebuilt with the new commands
+
+    @property
+    def completer(self):
+        """
+        The CommandCompleter for the command line, built on first use.
+        """
+        if self._completer is None:
+            from ..completion import CommandCompleter
+            subcommands = {}
+            for name, command_func in self._commands.items():
+                pattern = command_grammar(command_func.__doc__).pattern
+                subcommands[name] = set(c.name for c in pattern.flat(Command)
+                                        if c.name != name)
+            self._completer = CommandCompleter(subcommands,
+                                               self.form.parent_app.stream.data)
+        return self._completer
+
     def process_command_complete(self, command_line, control_widget_proxy):
         for comm in command_line.split(';'):
             argv = comm.split()
-            try:
-                command = argv.pop(0)
-            except IndexError:
+            if not argv:
                 return
-            command_func = self._commands.get(command)
-            if command_func is None:
-                self.form.error('command "{}" not recognized. See "help"'.format(command))
+            if argv[0] not in self._commands:
+                self.form.error('command "{}" not recognized. See "help"'.format(argv[0]))
                 return
-            try:
-                args = docopt(command_func.__doc__,
-                              version='Kerminal v {}'.format(__version__),
-                              argv=argv,
-                              options_first=True
-                              )  # Allow negative numbers as arguments in options
-            except DocoptExit as e:
-                self.form.error('command usage incorrect. See "help {}"'.format(command))
-                log.debug(e)
-            else:
-                command_func(args,
-                             control_widget_proxy,
-                             self.form,
-                             self.form.parent_app.stream)
+            self.execute(argv,
+                         control_widget_proxy,
+                         self.form,
+                         self.form.parent_app.stream)
+
+    def execute(self, argv, control_widget_proxy, form, stream):
+        """
+        Executes a single command, given as a list of words, against the given
+        form and stream. Returns True if the command was run.
+        """
+        command, argv = argv[0], argv[1:]
+        command_func = self._commands.get(command)
+        if command_func is None:
+            form.error('command "{}" not recognized. See "help"'.format(command))
+            return False
+        try:
+            grammar = command_grammar(command_func.__doc__)
+            args = grammar.parse(argv,
+                                 version='Kerminal v {}'.format(__version__),
+                                 options_first=True
+                                 )  # Allow negative numbers as arguments in options
+        except DocoptExit as e:
+            form.error('command usage incorrect. See "help {}"'.format(command))
+            log.debug(e)
+            return False
+        command_func(args,
+                     control_widget_proxy,
+                     form,
+                     stream)
+        return True
 
     def helps(self, args, widget_proxy, form, stream):
         """\
@@ -136,9 +235,13 @@ abort
  -- Send signal to craft to execute Abort.
 action <number>
  -- Send signal to craft to execute an Action Group command.
+alert ([--severity=<level>] [--band=<width>] <condition> | list | clear | cancel <number>)
+ -- Raise an alert when the craft's data goes beyond a limit.
+at (<time> <command>... | list | clear | cancel <number>)
+ -- Schedule a command to run at a universal or mission time.
 brakes (off | on)
  -- Enable or disable landing gear brakes.
-connect <host-address> [<port>]
+connect [--timeout=<seconds>] <host-address> [<port>]
  -- Connect to a Telemachus server if not already connected.
 disconnect
  -- Disconnect from the Telemachus server if currently connected.
@@ -152,6 +255,8 @@ lights (off | on)
  -- Turn the craft's lights on or off.
 log [commands]
  -- Utilities for logging data to file; see "help log" for in depth details.
+plugins
+ -- Show the installed plugins and how their consumers are keeping up.
 rcs (off | on)
  -- Enable or disable the craft's RCS.
 sas (off | on)
@@ -168,7 +273,11 @@ text
  -- Shows the most recent text on screen.
 throttle (up | down | <percent>)
  -- Set the throttle of the craft to <percent>, or increment by +/-10%
+when ([--repeat] <condition> do <command>... | list | clear | cancel <number>)
+ -- Execute a command when a condition on the craft's data becomes true.
 quit
  -- Shut down Kerminal.
 '''.format(version=__version__)
+            if self._plugin_commands:
+                help_msg += '\nPlugin commands: {0}\n'.format(', '.join(sorted(self._plugin_commands)))
         form.show_text(msg=help_msg)
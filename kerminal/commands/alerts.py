@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+"""
+Commands for limit alerts on the craft's data
+"""
+
+import logging
+
+from ..alerts import SEVERITIES
+
+log = logging.getLogger('kerminal.commands')
+
+
+def _remove_alert(stream, alert):
+    #The alert's keys are subscribed again for each new connection, until it
+    #and its subscriptions are removed together
+    with stream.subscription_lock:
+        if not stream.alerts.remove(alert.number):
+            return False
+        for key in alert.keys:
+            stream.subscription_manager.drop(key)
+        return True
+
+
+def _describe(alert, data):
+    values = ', '.join('{0:.6g}'.format(v) for v in alert.values(data))
+    return 'Alert {0}: {1} ({2})'.format(alert.number, alert.condition, values)
+
+
+def alert(args, widget_proxy, form, stream):
+    """\
+alert
+
+Raise an alert when the craft's data goes beyond a limit.
+
+Usage:
+  alert list
+  alert clear
+  alert cancel <number>
+  alert [--severity=<level>] [--band=<width>] <words>...
+
+Arguments:
+  <words>      The condition, comparisons of api variables with numbers joined
+               by "and", as in "v.heightFromTerrain < 100 and
+               v.verticalSpeed < -20".
+  <number>     The number of an alert, as shown by "alert list".
+
+Options:
+  -s --severity=<level>  How the alert is shown: warning, error or critical.
+                         [default: warning]
+  -b --band=<width>      The hysteresis band; a comparison which has become
+                         true only becomes false again once its value is this
+                         far back past the threshold. [default: 0]
+
+Commands:
+  list      Show the alerts and whether they are raised.
+  clear     Remove all of the alerts.
+  cancel    Remove a single alert.
+
+The comparisons are "<", "<=", ">" and ">=". A threshold ending in "%" compares
+a resource with its maximum, as in "r.resource[ElectricCharge] < 20%", and its
+band is in percent too. Alerts are checked with every message from the server;
+each is shown in the status line when its condition becomes true, and again
+when it is cleared.
+
+Examples:
+  alert --severity=critical v.geeForce > 6
+  alert --band=5 r.resource[ElectricCharge] < 20%
+  alert -s error v.heightFromTerrain < 100 and v.verticalSpeed < -20
+    """
+
+    alerts = stream.alerts
+
+    if args['list']:
+        lines = ['{:>4}  {:<8}  {:<6}  {}{}'.format(a.number,
+                                                   a.severity,
+                                                   'RAISED' if a.raised else '',
+                                                   a.condition,
+                                                   ', band {:g}'.format(a.band) if a.band else '')
+                 for a in alerts.pending()]
+        form.show_text(msg='Alerts\n\n' + ('\n'.join(lines) or 'None'))
+        return
+
+    if args['clear']:
+        for pending in alerts.pending():
+            _remove_alert(stream, pending)
+        form.info('Cleared all alerts')
+        return
+
+    if args['cancel']:
+        try:
+            number = int(args['<number>'])
+        except ValueError:
+            form.error('Alert number must be an integer')
+            return
+        pending = alerts.alerts.get(number)
+        if pending is not None and _remove_alert(stream, pending):
+            form.info('Cancelled alert {}'.format(number))
+        else:
+            form.warning('No alert {}'.format(number))
+        return
+
+    add_alert(args, widget_proxy, form, stream)
+
+
+def add_alert(args, widget_proxy, form, stream):
+    condition = ' '.join(args['<words>'])
+    severity = args['--severity'].lower()
+    if severity not in SEVERITIES:
+        form.error('Severity must be one of {}'.format(', '.join(SEVERITIES)))
+        return
+    try:
+        band = float(args['--band'])
+    except ValueError:
+        form.error('Band must be a number')
+        return
+
+    def notify(alert, raised):
+        #Called from the communication thread
+        if raised:
+            form.post_event(getattr(form, alert.severity),
+                            _describe(alert, stream.data))
+        else:
+            form.post_event(form.info, 'Alert {} cleared'.format(alert.number))
+
+    with stream.subscription_lock:
+        try:
+            new_alert = stream.alerts.add(condition, severity, band, notify)
+        except ValueError as e:
+            form.error('Could not understand alert "{}": {}'.format(condition, e))
+            return
+
+        unsupported = [key for key in new_alert.keys
+                       if not stream.capabilities.supports(key)]
+        if unsupported:
+            stream.alerts.remove(new_alert.number)
+            form.error('Not supported by the server: {}'.format(', '.join(unsupported)))
+            return
+
+        for key in new_alert.keys:
+            stream.subscription_manager.add(key)
+    log.info('Alert {} added: {} ({})'.format(new_alert.number, condition, severity))
+    form.info('Added alert {}'.format(new_alert.number))
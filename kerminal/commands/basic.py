@@ -94,13 +94,20 @@ connect
 Connect to a Telemachus server if not already connected.
 
 Usage:
-  connect <host-address> [<port>]
+  connect [--timeout=<seconds>] <host-address> [<port>]
 
 Arguments:
   <host-address>    The address of the computer acting as Telemachus server.
   <port>            The port for the connection. If not supplied, this command
                     will use the Telemachus default of 8085.
 
+Options:
+  -t --timeout=<seconds>    Give up on the connection after this many seconds.
+                            [default: 10]
+
+The connection is made in the background; other commands may be used while it
+is in progress and the result will be shown in the status line.
+
 Discussion and Examples:
 
 If you are using Kerminal on the same computer running Kerbal Space Program and
@@ -124,6 +131,10 @@ One will also likely need to configure port forwarding for the port being used.
         form.warning('Could not connect, already connected to a server!')
         return
 
+    if stream.make_connection.is_set():
+        form.warning('Could not connect, a connection is already in progress!')
+        return
+
     if args['<port>'] is None:
         port = 8085
     else:
@@ -133,24 +144,21 @@ One will also likely need to configure port forwarding for the port being used.
             form.error('Port must be a number')
             return
 
-    #Instructions to the Communication Thread to make the connection
+    try:
+        timeout = float(args['--timeout'])
+    except ValueError:
+        form.error('Timeout must be a number')
+        return
+
+    #Instructions to the Communication Thread to make the connection; the
+    #result is delivered to the form by the thread's connection listeners
     stream.address = args['<host-address>']
     stream.port = port
-    stream.make_connection.set()
-
-    form.info('Making connection to {}:{}'.format(args['<host-address>'],
-                                                  port))
-
-    #Wait for the Communication Thread to tell us it is done
-    stream.connect_event.wait()
+    stream.connect_timeout = timeout
     stream.connect_event.clear()
+    stream.make_connection.set()
 
-    if not stream.connected:  # Failed
-        form.error('Could not connect')
-    else:
-        form.info('Connected!')
-
-    form.show_smart()
+    form.connecting(args['<host-address>'], port)
 
 
 def disconnect(args, widget_proxy, form, stream):
@@ -164,7 +172,7 @@ Usage:
     """
     log.info('disconnect command called')
     if stream.loop is not None:
-        stream.loop.stop()
+        stream.close_connection()
         stream.make_connection.clear()
     else:
         form.warning('Not currently connected!')
@@ -7,7 +7,7 @@
 import logging
 import os
 
-from ..telemachus_api import plotables
+from ..telemachus_api import plotables, API
 
 log = logging.getLogger('kerminal.commands')
 log.debug('commands')
@@ -82,7 +82,7 @@ Variables To Log   : {}
                                    args['file'],
                                    args['add'],
                                    args['remove']]):
-        form.wInfo.feed = 'Parameters can\'t be changed while log is active'
+        form.warning('Parameters can\'t be changed while log is active')
         return
 
     #File cannot be changed while logging is on, but can be used
@@ -124,13 +124,23 @@ Variables To Log   : {}
         return
 
     if args['all']:
-        for var in ['t.universalTime', 'v.missionTime', 'sys.time'] + plotables:
+        #Only those the server is known to support, when that is known
+        for var in stream.capabilities.filter(['t.universalTime', 'v.missionTime',
+                                               'sys.time'] + plotables):
             stream.data_log_vars.add(var)
 
         return
 
     if args['add']:
         for var in args['<api-variable>']:
+            if API.is_action(var):
+                form.error('"{0}" is an action, it has no value to log'.format(var))
+                continue
+            if not stream.capabilities.supports(var):
+                form.error('"{0}" is not supported by the server'.format(var))
+                continue
+            if var not in API:  # It may still be known to the server
+                form.warning('"{0}" is not a known api variable'.format(var))
             stream.data_log_vars.add(var)
             #stream.subscription_manager.add(var)
 
@@ -140,7 +150,7 @@ Variables To Log   : {}
                 stream.data_log_vars.remove(var)
                 #stream.data_log_vars.discard(var)
             except KeyError:
-                form.wInfo.feed = 'Log variable already not in use'
+                form.warning('Log variable already not in use')
             else:
                 stream.subscription_manager.drop(var)
 
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+"""
+Commands for the installed plugins
+"""
+
+import logging
+
+log = logging.getLogger('kerminal.commands')
+
+
+def plugins(args, widget_proxy, form, stream):
+    """\
+plugins
+
+Show the installed plugins, and how well their consumers keep up with the
+data from the server.
+
+Usage:
+  plugins
+
+For each consumer this shows where it runs (its own thread or process), the
+frames it has consumed, dropped because it fell behind, and failed on, the CPU
+time it has spent, its lag (the time from a frame's arrival to its
+consumption) for the last frame and at worst, and the frames waiting for it.
+    """
+
+    manager = stream.plugins
+    lines = []
+    if manager.workers:
+        lines.append('{:<20} {:<7} {:>9} {:>8} {:>6} {:>8} {:>8} {:>8} {:>7}'.format(
+                     'Name', 'Mode', 'Consumed', 'Dropped', 'Errors', 'CPU s',
+                     'Lag ms', 'Max ms', 'Waiting'))
+    for worker in manager.workers:
+        stats = worker.stats
+        lines.append('{:<20} {:<7} {:>9} {:>8} {:>6} {:>8.2f} {:>8.1f} {:>8.1f} {:>7}'.format(
+                     worker.name[:20], worker.mode, stats.consumed, stats.dropped,
+                     stats.errors, stats.cpu, stats.lag * 1000,
+                     stats.max_lag * 1000, worker.backlog()))
+    commands = sorted(manager.commands)
+    if commands:
+        lines.extend(['', 'Commands: ' + ', '.join(commands)])
+    for name, reason in sorted(manager.failed.items()):
+        lines.append('{0} could not be loaded: {1}'.format(name, reason))
+    form.show_text(msg='Plugins\n\n' + ('\n'.join(lines) or 'None installed'))
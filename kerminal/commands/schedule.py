@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+
+"""
+Commands for deferring other commands until a time on the game clock, or until
+a condition on the craft's data, has been reached
+"""
+
+import logging
+
+from . import invalid_if_not_connected
+from .. import utils
+from ..triggers import compile_condition
+
+log = logging.getLogger('kerminal.commands')
+
+
+class _MessageCapture(list):
+    """
+    Stands in for the message queue, keeping the messages a command would send.
+    """
+    def put(self, item):
+        self.append(item)
+
+
+class _CaptureStream(object):
+    def __init__(self, stream):
+        self._stream = stream
+        self.msg_queue = _MessageCapture()
+        self.callbacks = []
+
+    def add_callback(self, callback_func):
+        #Responses are only expected once the messages are really sent
+        self.callbacks.append(callback_func)
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+class _CaptureForm(object):
+    #Informational messages describe sending, which is not yet happening
+    def __init__(self, form):
+        self._form = form
+
+    def info(self, msg):
+        pass
+
+    def __getattr__(self, name):
+        return getattr(self._form, name)
+
+
+def parse_deadline(time_string, stream):
+    """
+    Returns a (clock, deadline) pair from a time string of the form
+    "T+<time>" (mission time), "+<time>" (universal time from now), or "<time>"
+    (universal time). Raises ValueError for anything else.
+    """
+    if time_string.upper().startswith('T+'):
+        return 'met', utils.parse_duration(time_string[2:])
+    elif time_string.startswith('+'):
+        now = stream.data.get('t.universalTime')
+        if not isinstance(now, (int, float)):
+            raise ValueError('universal time is not yet known')
+        return 'ut', now + utils.parse_duration(time_string[1:])
+    else:
+        return 'ut', utils.parse_duration(time_string)
+
+
+def at(args, widget_proxy, form, stream):
+    """\
+at
+
+Schedule a command to be executed when the game clock reaches a given time.
+
+Usage:
+  at list
+  at clear
+  at cancel <number>
+  at <time> <command>...
+
+Arguments:
+  <time>       When to execute the command, one of:
+                 "T+<time>"   mission time, as in "T+90" or "T+1m30s"
+                 "+<time>"    universal time relative to now, as in "+45"
+                 "<time>"     absolute universal time, as in "1234567.5"
+               Times are in seconds, or use the units "d", "h", "m", "s".
+  <command>    Any command which sends messages to the craft, with its
+               arguments, such as "stage" or "throttle 50".
+  <number>     The number of a scheduled command, as shown by "at list".
+
+Commands:
+  list      Show the commands waiting to be executed.
+  clear     Remove all of the commands waiting to be executed.
+  cancel    Remove a single command waiting to be executed.
+
+The command is checked when scheduled and sent to the server with the first
+message from the server at or beyond its time, so precision depends on the
+rate (see "help rate"). Note that ";" separates commands, so
+"at T+10 stage; stage" schedules one stage and stages immediately once.
+
+Examples:
+  at T+0 throttle 100
+  at T+3 stage
+  at +60 sa prograde
+    """
+
+    scheduler = stream.scheduler
+
+    if args['list']:
+        lines = ['{:>4}  {:>3}  {:>14.1f}  {}'.format(e.number,
+                                                    e.clock.upper(),
+                                                    e.deadline,
+                                                    e.command)
+                 for e in scheduler.pending()]
+        form.show_text(msg='Scheduled Commands\n\n' + ('\n'.join(lines) or 'None'))
+        return
+
+    if args['clear']:
+        scheduler.clear()
+        form.info('Cleared all scheduled commands')
+        return
+
+    if args['cancel']:
+        try:
+            number = int(args['<number>'])
+        except ValueError:
+            form.error('Scheduled command number must be an integer')
+            return
+        if scheduler.cancel(number):
+            form.info('Cancelled scheduled command {}'.format(number))
+        else:
+            form.warning('No scheduled command {}'.format(number))
+        return
+
+    schedule_command(args, widget_proxy, form, stream)
+
+
+def capture_command(argv, widget_proxy, form, stream):
+    """
+    Executes the command given by argv against a stream which keeps its
+    messages rather than sending them, and returns those messages along with
+    any response callbacks the command registered, as (messages, callbacks).
+    Returns None (after informing the form) if the command cannot be deferred.
+    """
+    command_func = form.action_controller._commands.get(argv[0])
+    if command_func is None:
+        form.error('command "{}" not recognized. See "help"'.format(argv[0]))
+        return None
+    #Only commands that talk to the server make sense, and they are free of
+    #other side effects when executed against the capturing stream
+    if not getattr(command_func, 'requires_connection', False):
+        form.error('"{}" sends nothing to the craft, cannot defer it'.format(argv[0]))
+        return None
+
+    capture = _CaptureStream(stream)
+    if not form.action_controller.execute(argv, widget_proxy,
+                                          _CaptureForm(form), capture):
+        return None
+    if not capture.msg_queue:  # The command will have reported why
+        return None
+    return list(capture.msg_queue), capture.callbacks
+
+
+@invalid_if_not_connected
+def schedule_command(args, widget_proxy, form, stream):
+    argv = args['<command>']
+
+    try:
+        clock, deadline = parse_deadline(args['<time>'], stream)
+    except ValueError as e:
+        form.error('Could not understand time "{}": {}'.format(args['<time>'], e))
+        return
+
+    captured = capture_command(argv, widget_proxy, form, stream)
+    if captured is None:
+        return
+    messages, callbacks = captured
+
+    command = ' '.join(argv)
+
+    def notify(entry):
+        #Called from the communication thread
+        for callback in callbacks:
+            stream.add_callback(callback)
+        form.post_event(form.info, 'Executed scheduled command "{}"'.format(command))
+
+    log.info('Scheduling {} at {} {}'.format(command, clock, deadline))
+    entry = stream.scheduler.schedule(clock, deadline, command, messages, notify)
+    form.info('Scheduled "{}" as number {}'.format(command, entry.number))
+
+
+def _drop_trigger_subscriptions(stream, trigger):
+    with stream.subscription_lock:
+        for key in trigger.keys:
+            stream.subscription_manager.drop(key)
+
+
+def _remove_trigger(stream, trigger):
+    #The trigger's keys are subscribed again for each new connection, until it
+    #and its subscriptions are removed together
+    with stream.subscription_lock:
+        if not stream.triggers.remove(trigger.number):
+            return False
+        _drop_trigger_subscriptions(stream, trigger)
+        return True
+
+
+def when(args, widget_proxy, form, stream):
+    """\
+when
+
+Execute a command when a condition on the craft's data becomes true.
+
+Usage:
+  when list
+  when clear
+  when cancel <number>
+  when [--repeat] <words>...
+
+Arguments:
+  <words>      The condition and the command, separated by "do", as in
+               "when v.altitude > 70000 and o.ApA > 80000 do stage".
+  <number>     The number of a trigger, as shown by "when list".
+
+Options:
+  -r --repeat    Execute the command each time the condition becomes true,
+                 rather than only the first time.
+
+Commands:
+  list      Show the triggers waiting to be executed.
+  clear     Remove all of the triggers.
+  cancel    Remove a single trigger.
+
+Conditions may use any api variable, numbers, the comparisons "<", "<=", ">",
+">=", "==", "!=", arithmetic with "+", "-", "*", "/", "%", "**", and the
+logical "and", "or", "not". Conditions are checked only when one of their
+api variables changes, and the command is sent with the message that made the
+condition true. The command may be any command which sends messages to the
+craft; it is checked when the trigger is created.
+
+Examples:
+  when v.altitude > 70000 and o.ApA > 80000 do stage
+  when r.resource[LiquidFuel] < 1 do stage
+  when --repeat v.verticalSpeed < -50 do gear down
+    """
+
+    triggers = stream.triggers
+
+    if args['list']:
+        lines = ['{:>4}  {}{} do {}'.format(t.number,
+                                            '(repeat) ' if t.repeat else '',
+                                            t.condition,
+                                            t.command)
+                 for t in triggers.pending()]
+        form.show_text(msg='Triggers\n\n' + ('\n'.join(lines) or 'None'))
+        return
+
+    if args['clear']:
+        for trigger in triggers.pending():
+            _remove_trigger(stream, trigger)
+        form.info('Cleared all triggers')
+        return
+
+    if args['cancel']:
+        try:
+            number = int(args['<number>'])
+        except ValueError:
+            form.error('Trigger number must be an integer')
+            return
+        trigger = triggers.triggers.get(number)
+        if trigger is not None and _remove_trigger(stream, trigger):
+            form.info('Cancelled trigger {}'.format(number))
+        else:
+            form.warning('No trigger {}'.format(number))
+        return
+
+    add_trigger(args, widget_proxy, form, stream)
+
+
+@invalid_if_not_connected
+def add_trigger(args, widget_proxy, form, stream):
+    words = args['<words>']
+    if 'do' not in words:
+        form.error('Missing "do" between condition and command. See "help when"')
+        return
+    split = words.index('do')
+    condition, argv = ' '.join(words[:split]), words[split + 1:]
+    if not condition or not argv:
+        form.error('Both a condition and a command are needed. See "help when"')
+        return
+
+    try:
+        compile_condition(condition)
+    except ValueError as e:
+        form.error('Could not understand condition "{}": {}'.format(condition, e))
+        return
+
+    captured = capture_command(argv, widget_proxy, form, stream)
+    if captured is None:
+        return
+    messages, callbacks = captured
+
+    command = ' '.join(argv)
+
+    def notify(trigger):
+        #Called from the communication thread
+        for callback in callbacks:
+            stream.add_callback(callback)
+        form.post_event(form.info, 'Trigger {} executed "{}"'.format(trigger.number,
+                                                                    command))
+        if not trigger.repeat:
+            _drop_trigger_subscriptions(stream, trigger)
+
+    with stream.subscription_lock:
+        trigger = stream.triggers.add(condition, command, messages,
+                                      repeat=args['--repeat'], notify=notify)
+        for key in trigger.keys:
+            stream.subscription_manager.add(key)
+    log.info('Trigger {} added: {} do {}'.format(trigger.number, condition, command))
+    form.info('Added trigger {}'.format(trigger.number))
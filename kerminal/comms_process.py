@@ -0,0 +1,241 @@
+# encoding: utf-8
+
+"""
+Runs the communication stack in a child process, so that the handling of the
+server's messages and the drawing of the user interface do not contend for one
+interpreter (and its GIL), and each may have a core of its own.
+
+The child process runs an ordinary CommsThread: the websocket client, the
+decoding and parsing of messages, the locally computed channels and the data
+log. It forwards each message, decoded, through a pipe to ProcessCommsThread,
+which stands in for the CommsThread in the user interface's process and does
+the rest: callbacks, watchers, scheduled commands, triggers, alerts, the relay,
+the shared memory segment and plugins. Items for the server, and the data log
+settings, go the other way.
+
+Messages on the pipe are tuples, to the child:
+  ('connect', address, port, timeout)
+  ('close',)
+  ('item', item)        An item of the MSG_QUEUE, subscriptions or messages
+  ('send', message)     A message to send at once
+  ('log', on, file, variables)
+and from the child:
+  ('state', connected, reason)   A connection attempt has resolved
+  ('frame', msg)
+  ('counters', counters, version)
+  ('closed',)
+"""
+
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+
+from . import communication
+from .communication import CommsThread
+
+log = logging.getLogger('kerminal.comms_process')
+
+#Seconds between the child's updates of its counters
+COUNTERS_INTERVAL = 1.0
+
+#Counters of the child process copied to the user interface's
+COUNTERS = ('decode_failures', 'log_rows_written', 'log_rows_dropped')
+
+
+class ChildCommsThread(CommsThread):
+    """
+    The CommsThread of the child process. Subscriptions arrive from the user
+    interface's process already counted, and the data log variables are set
+    by it too.
+    """
+    def __init__(self, pipe, loop_factory=None):
+        super(ChildCommsThread, self).__init__(loop_factory=loop_factory)
+        self.pipe = pipe
+        self.next_counters = 0.0
+
+    def new_subscriptions(self):
+        self.subscription_manager = communication.SubscriptionManager(self.msg_queue,
+                                                                      lock=self.subscription_lock)
+        self.data_log_vars = communication.DATA_LOG_VARS = []
+
+    def send_counters(self):
+        self.next_counters = time.monotonic() + COUNTERS_INTERVAL
+        self.pipe.send(('counters',
+                        {name: getattr(self.metrics, name) for name in COUNTERS},
+                        self.capabilities.version))
+
+    def forward(self, msg):
+        #Called in the communication thread, which alone sends to the pipe
+        self.pipe.send(('frame', msg))
+        if time.monotonic() >= self.next_counters:
+            self.send_counters()
+
+    def reset_connection(self):
+        super(ChildCommsThread, self).reset_connection()
+        self.send_counters()
+        self.pipe.send(('closed', ))
+
+
+def _child_main(pipe, loop_factory):
+    stream = ChildCommsThread(pipe, loop_factory)
+    communication.FORWARD = stream.forward
+    stream.connection_listeners.append(
+        lambda connected, reason: pipe.send(('state', connected, reason)))
+    stream.start()
+
+    while True:
+        try:
+            command = pipe.recv()
+        except (EOFError, OSError):  # The user interface has gone
+            stream.close_connection()
+            return
+        kind = command[0]
+        if kind == 'item':
+            item = command[1]
+            if isinstance(item, dict):
+                stream.msg_queue.put(item)
+            elif item[0] == '+':
+                stream.subscription_manager.add(item[1])
+            else:
+                stream.subscription_manager.drop(item[1])
+        elif kind == 'send':
+            loop, protocol = stream.loop, stream.protocol
+            if loop is not None and protocol is not None:
+                loop.call_soon_threadsafe(protocol.send_json_message, command[1])
+        elif kind == 'log':
+            _, stream.data_log_on, stream.data_log_file, variables = command
+            stream.data_log_vars = communication.DATA_LOG_VARS = variables
+        elif kind == 'connect':
+            _, stream.address, stream.port, stream.connect_timeout = command
+            stream.connect_event.clear()
+            stream.make_connection.set()
+        elif kind == 'close':
+            stream.close_connection()
+
+
+class ProcessCommsThread(CommsThread):
+    """
+    Stands in for the CommsThread, with the connection held by a child
+    process. `loop` is not an event loop here, but is set while a connection
+    is being made or is held, as for the CommsThread.
+    """
+
+    #The child computes the local keys, subscribing to their inputs
+    local_providers = ()
+
+    def __init__(self, *args, **kwargs):
+        super(ProcessCommsThread, self).__init__(*args, **kwargs)
+        self.pipe = None
+        self.child = None
+        self.pipe_lock = threading.Lock()  # Several threads send to the child
+        self.log_state = None  # The data log settings last sent to the child
+
+    def start_child(self):
+        #Spawned, rather than forked from a process with threads and a terminal
+        context = multiprocessing.get_context('spawn')
+        self.pipe, child_pipe = context.Pipe()
+        #The loop factory is pickled, so must be a function or a partial
+        self.child = context.Process(target=_child_main,
+                                     args=(child_pipe, self.loop_factory),
+                                     name='kerminal comms')
+        self.child.daemon = True
+        self.child.start()
+        child_pipe.close()
+        self.log_state = None
+        log.info('Communication process {0} started'.format(self.child.pid))
+
+    def send_child(self, command):
+        with self.pipe_lock:
+            try:
+                self.pipe.send(command)
+            except (OSError, ValueError) as e:  # The child has gone
+                log.debug('Could not send to the communication process: {0}'.format(e))
+
+    def send_json_message(self, message_dict):
+        self.send_child(('send', message_dict))
+
+    def sync_log(self, force=False):
+        state = (self.data_log_on, self.data_log_file, list(self.data_log_vars))
+        if force or state != self.log_state:
+            self.log_state = state
+            self.send_child(('log', ) + state)
+
+    def forward_queue(self):
+        #Items for the server are passed to the child as they are put, and the
+        #data log settings whenever they change
+        while True:
+            try:
+                item = self.msg_queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+            else:
+                self.send_child(('item', item))
+            self.sync_log()
+
+    def run(self):
+        self.start_child()
+        forwarder = threading.Thread(target=self.forward_queue, name='comms forwarder')
+        forwarder.daemon = True
+        forwarder.start()
+        while True:
+            self.make_connection.wait()
+            if not self.child.is_alive():
+                log.error('Communication process exited, starting another')
+                self.start_child()
+            self.connect()
+
+    def connect(self):
+        self.loop = self.pipe
+        self.capabilities.expect(self.server)
+        self.alerts.reset()
+        self.sync_log(force=True)
+        self.send_child(('connect', self.address, self.port, self.connect_timeout))
+        version = None
+        while True:
+            try:
+                message = self.pipe.recv()
+            except (EOFError, OSError):
+                log.error('Communication process lost')
+                if not self.connected:
+                    self.connect_failed('communication process lost')
+                    return
+                break
+            kind = message[0]
+            if kind == 'frame':
+                self.metrics.frames_received += 1
+                communication.dispatch_message(message[1], self.send_json_message,
+                                               self.local_providers)
+            elif kind == 'counters':
+                _, counters, child_version = message
+                for name, value in counters.items():
+                    setattr(self.metrics, name, value)
+                if child_version != version:
+                    #Discovered, and cached, by the child
+                    version = child_version
+                    if version is not None:
+                        self.capabilities.load(version, self.server)
+            elif kind == 'state':
+                _, connected, reason = message
+                if not connected:
+                    self.connect_failed(reason)
+                    return
+                self.connected = True
+                self.connect_event.set()
+                self.notify_connection_listeners(True, None)
+            elif kind == 'closed':
+                break
+        self.reset_connection()
+
+    def connect_failed(self, reason):
+        self.connected = False
+        self.loop = None
+        self.make_connection.clear()
+        self.connect_event.set()
+        self.notify_connection_listeners(False, reason)
+
+    def close_connection(self):
+        if self.loop is None:
+            return
+        self.send_child(('close', ))
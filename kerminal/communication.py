@@ -1,8 +1,8 @@
 # encoding: utf-8
 
-from .telemachus_api import plotables
+from .telemachus_api import plotables, API
 
-import asyncio
+import atexit
 import collections
 import json
 import logging
@@ -10,23 +10,186 @@ import threading
 import queue
 import time
 
-from autobahn.asyncio.websocket import WebSocketClientProtocol,\
-                                       WebSocketClientFactory
-
 log = logging.getLogger('kerminal.communication')
 #log.setLevel(logging.DEBUG)
 
 #Initialize all plotable variables in the dict
 global LIVE_DATA
-LIVE_DATA = {k: 'None' for k in plotables}
+LIVE_DATA = {k: None for k in plotables}
+
+
+class OutboundQueue(queue.Queue):
+    """
+    The queue of items for the server: subscription changes as (action, key)
+    tuples and message dicts. Putting an item wakes the consumer on the event
+    loop, if one has installed a wakeup function.
+    """
+    def __init__(self, *args, **kwargs):
+        super(OutboundQueue, self).__init__(*args, **kwargs)
+        self.wakeup = None
+
+    def put(self, item, block=True, timeout=None):
+        super(OutboundQueue, self).put(item, block, timeout)
+        wakeup = self.wakeup
+        if wakeup is not None:
+            try:
+                wakeup()
+            except RuntimeError:  # The loop has closed
+                pass
+
+    def drain(self):
+        items = []
+        while True:
+            try:
+                items.append(self.get_nowait())
+            except queue.Empty:
+                return items
 
 global MSG_QUEUE
-MSG_QUEUE = queue.Queue()
+MSG_QUEUE = OutboundQueue()
+
+#Actions which go out ahead of everything else
+EMERGENCY_ACTIONS = frozenset(['f.abort', 'f.stage'])
+
+#Seconds to wait for the rest of a burst of non-emergency items, so that they
+#go out together, and the longest the consumer sleeps without being woken
+OUTBOUND_BATCH_WINDOW = 0.01
+OUTBOUND_IDLE = 0.1
+
+#Subscribed at each connection, and not counted by the SubscriptionManager
+CONNECTION_KEYS = ['v.name', 'p.paused', 't.universalTime', 'v.missionTime']
+
+
+class OutboundLanes(object):
+    """
+    Sorts outbound items into priority lanes, and composes them into as few
+    messages as possible. Messages come out in lane order: emergency actions,
+    then control (other actions, and any other message content), then
+    subscription changes.
+    """
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.emergency = []
+        self.control = []
+        self.other = []  # Non-run message contents, sent in order
+        self.subscriptions = collections.OrderedDict()  # key -> action
+
+    def __bool__(self):
+        return bool(self.emergency or self.control or self.other or
+                    self.subscriptions)
+
+    def add(self, item):
+        if isinstance(item, dict):
+            item = dict(item)
+            for action in item.pop('run', []):
+                if action.split('[', 1)[0] in EMERGENCY_ACTIONS:
+                    self.emergency.append(action)
+                else:
+                    self.control.append(action)
+            if item:
+                self.other.append(item)
+        else:
+            action, key = item
+            if action == '+' and not CAPABILITIES.allows(key):
+                if CAPABILITIES.known:
+                    log.warning('Not subscribing to {0}, unsupported by Telemachus {1}'.format(key, CAPABILITIES.version))
+                else:  # Sent once the capabilities are confirmed
+                    log.debug('Not subscribing to {0} until the capabilities of Telemachus are confirmed'.format(key))
+                return
+            #Adding and dropping a key in the same tick cancel each other
+            if self.subscriptions.get(key, action) != action:
+                del self.subscriptions[key]
+            else:
+                self.subscriptions[key] = action
+
+    def messages(self):
+        """
+        Returns the list of messages to send, in order, and empties the lanes.
+        """
+        messages = []
+        if self.emergency:
+            messages.append({'run': self.emergency})
+        if self.control:
+            messages.append({'run': self.control})
+        messages.extend(self.other)
+        if self.subscriptions:
+            composition = {}
+            for key, action in self.subscriptions.items():
+                composition.setdefault(action, []).append(key)
+            messages.append(composition)
+        self.clear()
+        return messages
 
 global CALLBACKS
 CALLBACKS = []
 
+#Watchers are called with (key, value) whenever an incoming value differs from
+#the last value received for that key; unlike CALLBACKS they persist
+global WATCHERS
+WATCHERS = {}
+
 from .utils import OrderedSet
+from .scheduling import CommandScheduler
+from .triggers import TriggerEngine
+from .capabilities import Capabilities
+from .derived import DerivedEngine
+from .rolling import RollingStatistics
+from .alerts import AlertEngine
+from .metrics import Metrics
+from .plugins import PluginManager
+
+#Commands waiting on the game clock, checked against each incoming message
+global SCHEDULER
+SCHEDULER = CommandScheduler()
+
+#Commands waiting on conditions, evaluated when their inputs change
+global TRIGGERS
+TRIGGERS = TriggerEngine()
+
+#The api variables the connected server supports, subscriptions to others are
+#not sent
+global CAPABILITIES
+CAPABILITIES = Capabilities()
+
+#Channels computed locally from the incoming data, subscribed like any other
+global DERIVED
+DERIVED = DerivedEngine()
+LIVE_DATA.update((k, None) for k in DERIVED.channels)
+CAPABILITIES.local.update(DERIVED.channels)
+
+#Rolling statistics of any value, as virtual keys such as "v.altitude:rate10s"
+global ROLLING
+ROLLING = RollingStatistics()
+
+#Limit alerts, evaluated against the live data after each message
+global ALERTS
+ALERTS = AlertEngine()
+
+#Internal counters, served by the metrics listener
+global METRICS
+METRICS = Metrics()
+
+#Installed plugins consuming the messages, loaded when Kerminal starts
+global PLUGINS
+PLUGINS = PluginManager()
+
+#The relay re-broadcasting messages to local clients, if one is running
+global RELAY
+RELAY = None
+
+#The shared memory segment publishing the latest values, if one is open
+global SEGMENT
+SEGMENT = None
+
+#Called with each message after it is handled, by the communication process
+#forwarding the messages to the user interface (see kerminal.comms_process)
+global FORWARD
+FORWARD = None
+
+#Providers of keys computed locally, in the order they are evaluated
+LOCAL_PROVIDERS = (DERIVED, ROLLING)
 
 
 class OrderedSetWithSubscriptionHook(OrderedSet):
@@ -54,10 +217,14 @@ class SubscriptionManager(object):
     """
     Basically a set of semaphores, I'm still refining this concept...
     """
-    def __init__(self, queue):
+    def __init__(self, queue, providers=None, lock=None):
         self.map = {}
         self.queue = queue
         self.no_transmit = ['sys.time']
+        #Providers of the keys computed locally, rather than by the server
+        self.providers = LOCAL_PROVIDERS if providers is None else providers
+        #Several threads subscribe, the counts change only while this is held
+        self.lock = threading.RLock() if lock is None else lock
 
     def __len__(self):
         return len(self.map)
@@ -70,26 +237,52 @@ class SubscriptionManager(object):
             yield i
 
     def put(self, action, key):
-        if key not in self.no_transmit:
-            self.queue.put((action, key))
+        if key in self.no_transmit:
+            return
+        for provider in self.providers:
+            if not provider.handles(key):
+                continue
+            #Computed locally, from its subscribed inputs
+            if action == '+':
+                provider.activate(key)
+                for inpt in provider.requirements(key):
+                    self.add(inpt)
+            else:
+                provider.deactivate(key)
+                for inpt in provider.requirements(key):
+                    self.drop(inpt)
+            return
+        self.queue.put((action, key))
 
     def add(self, key):
-        if key in self.map:  # Seen before
-            if self.map[key] == 0:
+        with self.lock:
+            if key in self.map:  # Seen before
+                if self.map[key] == 0:
+                    self.put('+', key)
+                self.map[key] += 1
+            else:  # Not seen before
                 self.put('+', key)
-            self.map[key] += 1
-        else:  # Not seen before
-            self.put('+', key)
-            self.map[key] = 1
+                self.map[key] = 1
 
     #Naming this "drop" for now to help keep interfaces straight in my head
     def drop(self, key):
-        if key in self.map:  # Seen before
-            self.map[key] -= 1
-            if self.map[key] == 0:
-                self.put('-', key)
-        else:
-            pass  # Can't drop what you haven't seen
+        with self.lock:
+            if key in self.map:  # Seen before
+                self.map[key] -= 1
+                if self.map[key] == 0:
+                    self.put('-', key)
+            else:
+                pass  # Can't drop what you haven't seen
+
+    def transmitted(self):
+        """
+        Returns the keys subscribed on the server: those counted, and not
+        computed locally.
+        """
+        with self.lock:
+            return [key for key, count in self.map.items()
+                    if count > 0 and key not in self.no_transmit and
+                    not any(provider.handles(key) for provider in self.providers)]
 
 
 global DATA_LOG_ON, DATA_LOG_VARS, DATA_LOG_FILE
@@ -98,7 +291,155 @@ DATA_LOG_VARS = None  # set to OrderedSetWithSubscriptionHook by CommsThread
 DATA_LOG_FILE = 'kerminaldata.csv'
 
 
-class TelemachusProtocol(WebSocketClientProtocol):
+#The networking stack (asyncio and autobahn) is imported by import_network on
+#the first connection, which keeps it out of Kerminal's start up
+asyncio = None
+WebSocketClientFactory = None
+TelemachusClientProtocol = None
+
+
+def import_network():
+    """
+    Imports the networking stack, and makes TelemachusClientProtocol.
+    """
+    global asyncio, WebSocketClientFactory, TelemachusClientProtocol
+    if TelemachusClientProtocol is not None:
+        return
+    import asyncio
+    from autobahn.asyncio.websocket import WebSocketClientProtocol,\
+                                           WebSocketClientFactory
+    TelemachusClientProtocol = type('TelemachusClientProtocol',
+                                    (TelemachusProtocol, WebSocketClientProtocol),
+                                    {})
+
+
+#Kinds of event loop, "auto" being uvloop if it is installed, else asyncio's
+EVENT_LOOPS = ('auto', 'asyncio', 'uvloop')
+
+
+def new_event_loop(kind='auto'):
+    """
+    Returns a new event loop of the given kind (see EVENT_LOOPS). Raises
+    ImportError if uvloop is asked for but not installed.
+    """
+    if kind not in EVENT_LOOPS:
+        raise ValueError('{0} is not a kind of event loop'.format(kind))
+    if kind != 'asyncio':
+        try:
+            import uvloop
+        except ImportError:
+            if kind == 'uvloop':
+                raise
+        else:
+            return uvloop.new_event_loop()
+    import asyncio
+    return asyncio.new_event_loop()
+
+
+def decode_message(payload):
+    """
+    Returns the message from the server in payload, its values parsed and
+    stamped with "sys.time", or None if it could not be decoded.
+    """
+    global METRICS
+    METRICS.frames_received += 1
+    #Telemachus server should always send text as json
+    try:
+        msg = json.loads(payload.decode('utf-8'))
+    except Exception as e:  # In case of bad encoding or other problems
+        METRICS.decode_failures += 1
+        log.exception(e)
+        log.debug('Could not parse: {0}'.format(payload))
+        return None
+    msg['sys.time'] = time.time()
+    log.debug('Message Received: {0}'.format(msg))
+    #Values are parsed here once, so no consumer need parse them
+    API.parse_message(msg)
+    return msg
+
+
+def _log_column(key):
+    #The data log header gives the units of each column the API knows them for
+    variable = API.get(key)
+    if variable is None or variable.units is None:
+        return key
+    return '{0} [{1}]'.format(key, variable.units)
+
+
+def dispatch_message(msg, send, providers=LOCAL_PROVIDERS):
+    """
+    Hands a decoded message to everything which consumes the data, and updates
+    the live data with it. `send` sends a message to the server at once, for
+    scheduled commands and triggers; providers compute the local values.
+    """
+    global CALLBACKS
+    #Callbacks should generally pop their key out of the message
+    remaining = []
+    for callback in CALLBACKS:
+        found = callback(msg)
+        if not found:
+            remaining.append(callback)
+    CALLBACKS = remaining
+
+    global LIVE_DATA, WATCHERS
+    #Local values join the message, as though sent by the server
+    for provider in providers:
+        provider.update(msg, LIVE_DATA)
+
+    #Only keys with a watcher are compared, so this stays cheap
+    if WATCHERS:
+        for key in WATCHERS.keys() & msg.keys():
+            value = msg[key]
+            if value != LIVE_DATA.get(key):
+                for watcher in WATCHERS.get(key, ()):
+                    watcher(key, value)
+
+    #Triggers must see which of their inputs changed before the update
+    global TRIGGERS
+    triggered = TRIGGERS.candidates(msg, LIVE_DATA) if TRIGGERS else None
+
+    LIVE_DATA.update(msg)
+
+    global SEGMENT
+    if SEGMENT is not None:
+        SEGMENT.publish(msg)
+
+    #Scheduled commands are sent as soon as their time has come
+    global SCHEDULER
+    if SCHEDULER:
+        for entry in SCHEDULER.due(msg):
+            for message in entry.messages:
+                send(message)
+            if entry.notify is not None:
+                entry.notify(entry)
+
+    if triggered:
+        for trigger in TRIGGERS.evaluate(triggered, LIVE_DATA):
+            for message in trigger.messages:
+                send(message)
+            if trigger.notify is not None:
+                trigger.notify(trigger)
+
+    global ALERTS
+    if ALERTS:
+        for alert, raised in ALERTS.evaluate(LIVE_DATA):
+            if alert.notify is not None:
+                alert.notify(alert, raised)
+
+    global RELAY
+    if RELAY is not None:
+        RELAY.publish(msg)
+
+    global PLUGINS
+    if PLUGINS:
+        PLUGINS.publish(msg)
+
+
+class TelemachusProtocol(object):
+    """
+    The handling of the Telemachus datalink, mixed into autobahn's websocket
+    client protocol as TelemachusClientProtocol.
+    """
 
     #def __init__(self, *args, **kwargs):
         #super(TelemachusProtocol, self).__init__(*args, **kwargs)
@@ -122,104 +463,107 @@ class TelemachusProtocol(WebSocketClientProtocol):
         log.debug('WebSocket connect open.')
 
         #Below here are things that should be executed once at each connection
-        self.send_json_message({'+': ['v.name',
-                                      'p.paused',
-                                      't.universalTime',
-                                      'v.missionTime'],
+        self.send_json_message({'+': [key for key in CONNECTION_KEYS
+                                      if CAPABILITIES.allows(key)],
                                 'rate': 200,
                                 })
 
-        @asyncio.coroutine
-        def consume_queue():
+        async def consume_queue():
             global MSG_QUEUE
-            composition = {}
+            loop = asyncio.get_event_loop()
+            wake = asyncio.Event()
+            MSG_QUEUE.wakeup = lambda: loop.call_soon_threadsafe(wake.set)
+            lanes = OutboundLanes()
             while True:
                 try:
-                    item = MSG_QUEUE.get_nowait()
-                except queue.Empty:
-                    if composition:
-                        log.debug(composition)
-                        self.send_json_message(composition)
-                        composition = {}
-                    #The sleep time here could be changed, or I could set this
-                    #up to be signaled by an event
-                    yield from asyncio.sleep(0.1)
-                else:
-                    try:
-                        action, key = item
-                    except ValueError:  # If the item is a dict, send it on
-                        self.send_json_message(item)
-                    else:
-                        if action in composition:
-                            composition[action].append(key)
-                        else:
-                            composition[action] = [key]
-
-        asyncio.Task(consume_queue())
+                    await asyncio.wait_for(wake.wait(), OUTBOUND_IDLE)
+                except asyncio.TimeoutError:
+                    pass
+                wake.clear()
+                for item in MSG_QUEUE.drain():
+                    lanes.add(item)
+                if not lanes:
+                    continue
+                if not lanes.emergency:
+                    #Let the rest of a burst arrive so it goes out as one frame
+                    await asyncio.sleep(OUTBOUND_BATCH_WINDOW)
+                    for item in MSG_QUEUE.drain():
+                        lanes.add(item)
+                for message in lanes.messages():
+                    self.send_json_message(message)
+
+        asyncio.ensure_future(consume_queue())
 
     def onMessage(self, payload, isBinary):
         #The Telemachus server should never send binary data, but just in case
         if isBinary:
             log.debug('Received binary data: {0}'.format(payload))
-        else:
-            #Telemachus server should always send text as json
+            return
+        msg = decode_message(payload)
+        if msg is None:
+            return
+        dispatch_message(msg, self.send_json_message)
+
+        global FORWARD
+        if FORWARD is not None:
+            FORWARD(msg)
+        self.log_data()
+
+    def log_data(self):
+        global DATA_LOG_ON, DATA_LOG_VARS, DATA_LOG_FILE, LIVE_DATA, METRICS
+        if DATA_LOG_ON:  # Logging is enabled
+            #If self.data_log is None, but DATA_LOG_ON is True, then
+            #logging was just enabled and we need to open the file and
+            #write the headers
+            if self.data_log is None:
+                self.data_log = open(DATA_LOG_FILE, 'a', -1)
+                self.data_log.write(';'.join([_log_column(v) for v in DATA_LOG_VARS]) + '\n')
+            #Write the log vars to the file
             try:
-                msg = json.loads(payload.decode('utf-8'))
-            except Exception as e:  # In case of bad encoding or other problems
-                log.exception(e)
-                log.debug('Could not parse: {0}'.format(payload))
-                return
+                self.data_log.write(';'.join([str(LIVE_DATA.get(v)) for v in DATA_LOG_VARS]) + '\n')
+            except OSError as e:  # Such as a full disk
+                METRICS.log_rows_dropped += 1
+                log.debug('Data log row dropped: {0}'.format(e))
             else:
-                msg['sys.time'] = time.time()
-                log.debug('Message Received: {0}'.format(msg))
-
-            global CALLBACKS
-            #Callbacks should generally pop their key out of the message
-            remaining = []
-            for callback in CALLBACKS:
-                found = callback(msg)
-                if not found:
-                    remaining.append(callback)
-            CALLBACKS = remaining
-
-            global LIVE_DATA
-            LIVE_DATA.update(msg)
-            #Logging stuff
-            global DATA_LOG_ON, DATA_LOG_VARS, DATA_LOG_FILE
-            if DATA_LOG_ON:  # Logging is enabled
-                #If self.data_log is None, but DATA_LOG_ON is True, then
-                #logging was just enabled and we need to open the file and
-                #write the headers
-                if self.data_log is None:
-                    self.data_log = open(DATA_LOG_FILE, 'a', -1)
-                    self.data_log.write(';'.join(DATA_LOG_VARS) + '\n')
-                #Write the log vars to the file
-                self.data_log.write(';'.join([str(LIVE_DATA[v]) for v in DATA_LOG_VARS]) + '\n')
-            else:
-                if self.data_log is not None:
-                    self.data_log.close()
-                    self.data_log = None
+                METRICS.log_rows_written += 1
+        else:
+            if self.data_log is not None:
+                self.data_log.close()
+                self.data_log = None
 
     def onError(self, *args):
         log.debug('Error: {0}'.format(args))
 
     def onClose(self, wasClean, code, reason):
         log.info('WebSocket connection closed: {0}'.format(reason))
+        if getattr(self, 'data_log', None) is not None:
+            self.data_log.close()
+            self.data_log = None
         asyncio.get_event_loop().stop()
 
 
 class CommsThread(threading.Thread):
 
-    def __init__(self, address='localhost', port=8085, task_queue=None):
+    #Providers of the keys computed locally, subscribed through this thread
+    local_providers = LOCAL_PROVIDERS
+
+    def __init__(self, address='localhost', port=8085, task_queue=None,
+                 loop_factory=None):
         #if task_queue is None:
         super(CommsThread, self).__init__()
         self.daemon = True
         self.address = address
         self.port = port
+        #Called for a new event loop with each connection, and by the relay
+        self.loop_factory = new_event_loop if loop_factory is None else loop_factory
         self.loop = None
         self.make_connection = threading.Event()  # Internal use
         self.connect_event = threading.Event()  # External tracking
         self.connected = False
+        self.protocol = None
+        self.connect_timeout = 10  # seconds
+        #Called with (connected, reason) when a connection attempt resolves
+        self.connection_listeners = []
 
         global LIVE_DATA
         self.data = LIVE_DATA
@@ -227,16 +571,71 @@ class CommsThread(threading.Thread):
         global MSG_QUEUE
         self.msg_queue = MSG_QUEUE
 
+        global SCHEDULER, TRIGGERS, ALERTS, CAPABILITIES, DERIVED, ROLLING
+        self.scheduler = SCHEDULER
+        self.triggers = TRIGGERS
+        self.alerts = ALERTS
+        self.capabilities = CAPABILITIES
+        self.derived = DERIVED
+        self.rolling = ROLLING
+        self.relay = None
+        self.metrics = METRICS
+        self.plugins = PLUGINS
+        self.metrics_server = None
+
         #global DATA_LOG_VARS
         #self.data_log_vars = DATA_LOG_VARS
 
-        self.subscription_manager = SubscriptionManager(MSG_QUEUE)
-        self.data_log_vars = OrderedSetWithSubscriptionHook(self.subscription_manager,
-                                                            ['t.universalTime',
-                                                             'v.missionTime',
-                                                             'sys.time'])
-        global DATA_LOG_VARS
-        DATA_LOG_VARS = self.data_log_vars
+        #Objects whose subscriptions outlive a connection, see add_subscriber
+        self.subscribers = []
+        self.subscription_lock = threading.RLock()
+        self.new_subscriptions()
+        self.add_subscriber(self.triggers)
+        self.add_subscriber(self.alerts)
+
+    def new_subscriptions(self):
+        """
+        Makes the SubscriptionManager, and the data log variables subscribed
+        through it, for a new connection, and subscribes the subscribers' keys
+        on it.
+        """
+        global MSG_QUEUE, DATA_LOG_VARS
+        with self.subscription_lock:
+            self.subscription_manager = SubscriptionManager(MSG_QUEUE,
+                                                            self.local_providers,
+                                                            self.subscription_lock)
+            self.data_log_vars = OrderedSetWithSubscriptionHook(self.subscription_manager,
+                                                                ['t.universalTime',
+                                                                 'v.missionTime',
+                                                                 'sys.time'])
+            DATA_LOG_VARS = self.data_log_vars
+            for subscriber in self.subscribers:
+                for key in subscriber.subscribed_keys():
+                    self.subscription_manager.add(key)
+
+    def add_subscriber(self, subscriber):
+        """
+        Registers an object whose subscriptions outlive a connection: the keys
+        returned by its subscribed_keys() (each as often as it is subscribed)
+        are subscribed now, and again for each new connection. The subscriber
+        adds and drops its own subscriptions as they change, holding the
+        subscription_lock while it changes both its keys and the subscriptions.
+        """
+        with self.subscription_lock:
+            self.subscribers.append(subscriber)
+            for key in subscriber.subscribed_keys():
+                self.subscription_manager.add(key)
+
+    def remove_subscriber(self, subscriber):
+        """
+        Drops the subscriptions of a subscriber, which is forgotten.
+        """
+        with self.subscription_lock:
+            if subscriber not in self.subscribers:
+                return
+            self.subscribers.remove(subscriber)
+            for key in subscriber.subscribed_keys():
+                self.subscription_manager.drop(key)
 
     @property
     def data_log_on(self):
@@ -261,34 +660,51 @@ class CommsThread(threading.Thread):
     def connect(self):
         url = 'ws://{0}:{1}/datalink'.format(self.address, str(self.port))
         log.info(url)
-        self.factory = WebSocketClientFactory(url, debug=False)
-        self.factory.protocol = TelemachusProtocol
+        self.factory = WebSocketClientFactory(url)
+        self.factory.protocol = TelemachusClientProtocol
         coro = self.loop.create_connection(self.factory,
                                            self.address,
                                            self.port)
 
         #Notes about events:
-        #The UI waits on the connect_event to know if the connection has either
-        #failed or succeeded; the UI will clear this event.
+        #The connect_event is set once the connection has either failed or
+        #succeeded, and the connection listeners are notified; the UI does not
+        #wait on the attempt, it receives the result through its listener.
         #self.connected differentiates between success and failure
         #Success -> self.connected=True ; Failure -> self.connected = False
 
+        #Those of an earlier connection do not apply, the server may have been
+        #upgraded since
+        expected = self.capabilities.expect(self.server)
+        if expected is not None:
+            log.info('Expecting Telemachus {0}'.format(expected))
+        self.derived.reset()
+        self.alerts.reset()
+
         ### MAKING the connection
         try:
-            self.loop.run_until_complete(coro)
-        #TODO: Add in some informative messages to send back to the UI
-        except:  # Failure, shut down and abort
-            self.connect_event.set()  # Connection resolved
+            _transport, self.protocol = self.loop.run_until_complete(
+                asyncio.wait_for(coro, self.connect_timeout))
+        except Exception as e:  # Failure, shut down and abort
+            if isinstance(e, asyncio.TimeoutError):
+                reason = 'timed out after {0}s'.format(self.connect_timeout)
+            else:
+                reason = str(e) or e.__class__.__name__
+            log.info('Connection failed: {0}'.format(reason))
             self.connected = False  # Connection resolved badly
             #Tear down the loop
             self.loop.stop()
             self.loop.close()
             self.loop = None
             self.make_connection.clear()  # Clear so we can wait for it again
+            self.connect_event.set()  # Connection resolved
+            self.notify_connection_listeners(False, reason)
             return
         else:
-            self.connect_event.set()  # Connection resolved
             self.connected = True  # Connection resolved well
+            self.connect_event.set()  # Connection resolved
+            self.notify_connection_listeners(True, None)
+            self.discover_capabilities()
 
         ### MAINTAINING the connection
         try:
@@ -296,24 +712,161 @@ class CommsThread(threading.Thread):
         except Exception as e:
             log.exception(e)
         finally:
-            #Tear down the loop
+            #Tear down the loop, ending its tasks (the outbound queue's)
+            pending = asyncio.all_tasks(self.loop)
+            for task in pending:
+                task.cancel()
+            if pending:
+                self.loop.run_until_complete(asyncio.gather(*pending,
+                                                            return_exceptions=True))
             self.loop.close()
-            self.loop = None
-            self.make_connection.clear()  # Clear so we can wait for it again
-            self.connected = False
+            self.reset_connection()
 
-            #Reset important connection state variables
-            global MSG_QUEUE
-            self.subscription_manager = SubscriptionManager(MSG_QUEUE)
-            self.data_log_vars = OrderedSetWithSubscriptionHook(self.subscription_manager,
-                                                            ['t.universalTime',
-                                                             'v.missionTime',
-                                                             'sys.time'])
+    def reset_connection(self):
+        """
+        Resets the connection state once a connection has been closed.
+        """
+        global CALLBACKS
+        self.loop = None
+        self.make_connection.clear()  # Clear so we can wait for it again
+        self.connected = False
+        self.protocol = None
+        self.msg_queue.wakeup = None
+
+        #Replies to the closed connection will not come
+        CALLBACKS = []
+
+        #Reset important connection state variables
+        self.derived.clear()
+        self.rolling.clear()
+        self.new_subscriptions()
+
+    @property
+    def server(self):
+        return '{0}:{1}'.format(self.address, self.port)
+
+    def discover_capabilities(self):
+        """
+        Requests the server version, and the api listing if that version's
+        capabilities are not cached. The responses are handled as callbacks in
+        the communication thread.
+        """
+        self.subscription_manager.add('a.version')
+        self.add_callback(self._version_callback)
+
+    def _version_callback(self, msg):
+        if 'a.version' not in msg:
+            return False
+        #The version stays in the message for the live data
+        version = msg['a.version']
+        self.subscription_manager.drop('a.version')
+        if version is not None and self.capabilities.load(version, self.server):
+            log.info('Using cached capabilities of Telemachus {0}'.format(version))
+            self.capabilities_confirmed()
+            return True
+        log.info('Discovering capabilities of Telemachus {0}'.format(version))
+        subscription_manager = self.subscription_manager
+
+        def api_callback(msg):
+            if 'a.api' not in msg:
+                return False
+            listing = msg.pop('a.api')
+            subscription_manager.drop('a.api')
+            if isinstance(listing, list):
+                self.capabilities.update(version, self.server, listing)
+                self.capabilities_confirmed()
+            else:
+                log.warning('Server did not list its api: {0}'.format(listing))
+                #Nothing is known of the server, so everything is sent to it
+                self.capabilities.reset()
+                self.capabilities_confirmed()
+            return True
+
+        self.subscription_manager.add('a.api')
+        self.add_callback(api_callback)
+        return True
+
+    def capabilities_confirmed(self):
+        """
+        Called in the communication thread once the capabilities of the
+        connection are known. Until then, subscriptions went to the server
+        only if expected of the version last seen there; those it supports are
+        sent again, together, and the others are reported.
+        """
+        keys = self.subscription_manager.transmitted()
+        keys.extend(key for key in CONNECTION_KEYS if key not in keys)
+        supported = self.capabilities.filter(keys)
+        unsupported = [key for key in keys if key not in supported]
+        if unsupported:
+            log.warning('Subscribed to variables unsupported by Telemachus {0}: {1}'.format(self.capabilities.version, unsupported))
+        if supported and self.protocol is not None:
+            self.protocol.send_json_message({'+': supported})
+
+    def start_relay(self, websocket=None, tcp=None, allow_control=False):
+        """
+        Starts relaying this connection's data to local clients, listening for
+        websockets and/or TCP at the given (host, port) addresses. Returns the
+        RelayThread, once it is listening (or has failed to, see its error).
+        """
+        from .relay import RelayThread
+        global RELAY
+        relay = RelayThread(self, websocket, tcp, allow_control)
+        relay.start()
+        relay.ready.wait()
+        if relay.error is None:
+            RELAY = self.relay = relay
+            self.add_subscriber(relay)
+        return relay
+
+    def start_segment(self, index_file):
+        """
+        Starts publishing the latest values to a shared memory segment, which
+        is described by index_file and removed at exit. Raises OSError or
+        RuntimeError if it cannot be created.
+        """
+        from .segment import SegmentWriter
+        global SEGMENT
+        if SEGMENT is not None:
+            return SEGMENT
+        SEGMENT = SegmentWriter(index_file)
+        atexit.register(SEGMENT.close)
+        return SEGMENT
+
+    def start_metrics(self, address, variables=None):
+        """
+        Serves the metrics page at the (host, port) address, with the given api
+        variables (or a default few). Raises OSError if it cannot listen.
+        """
+        from .metrics_server import MetricsServer
+        if self.metrics_server is None:
+            self.metrics_server = MetricsServer(address, self, variables)
+            self.metrics_server.start()
+        return self.metrics_server
+
+    def notify_connection_listeners(self, connected, reason):
+        for listener in self.connection_listeners:
+            try:
+                listener(connected, reason)
+            except Exception as e:
+                log.exception(e)
+
+    def close_connection(self):
+        """
+        Cleanly closes the websocket connection from outside of the
+        communication thread; the data log is closed along with it.
+        """
+        if self.loop is None:
+            return
+        if self.protocol is not None:
+            self.loop.call_soon_threadsafe(self.protocol.sendClose)
+        else:
+            self.loop.call_soon_threadsafe(self.loop.stop)
 
     def init_loop(self):
-        self.loop = asyncio.new_event_loop()
+        import_network()
+        self.loop = self.loop_factory()
         asyncio.set_event_loop(self.loop)
-        self.loop.queue = asyncio.Queue()
+        log.info('Event loop {0}'.format(type(self.loop).__module__))
 
     def run(self):
         #This thread will stay alive, even if connections are lost or dropped
@@ -325,3 +878,19 @@ class CommsThread(threading.Thread):
     def add_callback(self, callback_func):
         global CALLBACKS
         CALLBACKS.append(callback_func)
+
+    def add_watcher(self, key, watcher_func):
+        """
+        Register watcher_func to be called with (key, value) from the
+        communication thread each time the value for key changes.
+        """
+        global WATCHERS
+        WATCHERS[key] = WATCHERS.get(key, ()) + (watcher_func, )
+
+    def remove_watcher(self, key, watcher_func):
+        global WATCHERS
+        remaining = tuple(w for w in WATCHERS.get(key, ()) if w != watcher_func)
+        if remaining:
+            WATCHERS[key] = remaining
+        else:
+            WATCHERS.pop(key, None)
@@ -0,0 +1,143 @@
+# encoding: utf-8
+
+"""
+Tab completion for the Kerminal Command Line, over command names, the
+subcommands of each command, and api variables.
+"""
+
+import itertools
+
+from .telemachus_api import plotables, mj_actions, vessel_actions, \
+                            flight_actions, time_warp_actions, mapview_actions
+
+_END = ''  # Marks the end of a word, sorts before every character
+
+
+class Trie(object):
+    """
+    A prefix tree of words. Finding the node for a prefix costs only the
+    length of the prefix, regardless of the number of words.
+    """
+    def __init__(self, words=()):
+        self.root = {}
+        self.size = 0
+        for word in words:
+            self.add(word)
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, word):
+        node = self._find(word)
+        return node is not None and _END in node
+
+    def add(self, word):
+        node = self.root
+        for char in word:
+            node = node.setdefault(char, {})
+        if _END not in node:
+            node[_END] = None
+            self.size += 1
+
+    def _find(self, prefix):
+        node = self.root
+        for char in prefix:
+            node = node.get(char)
+            if node is None:
+                return None
+        return node
+
+    def complete(self, prefix, limit=None):
+        """
+        Returns, in sorted order, the words beginning with prefix.
+        """
+        node = self._find(prefix)
+        if node is None:
+            return []
+        return list(itertools.islice(self._walk(node, prefix), limit))
+
+    def _walk(self, node, prefix):
+        for char in sorted(node):
+            if char == _END:
+                yield prefix
+            else:
+                yield from self._walk(node[char], prefix + char)
+
+    def common_prefix(self, prefix):
+        """
+        Returns the longest string extending prefix that is shared by all of
+        the words beginning with prefix.
+        """
+        node = self._find(prefix)
+        if node is None:
+            return prefix
+        while len(node) == 1 and _END not in node:
+            char, node = next(iter(node.items()))
+            prefix += char
+        return prefix
+
+
+def _common_prefix(words):
+    if not words:
+        return ''
+    first, last = min(words), max(words)
+    for i, char in enumerate(first):
+        if char != last[i]:
+            return first[:i]
+    return first
+
+
+class CommandCompleter(object):
+    """
+    Completes Kerminal command lines. The first word of each command is
+    completed from the command names, later words from the subcommands of that
+    command and from the api variables, including any that the server has sent
+    which are not part of the static api listing.
+    """
+    def __init__(self, subcommands, data=None):
+        #subcommands maps each command name to an iterable of its subcommands
+        self.commands = Trie(subcommands)
+        self.subcommands = {name: Trie(subs) for name, subs in subcommands.items()}
+        self.api = Trie(itertools.chain(plotables, mj_actions, vessel_actions,
+                                        flight_actions, time_warp_actions,
+                                        mapview_actions, ['sys.time']))
+        self.data = data
+        self._data_size = 0
+
+    def _discover(self):
+        #The live data only grows, new keys are added when it does
+        if self.data is not None and len(self.data) != self._data_size:
+            for key in list(self.data):
+                self.api.add(key)
+            self._data_size = len(self.data)
+
+    def complete(self, line, limit=None):
+        """
+        Completes the last word of line. Returns the (possibly) extended line
+        and the candidates (up to limit) that were found for the word.
+        """
+        segment = line.rsplit(';', 1)[-1]
+        words = segment.split()
+        if not words or segment[-1].isspace():
+            word = ''
+        else:
+            word = words.pop()
+
+        if not words:  # Completing the command itself
+            tries = [self.commands]
+        else:
+            self._discover()
+            tries = [self.subcommands.get(words[0]), self.api]
+        tries = [t for t in tries if t is not None and t.complete(word, 1)]
+        if not tries:
+            return line, []
+
+        #At least two are needed to tell whether the completion is unique
+        fetch = None if limit is None else max(limit, 2)
+        candidates = sorted(set(itertools.chain.from_iterable(t.complete(word, fetch)
+                                                              for t in tries)))
+        if len(candidates) == 1:
+            extension = candidates[0][len(word):] + ' '
+        else:
+            extension = _common_prefix([t.common_prefix(word) for t in tries])[len(word):]
+        return line + extension, candidates[:limit]
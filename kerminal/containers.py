@@ -5,10 +5,16 @@ from .widgets import SemiInteractiveText
 from .gauges import *
 from .escape_forwarding_containers import EscapeForwardingContainer, \
                                           EscapeForwardingGridContainer
+from .sensors import SensorFrame
+from .telemachus_api import API
+from .propagation import OrbitInterpolator, QUANTITIES, ELEMENTS, ORIENTATION
+from . import utils
 
+import collections
 import curses
 from functools import partial
 import logging
+import math
 
 #log = logging.getLogger('npyscreen2.test')
 
@@ -141,49 +147,33 @@ class KerminalLivePlotable(EscapeForwardingContainer):
             widget.relx = self.relx + self.left_margin
 
 
-#These things should TOTALLY get refactored
-def velocity_formatter(func, width):
-    r_just = '{:>' + str(width) + '}'
-    v = func()
-    if v == 'None':
-        return r_just.format('N/A')
-    v = float(v)
-    #Base units are m/s
-    units = 'm/s'
-    if v >= 1000.0:
-        v /= 1000.0
-        units = 'km/s'
-    if v >= 1000.0:
-        v /= 1000.0
-        units = 'Mm/s'
-    v = '{:.3f}'.format(v)
-    return r_just.format(' '.join([v, units]))
+#Formatters are given the variable's entry in the API registry, which has its
+#units, a function returning its value (typed when it was received) and the
+#width to fill
+def _missing(value):
+    #Values not yet received, or not numbers
+    return not isinstance(value, (int, float)) or isinstance(value, bool)
 
 
-def distance_formatter(func, width):
+def metric_formatter(variable, func, width):
     r_just = '{:>' + str(width) + '}'
-    a = func()
-    if a == 'None':
+    v = func()
+    if _missing(v):
         return r_just.format('N/A')
-    a = float(func())
-    units = 'm'
-    if a >= 1000.0:
-        a /= 1000.0
-        units = 'km'
-    if a >= 1000.0:
-        a /= 1000.0
-        units = 'Mm'
-    a = '{:.3f}'.format(a)
-
-    return r_just.format(' '.join([a, units]))
+    prefix = ''
+    for larger in ('k', 'M'):
+        if v < 1000.0:
+            break
+        v /= 1000.0
+        prefix = larger
+    return r_just.format('{:.3f} {}{}'.format(v, prefix, variable.units))
 
 
-def fancy_time_formatter(func, width):
+def fancy_time_formatter(variable, func, width):
     r_just = '{:>' + str(width) + '}'
     t = func()
-    if t == 'None':
+    if _missing(t):
         return r_just.format('N/A')
-    t = float(t)
     #Kerbin-based time
     #http://wiki.kerbalspaceprogram.com/wiki/Time
     minutes, seconds = divmod(t, 60)
@@ -205,157 +195,60 @@ def fancy_time_formatter(func, width):
     return r_just.format(time_str)
 
 
-def simple_time_formatter(func, width):
+def simple_time_formatter(variable, func, width):
     r_just = '{:>' + str(width) + '}'
     t = func()
-    if t == 'None':
+    if _missing(t):
         return r_just.format('N/A')
     #Much more economical with space...
     #Compare how a 1000 years looks here:   9203400000s
     #                                       2147483647
     #to just under 1000 years in the fancy: 999y 426d 5h 59m 59.9s
-    t = '{:.1f}s'.format(float(t))
-    return r_just.format(t)
+    return r_just.format('{:.1f}s'.format(t))
 
 
-def degree_formatter(func, width):
-    r_just = '{:>' + str(width) + '}'
-    d = func()
-    if d == 'None':
-        return r_just.format('N/A')
-    #TODO: add a degree character
-    d = '{:.3f}'.format(float(d))
-    return r_just.format(d)
-
-
-def float_formatter(func, width):
+def float_formatter(variable, func, width):
     r_just = '{:>' + str(width) + '}'
     f = func()
-    if f == 'None':
+    if _missing(f):
         return r_just.format('N/A')
-    f = '{:.3f}'.format(float(f))
+    f = '{:.3f}'.format(f)
+    if variable.units is not None:
+        f = ' '.join([f, variable.units])
     return r_just.format(f)
 
 
-def plain_formatter(func, width):
+def plain_formatter(variable, func, width):
     r_just = '{:>' + str(width) + '}'
     p = func()
-    if p == 'None':
+    if p is None:
         p = 'N/A'
-    return r_just.format(p)
-
+    return r_just.format(str(p))
 
-def paused_formatter(func, width):
-    try:
-        p = int(func())
-    except ValueError:
-        p = None
 
+def paused_formatter(variable, func, width):
     meanings = {0: 'Unpaused', 1: 'Paused', 2: 'No Power', 3: 'Off',
-                4: 'Not Found', None: 'Not Found'}
+                4: 'Not Found'}
 
     r_just = '{:>' + str(width) + '}'
-    return r_just.format(meanings[p])
+    return r_just.format(meanings.get(func(), 'Not Found'))
 
 
-def charge_formatter(func, width):
+def sensor_formatter(variable, func, width):
+    #Sensor values are SensorFrames, decoded as they arrived
     r_just = '{:>' + str(width) + '}'
-    v = func()
-    if v == 'None':
+    frame = func()
+    if not isinstance(frame, SensorFrame):
         return r_just.format('N/A')
-    v = float(v)
-    #Base units are Wh
-    units = 'Wh'
-    if v >= 1000.0:
-        v /= 1000.0
-        units = 'kWh'
-    if v >= 1000.0:
-        v /= 1000.0
-        units = 'MWh'
-    v = '{:.1f}'.format(v)
-    return r_just.format(' '.join([v, units]))
-
-
-def volume_formatter(func, width):
-    r_just = '{:>' + str(width) + '}'
-    v = func()
-    if v == 'None':
+    readings = [v for v in frame.values if not math.isnan(v)]
+    if not readings:
         return r_just.format('N/A')
-    elif v == '':  # MonoPropellant api string is atypical
-        v = 0
-    v = float(v)
-    #except:
-        #raise ValueError(v)
-    #Base units are Wh
-    units = 'L'
-    if v >= 1000.0:
-        v /= 1000.0
-        units = 'kL'
-    if v >= 1000.0:
-        v /= 1000.0
-        units = 'ML'
-    v = '{:.1f}'.format(v)
-    return r_just.format(' '.join([v, units]))
-
-
-def thermometer_formatter(func, width):
-    r_just = '{:>' + str(width) + '}'
-    t = func()
-    if t == 'None':
-        return r_just.format('N/A')
-    try:
-        t = float(t.split(',')[1][2:-2])
-    except:
-        return 'debugme'
-    #Base units are C
-    units = 'C'
-    t = '{:.2f}'.format(t)
-    return r_just.format(' '.join([t, units]))
-
-
-def barometer_formatter(func, width):
-    r_just = '{:>' + str(width) + '}'
-    p = func()
-    if p == 'None':
-        return r_just.format('N/A')
-    try:
-        p = float(p.split(',')[1][2:-2])
-    except:
-        return 'debugme'
-    #Base units are Pa
-    units = 'Pa'
-    p = '{:.2f}'.format(p)
-    return r_just.format(' '.join([p, units]))
-
-
-def gravity_formatter(func, width):
-    r_just = '{:>' + str(width) + '}'
-    g = func()
-    if g == 'None':
-        return r_just.format('N/A')
-    try:
-        g = float(g.split(',')[1][2:-2])
-    except:
-        return 'debugme'
-    #Base units are Pa
-    units = 'm/s2'
-    g = '{:.2f}'.format(g)
-    return r_just.format(' '.join([g, units]))
-
-
-def accelerometer_formatter(func, width):
-    r_just = '{:>' + str(width) + '}'
-    a = func()
-    if a == 'None':
-        return r_just.format('N/A')
-    try:
-        a = float(a.split(',')[1][2:-2])
-    except:
-        return 'debugme'
-    #Base units are Pa
-    units = 'Gs'
-    a = '{:.2f}'.format(a)
-    return r_just.format(' '.join([a, units]))
+    units = variable.units
+    text = ' '.join(['{:.2f}'.format(v) for v in readings] + [units])
+    if len(text) > width:  # Too many sensors to show, give their range
+        text = '{:.2f}..{:.2f} {} ({})'.format(min(readings), max(readings),
+                                                units, len(readings))
+    return r_just.format(text)
 
 
 class OrbitalInfo(KerminalLivePlotable):
@@ -383,9 +276,9 @@ class OrbitalInfo(KerminalLivePlotable):
     def create(self):
         #widget_id, title, api-var, formatter_func
         items = [('orbitalspeed', 'Orbital Speed:', 'o.relativeVelocity',
-                  velocity_formatter),
-                 ('apoapsis', 'Apoapsis:', 'o.ApA', distance_formatter),
-                 ('periapsis', 'Periapsis:', 'o.PeA', distance_formatter),
+                  metric_formatter),
+                 ('apoapsis', 'Apoapsis:', 'o.ApA', metric_formatter),
+                 ('periapsis', 'Periapsis:', 'o.PeA', metric_formatter),
                  ('orbitalperiod', 'Orbital Period:', 'o.period',
                   fancy_time_formatter),
                  ('timetoapoapsis', 'Time to Apoapsis:', 'o.timeToAp',
@@ -393,16 +286,23 @@ class OrbitalInfo(KerminalLivePlotable):
                  ('timetoperiapsis', 'Time to Periapsis:', 'o.timeToPe',
                   fancy_time_formatter),
                  ('inclination', 'Inclination', 'o.inclination',
-                  degree_formatter),
+                  float_formatter),
                  ('eccentricity', 'Eccentricity', 'o.eccentricity',
                   float_formatter)]
 
+        data = self.form.parent_app.stream.data
+        #Values which change along the orbit are advanced between messages
+        interpolator = OrbitInterpolator(data)
+
         def get_data(data, var):
-            return str(data.get(var, ''))
+            if var in QUANTITIES:
+                return interpolator.value(var)
+            return data.get(var)
 
         f_width = self.width - (self.title_length + self.left_margin + self.right_margin + 1)
 
-        data = self.form.parent_app.stream.data
+        for api in ELEMENTS + ORIENTATION:
+            self.form.parent_app.stream.subscription_manager.add(api)
 
         for key, tit, api, frmt_f in items:
             self.form.parent_app.stream.subscription_manager.add(api)
@@ -413,7 +313,7 @@ class OrbitalInfo(KerminalLivePlotable):
                      title_width=self.title_length,
                      title_value=tit,
                      field_value='',
-                     field_feed=partial(frmt_f, base_func, f_width),
+                     field_feed=partial(frmt_f, API[api], base_func, f_width),
                      editable=False)
 
 
@@ -440,25 +340,25 @@ class SurfaceInfo(KerminalLivePlotable):
     def create(self):
         #widget_id, title, api-var, formatter_func
         items = [('altitudeabovesealevel', 'Altitude ASL:', 'v.altitude',
-                  distance_formatter),
+                  metric_formatter),
                  #('altitudeaboveterrain', 'Altitude True:', 'v.heightFromTerrain',
-                  #distance_formatter),
+                  #metric_formatter),
                  ('surfacespeed', 'Surface Speed:', 'v.surfaceVelocity',
-                  velocity_formatter),
+                  metric_formatter),
                  ('surfacevertical', 'Vertical Speed:', 'v.verticalSpeed',
-                  velocity_formatter),
-                 ('pitch', 'Pitch:', 'n.pitch', degree_formatter),
-                 ('heading', 'Heading:', 'n.heading', degree_formatter),
-                 ('roll', 'Roll:', 'n.roll', degree_formatter),
-                 ('rawpitch', 'Raw Pitch:', 'n.rawpitch', degree_formatter),
-                 ('rawheading', 'Raw Heading:', 'n.rawheading', degree_formatter),
-                 ('rawroll', 'Raw Roll:', 'n.rawroll', degree_formatter),
-                 ('latitude', 'Latitude:', 'v.lat', plain_formatter),
+                  metric_formatter),
+                 ('pitch', 'Pitch:', 'n.pitch', float_formatter),
+                 ('heading', 'Heading:', 'n.heading', float_formatter),
+                 ('roll', 'Roll:', 'n.roll', float_formatter),
+                 ('rawpitch', 'Raw Pitch:', 'n.rawpitch', float_formatter),
+                 ('rawheading', 'Raw Heading:', 'n.rawheading', float_formatter),
+                 ('rawroll', 'Raw Roll:', 'n.rawroll', float_formatter),
+                 ('latitude', 'Latitude:', 'v.lat', float_formatter),
                  ('longitude', 'Longitude:', 'v.long', float_formatter),
                  ]
 
         def get_data(data, var):
-            return str(data.get(var, ''))
+            return data.get(var)
 
         f_width = self.width - (self.title_length + self.left_margin + self.right_margin + 1)
 
@@ -473,7 +373,7 @@ class SurfaceInfo(KerminalLivePlotable):
                      title_width=self.title_length,
                      title_value=tit,
                      field_value='',
-                     field_feed=partial(frmt_f, base_func, f_width),
+                     field_feed=partial(frmt_f, API[api], base_func, f_width),
                      editable=False)
 
 
@@ -504,7 +404,7 @@ class TimeInfo(KerminalLivePlotable):
                   ]
 
         def get_data(data, var):
-            return str(data.get(var, ''))
+            return data.get(var)
 
         f_width = self.width - (self.title_length + self.left_margin + self.right_margin + 1)
 
@@ -519,7 +419,7 @@ class TimeInfo(KerminalLivePlotable):
                      title_width=self.title_length,
                      title_value=tit,
                      field_value='',
-                     field_feed=partial(frmt_f, base_func, f_width),
+                     field_feed=partial(frmt_f, API[api], base_func, f_width),
                      editable=False)
 
 
@@ -534,6 +434,11 @@ class ResourceInfo(KerminalLivePlotable):
                  *args,
                  **kwargs):
         self.gauges = []
+        self.resources = {}  # resource name -> list of gauges
+        self._retired = {}  # gauges of resources no longer reported
+        #Resource events are queued by the communication thread and consumed
+        #during update, so nothing is polled when nothing has changed
+        self.pending = collections.deque()
         super(ResourceInfo, self).__init__(form,
                                           parent,
                                           title_length=title_length,
@@ -544,24 +449,19 @@ class ResourceInfo(KerminalLivePlotable):
                                            **kwargs)
 
     def create(self):
-        self.gauges.append(self.add(ElectricChargeGauge,
-                                    widget_id='electriccharge',))
-        self.gauges.append(self.add(LiquidFuelGauge,
-                                    widget_id='liquidfuel',))
-        self.gauges.append(self.add(LiquidFuelStageGauge,
-                                    widget_id='liquidfuelstage',))
-        self.gauges.append(self.add(OxidizerGauge,
-                                    widget_id='oxidizerfuel',))
-        self.gauges.append(self.add(OxidizerStageGauge,
-                                    widget_id='oxidizerstage',))
-        self.gauges.append(self.add(MonopropellantGauge,
-                                    widget_id='monopropellant',))
-        #self.gauges.append(self.add(MonopropellantStageGauge,  #seemed bugged
-                                    #widget_id='monopropellantstage',))
-        self.gauges.append(self.add(IntakeAirGauge,
-                                    widget_id='intakeair',))
-        self.gauges.append(self.add(XenonGasGauge,
-                                    widget_id='xenongas',))
+        stream = self.form.parent_app.stream
+        stream.subscription_manager.add('r.resourceNameList')
+        stream.add_watcher('r.resourceNameList', self.on_resource_event)
+
+    def on_resource_event(self, key, value):
+        #Called from the communication thread
+        self.pending.append((key, value))
+
+    def add_resource(self, name):
+        """
+        Lazily creates the gauges for a newly discovered resource. They remain
+        hidden until the server reports a capacity for the resource.
+        """
 
         def gauge_feed(gauge_display, data):
             if gauge_display.stage:
@@ -570,15 +470,12 @@ class ResourceInfo(KerminalLivePlotable):
             else:
                 value = data.get(gauge_display.api_vars['total'])
                 maximum = data.get(gauge_display.api_vars['maximum'])
-            if maximum is None:  # This really only applies to Monopropellant
-                gauge_display.gauge.max_val = 1
-                return 0
-            if maximum == 'None' or maximum < 0:  # No capacity for the resource
+            if maximum in [None, 'None'] or maximum < 0:  # No capacity
                 gauge_display.gauge.max_val = 1
                 return 0
             else:
                 gauge_display.gauge.max_val = float(maximum)
-            if value == 'None':
+            if value in [None, 'None']:
                 return 0
             value = float(value)
             return value
@@ -591,27 +488,141 @@ class ResourceInfo(KerminalLivePlotable):
                 value = data.get(gauge_display.api_vars['total'])
                 maximum = data.get(gauge_display.api_vars['maximum'])
             units = gauge_display.units
-            if maximum is None:  # This really only applies to Monopropellant
-                gauge_display.gauge.max_val = 1
-                return ' N/A '
-            if maximum == 'None':
+            if maximum in [None, 'None']:
                 return ' N/A '
-            if value == 'None':
+            if value in [None, 'None']:
                 value = 0
             value = float(value)
             maximum = float(maximum)
             return '{:.3e}/{:.3e} '.format(value, maximum) + units
 
-        data = self.form.parent_app.stream.data
-        sub_manager = self.form.parent_app.stream.subscription_manager
+        def burn_feed(gauge_display, data):
+            amount = 'current' if gauge_display.stage else 'total'
+            rate = data.get(gauge_display.api_vars[amount + '_trend'])
+            if not isinstance(rate, float) or abs(rate) < 1e-9:
+                return ''
+            text = '{:+.3g}/s'.format(rate)
+            empty = data.get(gauge_display.api_vars[amount + '_empty'])
+            if isinstance(empty, float):
+                text += ' ' + utils.format_duration(empty)
+            return text
 
-        for gauge in self.gauges:
-            if not gauge.stage:
-                gauge.title.bold = True
-            for api_var in gauge.api_vars.values():
-                sub_manager.add(api_var)
+        stream = self.form.parent_app.stream
+        data = stream.data
+        gauges = [self.add(ResourceGauge,
+                           resource=name,
+                           widget_id=name.lower())]
+        gauges[0].title.bold = True
+        if resource_info(name)[3]:
+            gauges.append(self.add(ResourceStageGauge,
+                                   resource=name,
+                                   widget_id=name.lower() + 'stage'))
+
+        for gauge in gauges:
+            gauge.live = False
+            gauge.auto_manage = False
+            gauge.hidden = True
             gauge.gauge.feed = partial(gauge_feed, gauge, data)
             gauge.textvalues.feed = partial(text_feed, gauge, data)
+            gauge.burnvalues.feed = partial(burn_feed, gauge, data)
+            self.gauges.append(gauge)
+        self.resources[name] = gauges
+
+        max_key = gauges[0].api_vars['maximum']
+        stream.subscription_manager.add(max_key)
+        stream.add_watcher(max_key, self.on_resource_event)
+
+    def remove_resource(self, name):
+        """
+        Hides the gauges of a resource no longer reported by the server and
+        drops all of its subscriptions. The gauges are kept for reuse.
+        """
+        stream = self.form.parent_app.stream
+        gauges = self.resources.pop(name)
+        max_key = gauges[0].api_vars['maximum']
+        stream.remove_watcher(max_key, self.on_resource_event)
+        stream.subscription_manager.drop(max_key)
+        self.show_resource(gauges, False)
+        self._retired[name] = gauges
+
+    def show_resource(self, gauges, show):
+        sub_manager = self.form.parent_app.stream.subscription_manager
+        api_vars = gauges[0].api_vars
+        if gauges[0].live == show:
+            return False
+        #Each gauge estimates the rate of use of its own amount
+        keys = [api_vars['current'], api_vars['total']]
+        for gauge in gauges:
+            amount = 'current' if gauge.stage else 'total'
+            keys.extend([api_vars[amount + '_trend'], api_vars[amount + '_empty']])
+        for key in keys:
+            if show:
+                sub_manager.add(key)
+            else:
+                sub_manager.drop(key)
+        for gauge in gauges:
+            gauge.live = show
+            gauge.auto_manage = show
+            gauge.hidden = not show
+        return True
+
+    def present(self, maximum):
+        """
+        Whether a resource is present, given its capacity.
+        """
+        return maximum not in [None, 'None'] and maximum >= 0
+
+    def discover_resources(self, value):
+        """
+        Reconciles the displayed resources against the list of resource names
+        reported by the server.
+        """
+        if value in [None, 'None']:
+            names = []
+        elif isinstance(value, str):
+            names = [n.strip() for n in value.split(',') if n.strip()]
+        else:
+            names = list(value)
+
+        made_modification = False
+        for name in [n for n in self.resources if n not in names]:
+            self.remove_resource(name)
+            made_modification = True
+        for name in names:
+            if name in self.resources:
+                continue
+            if name in self._retired:  # Seen before, reuse its gauges
+                gauges = self.resources[name] = self._retired.pop(name)
+                max_key = gauges[0].api_vars['maximum']
+                stream = self.form.parent_app.stream
+                stream.subscription_manager.add(max_key)
+                stream.add_watcher(max_key, self.on_resource_event)
+                #The watcher only fires on a change, so an unchanged capacity
+                #must be shown from the value last received
+                if self.show_resource(gauges, self.present(stream.data.get(max_key))):
+                    made_modification = True
+            else:
+                self.add_resource(name)
+        return made_modification
+
+    def update(self):
+        made_modification = False
+        while self.pending:
+            key, value = self.pending.popleft()
+            if key == 'r.resourceNameList':
+                if self.discover_resources(value):
+                    made_modification = True
+                continue
+            #Capacity changed, key is of the form "r.resourceMax[<name>]"
+            name = key[len('r.resourceMax['):-1]
+            gauges = self.resources.get(name)
+            if gauges is None:
+                continue
+            if self.show_resource(gauges, self.present(value)):
+                made_modification = True
+        if made_modification:
+            self.resize()
+            self.parent._resize()
 
     def resize(self):
         #Resizes itself according to contained items
@@ -643,35 +654,6 @@ class ResourceInfo(KerminalLivePlotable):
         if parent_resize:
             self.parent.resize()
 
-    def update(self):
-        #log = logging.getLogger('npyscreen2.test')
-        data = self.form.parent_app.stream.data
-        sub_manager = self.form.parent_app.stream.subscription_manager
-        made_modification = False
-        for gauge in self.gauges:
-            resource_max = data.get(gauge.api_vars['maximum'])
-            if resource_max in [None, 'None'] or resource_max < 0:
-                if gauge.live:  # Already down otherwise
-                    #log.debug('dismissing widget')
-                    sub_manager.drop(gauge.api_vars['current'])
-                    sub_manager.drop(gauge.api_vars['total'])
-                    gauge.live = False
-                    gauge.auto_manage = False
-                    gauge.hidden = True
-                    made_modification = True
-            else:
-                if not gauge.live:  # Already up otherwise
-                    #log.debug('recalling widget')
-                    sub_manager.add(gauge.api_vars['current'])
-                    sub_manager.add(gauge.api_vars['total'])
-                    gauge.live = True
-                    gauge.auto_manage = True
-                    gauge.hidden = False
-                    made_modification = True
-        if made_modification:
-            self.resize()
-            self.parent._resize()
-
 
 class ThrottleInfo(KerminalLivePlotable):
     def __init__(self,
@@ -793,14 +775,14 @@ class SensorInfo(KerminalLivePlotable):
 
     def create(self):
         #widget_id, title, api-var, formatter_func
-        items = [('temperature', 'Thermometer:', 's.sensor.temp', thermometer_formatter),
-                 ('pressure', 'Barometer:', 's.sensor.pres', barometer_formatter),
-                 ('gravity', 'Grav. Detector:', 's.sensor.grav', gravity_formatter),
-                 ('acceleration', 'Accelerometer:', 's.sensor.acc', accelerometer_formatter),
+        items = [('temperature', 'Thermometer:', 's.sensor.temp', sensor_formatter),
+                 ('pressure', 'Barometer:', 's.sensor.pres', sensor_formatter),
+                 ('gravity', 'Grav. Detector:', 's.sensor.grav', sensor_formatter),
+                 ('acceleration', 'Accelerometer:', 's.sensor.acc', sensor_formatter),
                   ]
 
         def get_data(data, var):
-            return str(data.get(var, ''))
+            return data.get(var)
 
         f_width = self.width - (self.title_length + self.left_margin + self.right_margin + 1)
 
@@ -815,7 +797,7 @@ class SensorInfo(KerminalLivePlotable):
                      title_width=self.title_length,
                      title_value=tit,
                      field_value='',
-                     field_feed=partial(frmt_f, base_func, f_width),
+                     field_feed=partial(frmt_f, API[api], base_func, f_width),
                      editable=False)
 
 
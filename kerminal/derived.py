@@ -0,0 +1,197 @@
+# encoding: utf-8
+
+"""
+Derived telemetry: channels computed locally from the api variables, such as
+vertical acceleration from v.verticalSpeed, which can be subscribed to, logged,
+and displayed as though they came from the server. Their keys begin with "d.".
+
+Channels are declared below by their inputs and a function of those inputs.
+They are evaluated as each message arrives, in dependency order, and only when
+one of their inputs has changed, so a channel may itself be the input of
+another.
+"""
+
+import collections
+import math
+import threading
+
+from .telemachus_api import API
+
+STANDARD_GRAVITY = 9.80665  # m/s2, the unit of v.geeForce
+
+
+class Rate(object):
+    """
+    The rate of change of a value with respect to a clock, from successive
+    samples. Called with (value, time).
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.last = None
+        self.rate = None
+
+    def __call__(self, value, now):
+        last, self.last = self.last, (value, now)
+        if last is None or now < last[1]:  # First sample, or the clock reverted
+            self.rate = None
+        elif now > last[1]:
+            self.rate = (value - last[0]) / (now - last[1])
+        #Otherwise the clock has not moved (paused), keep the last rate
+        return self.rate
+
+
+def local_gravity(speed, sma, period):
+    #The gravitational parameter from Kepler's third law, the distance from
+    #the body's center by vis-viva, giving the gravity at the craft
+    mu = 4 * math.pi ** 2 * sma ** 3 / period ** 2
+    radius = 2 / (speed ** 2 / mu + 1 / sma)
+    return mu / radius ** 2
+
+
+def apparent_twr(gee_force, gravity):
+    #Proper acceleration over local gravity; equal to the thrust to weight
+    #ratio only when drag is negligible
+    return gee_force * STANDARD_GRAVITY / gravity
+
+
+def propellant_fraction(fuel, oxidizer, fuel_max, oxidizer_max):
+    return 100 * (fuel + oxidizer) / (fuel_max + oxidizer_max)
+
+
+Channel = collections.namedtuple('Channel', ['key', 'name', 'units', 'inputs',
+                                             'compute'])
+
+#key, display name, units, inputs, function of the inputs (or a factory for a
+#stateful one, such as Rate)
+CHANNELS = [('d.gravity', 'Local Gravity', 'm/s2',
+             ('o.relativeVelocity', 'o.sma', 'o.period'), local_gravity),
+            ('d.twr', 'Apparent TWR', None,
+             ('v.geeForce', 'd.gravity'), apparent_twr),
+            ('d.verticalAcceleration', 'Vertical Acceleration', 'm/s2',
+             ('v.verticalSpeed', 't.universalTime'), Rate),
+            ('d.qRate', 'Dynamic Pressure Rate', 'Pa/s',
+             ('v.dynamicPressure', 't.universalTime'), Rate),
+            ('d.propellant', 'Propellant Remaining', '%',
+             ('r.resource[LiquidFuel]', 'r.resource[Oxidizer]',
+              'r.resourceMax[LiquidFuel]', 'r.resourceMax[Oxidizer]'),
+             propellant_fraction),
+            ]
+
+
+class DerivedEngine(object):
+    """
+    Evaluates the active derived channels. Channels are activated and
+    deactivated (by the SubscriptionManager) from any thread, `update` is
+    called by the communication thread for each message.
+    """
+    def __init__(self, definitions=CHANNELS):
+        self.channels = collections.OrderedDict()
+        self.factories = {}
+        self.active = {}  # key -> activation count
+        self.lock = threading.Lock()
+        for key, name, units, inputs, compute in definitions:
+            self.define(key, name, units, inputs, compute)
+        self._plan()
+
+    def __contains__(self, key):
+        return key in self.channels
+
+    def handles(self, key):
+        return key in self.channels
+
+    def define(self, key, name, units, inputs, compute):
+        for inpt in inputs:
+            if inpt not in self.channels and inpt.startswith('d.'):
+                raise ValueError('{0} is defined before its input {1}'.format(key, inpt))
+        if isinstance(compute, type):  # Stateful, made fresh on each reset
+            self.factories[key] = compute
+            compute = compute()
+        self.channels[key] = Channel(key, name, units, tuple(inputs), compute)
+        API.register(key, name, 'derived', 'float', units)
+
+    def reset(self):
+        """
+        Forgets the state of stateful channels, as for a new connection.
+        """
+        for key, factory in self.factories.items():
+            self.channels[key] = self.channels[key]._replace(compute=factory())
+        self._plan()
+
+    def _plan(self):
+        #Channels are defined after their inputs, so definition order is a
+        #valid evaluation order
+        self.order = [self.channels[key] for key in self.channels
+                      if key in self.active]
+        self.inputs = set()
+        for channel in self.order:
+            self.inputs.update(channel.inputs)
+
+    def requirements(self, key):
+        """
+        Returns the api variables (not derived) needed to compute key.
+        """
+        needed = []
+        for inpt in self.channels[key].inputs:
+            if inpt in self.channels:
+                needed.extend(i for i in self.requirements(inpt) if i not in needed)
+            elif inpt not in needed:
+                needed.append(inpt)
+        return needed
+
+    def activate(self, key):
+        with self.lock:
+            self._activate(key)
+            self._plan()
+
+    def _activate(self, key):
+        #Derived inputs are activated along with the channel
+        self.active[key] = self.active.get(key, 0) + 1
+        for inpt in self.channels[key].inputs:
+            if inpt in self.channels:
+                self._activate(inpt)
+
+    def deactivate(self, key):
+        with self.lock:
+            self._deactivate(key)
+            self._plan()
+
+    def clear(self):
+        with self.lock:
+            self.active.clear()
+            self._plan()
+
+    def _deactivate(self, key):
+        if key not in self.active:
+            return
+        self.active[key] -= 1
+        if not self.active[key]:
+            del self.active[key]
+        for inpt in self.channels[key].inputs:
+            if inpt in self.channels:
+                self._deactivate(inpt)
+
+    def update(self, msg, previous):
+        """
+        Adds to msg the values of the active channels with a changed input,
+        where previous holds the values before msg. Must be called before
+        previous is updated with msg.
+        """
+        order = self.order
+        if not order:
+            return
+        changed = set(k for k in self.inputs & msg.keys()
+                      if msg[k] != previous.get(k))
+        for channel in order:
+            if changed.isdisjoint(channel.inputs):
+                continue
+            values = [msg[k] if k in msg else previous.get(k)
+                      for k in channel.inputs]
+            try:
+                value = channel.compute(*values)
+            except (TypeError, ValueError, ArithmeticError):
+                value = None  # Missing or non-numeric inputs
+            if value != previous.get(channel.key):
+                msg[channel.key] = value
+                changed.add(channel.key)
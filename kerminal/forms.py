@@ -16,6 +16,8 @@ import npyscreen2
 from functools import partial
 
 import logging
+import queue
+import time
 
 from datetime import datetime
 
@@ -29,18 +31,32 @@ def header_feed(thread):
     return status
 
 
+#The panels of the telemetry screen, as (container, widget id)
+SMART_PANELS = [(containers.ResourceInfo, 'resource0'),
+                (containers.ThrottleInfo, 'throttle0'),
+                (containers.OrbitalInfo, 'orbit0'),
+                (containers.SurfaceInfo, 'surface0'),
+                (containers.TimeInfo, 'time0'),
+                (containers.SensorInfo, 'sensor0'),
+                (containers.BooleanToggles, 'buttons0')]
+
+
 class KerminalForm(npyscreen2.Form):
     def __init__(self, *args, **kwargs):
         super(KerminalForm, self).__init__(*args, **kwargs)
 
         self.action_controller = KerminalCommands(self, self)
 
+        #Events from other threads, handled by the UI thread in while_waiting
+        self.events = queue.Queue()
+        self.parent_app.stream.connection_listeners.append(self.post_connection_event)
+
         self.text = self.add(containers.KerminalMultiLineText,
                              widget_id='text',
                              editable=True,
                              margin=1,
                              auto_manage=False, hidden=True)
-        self.text.build_contained_from_text(launch_text)
+        self.text_built = False  # The launch text is built when first shown
 
         self.smart = self.add(EscapeForwardingSmartContainer,
                               widget_id='smart',
@@ -48,24 +64,7 @@ class KerminalForm(npyscreen2.Form):
                               editable=True,
                               auto_manage=False)
 
-        self.smart.add(containers.ResourceInfo,
-                       widget_id='resource0')
-        self.smart.add(containers.ThrottleInfo,
-                       widget_it='throttle0')
-        self.smart.add(containers.OrbitalInfo,
-                       widget_id='orbit0')
-
-        self.smart.add(containers.SurfaceInfo,
-                       widget_id='surface0')
-
-        self.smart.add(containers.TimeInfo,
-                       widget_id='time0')
-
-        self.smart.add(containers.SensorInfo,
-                       widget_id='sensor0')
-
-        self.smart.add(containers.BooleanToggles,
-                       widget_id='buttons0')
+        self.panels_built = False  # See build_panels
 
         self.top_bar = self.add(npyscreen2.BorderBox,
                                 widget_id='top_bar',
@@ -130,7 +129,10 @@ class KerminalForm(npyscreen2.Form):
         self.smart.hidden = True
         self.text.editable = True
         self.text.hidden = False
+        if msg is None and not self.text_built:
+            msg = launch_text
         if msg is not None:
+            self.text_built = True
             self.text.build_contained_from_text(msg)
             self.text._resize()
 
@@ -140,6 +142,18 @@ class KerminalForm(npyscreen2.Form):
         self.text.editable = False
         self.text.hidden = True
 
+    def build_panels(self):
+        """
+        Builds the panels of the telemetry screen. This waits until the form
+        has first been displayed, so that Kerminal appears sooner. The panels
+        are built together, as the screen shows all of them from the start and
+        lays them out as one grid.
+        """
+        self.panels_built = True
+        for container, widget_id in SMART_PANELS:
+            self.smart.add(container, widget_id=widget_id)
+        self.smart._resize()
+
     def set_up_exit_condition_handlers(self):
         super(KerminalForm, self).set_up_exit_condition_handlers()
         self.how_exited_handlers.update({'escape': self.toggle_commands})
@@ -157,8 +171,50 @@ class KerminalForm(npyscreen2.Form):
             self.command_line.value = ''
 
     def while_waiting(self):
+        self.handle_events()
+        if not self.panels_built:
+            self.build_panels()
+        start = time.perf_counter()
         self.call_feed()
         self.display()
+        self.parent_app.stream.metrics.render(time.perf_counter() - start)
+
+    def post_event(self, handler, *args):
+        """
+        Thread-safe; handler(*args) will be called by the UI thread.
+        """
+        self.events.put((handler, args))
+
+    def post_connection_event(self, connected, reason):
+        #Called from the communication thread
+        self.post_event(self.on_connection_resolved, connected, reason)
+
+    def handle_events(self):
+        while True:
+            try:
+                handler, args = self.events.get_nowait()
+            except queue.Empty:
+                return
+            handler(*args)
+
+    def on_connection_resolved(self, connected, reason):
+        if connected:
+            self.info('Connected!')
+            self.show_smart()
+        else:
+            self.error('Could not connect: {}'.format(reason))
+
+    def connecting(self, host, port):
+        """
+        Shows the progress of a connection attempt in the status line.
+        """
+        start = time.time()
+        self.status_prefix.value = 'INFO:'
+        self.status_prefix.color = 'LABEL'
+        self.status.feed = lambda: 'Connecting to {}:{} ... {:.0f}s'.format(host,
+                                                                           port,
+                                                                           time.time() - start)
+        self.resize_status_line()
 
     def info(self, msg):
         self.status_prefix.value = 'INFO:'
@@ -1,9 +1,8 @@
 # -*- coding: utf-8 -*-
 
-__all__ = ['ElectricChargeGauge', 'LiquidFuelGauge', 'LiquidFuelStageGauge',
-           'OxidizerGauge', 'OxidizerStageGauge', 'MonopropellantGauge',
-           'MonopropellantStageGauge', 'IntakeAirGauge', 'XenonGasGauge',
-           'TitledGauge', 'TitledGaugeWithTextValues', 'ThrottleGauge']
+__all__ = ['ResourceGauge', 'ResourceStageGauge', 'RESOURCE_TABLE',
+           'resource_info', 'resource_api_vars', 'TitledGauge',
+           'TitledGaugeWithTextValues', 'ThrottleGauge', 'BURN_WINDOW']
 
 from .gauge_displays import *
 from .resource_gauges import *
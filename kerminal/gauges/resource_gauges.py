@@ -2,179 +2,115 @@
 
 from . import TitledGaugeWithTextValues
 
-
-__all__ = ['ElectricChargeGauge', 'LiquidFuelGauge', 'LiquidFuelStageGauge',
-           'OxidizerGauge', 'OxidizerStageGauge', 'MonopropellantGauge',
-           'MonopropellantStageGauge', 'IntakeAirGauge', 'XenonGasGauge',
-           'ThrottleGauge']
-
-
-class ElectricChargeGauge(TitledGaugeWithTextValues):
+import collections
+import npyscreen2
+
+
+__all__ = ['ResourceGauge', 'ResourceStageGauge', 'ThrottleGauge',
+           'RESOURCE_TABLE', 'resource_info', 'resource_api_vars',
+           'BURN_WINDOW']
+
+
+#Display parameters for the resources that ship with the stock game. Resources
+#reported by the server which are not found here (such as those added by mods)
+#are displayed using the defaults provided by resource_info
+#name: (title, units, text_width, show a current stage gauge)
+RESOURCE_TABLE = collections.OrderedDict([
+    ('ElectricCharge', ('Electric Charge:', 'Wh', 23, False)),
+    ('LiquidFuel', ('Liquid Fuel:', 'L', 22, True)),
+    ('Oxidizer', ('Oxidizer:', 'L', 22, True)),
+    #The stage gauge for MonoPropellant seemed bugged
+    ('MonoPropellant', ('Monopropellant:', 'L', 22, False)),
+    ('IntakeAir', ('Intake Air:', 'L', 22, False)),
+    ('XenonGas', ('Xenon Gas:', 'hg', 23, False)),
+    ])
+
+
+def resource_info(name):
+    """
+    Returns the (title, units, text_width, stage) display parameters for a
+    resource by name, generating defaults for unknown resources.
+    """
+    try:
+        return RESOURCE_TABLE[name]
+    except KeyError:
+        return ('{}:'.format(name), '', 22, False)
+
+
+#The window over which burn rates are estimated, see kerminal.rolling
+BURN_WINDOW = '30s'
+
+
+def resource_api_vars(name):
+    """
+    Returns the dictionary of Telemachus API variables for a resource by name,
+    along with the rolling statistic keys estimating its rate of use.
+    """
+    api_vars = {'maximum': 'r.resourceMax[{}]'.format(name),
+                'current': 'r.resourceCurrent[{}]'.format(name),
+                'total': 'r.resource[{}]'.format(name)}
+    for amount in ('current', 'total'):
+        api_vars[amount + '_trend'] = '{}:trend{}'.format(api_vars[amount], BURN_WINDOW)
+        api_vars[amount + '_empty'] = '{}:empty{}'.format(api_vars[amount], BURN_WINDOW)
+    return api_vars
+
+
+class ResourceGauge(TitledGaugeWithTextValues):
     def __init__(self,
                  form,
                  parent,
+                 resource='ElectricCharge',
                  height=2,
-                 title_value='Electric Charge:',
-                 text_width=23,
+                 title_value=None,
+                 text_width=None,
                  text_theme='LABEL',
                  text_feed=None,
-                 units='Wh',
+                 units=None,
                  stage=False,
-                 api_vars={'maximum': 'r.resourceMax[ElectricCharge]',
-                           'current': 'r.resourceCurrent[ElectricCharge]',
-                           'total': 'r.resource[ElectricCharge]'},
+                 burn_width=16,
                  *args,
                  **kwargs):
 
-        self.units = units
-        self.api_vars = api_vars
-        self.stage = stage
-
-        super(ElectricChargeGauge, self).__init__(form,
-                                                  parent,
-                                                  height=height,
-                                                  title_value=title_value,
-                                                  text_width=text_width,
-                                                  text_theme='LABEL',
-                                                  gauge_theme_breakpoints=[0.2, 0.5],
-                                                  gauge_themes=['DANGER', 'CAUTION', 'SAFE'],
-                                                  *args,
-                                                  **kwargs)
-
-
-class LiquidFuelGauge(TitledGaugeWithTextValues):
-    def __init__(self,
-                 form,
-                 parent,
-                 height=2,
-                 title_value='Liquid Fuel:',
-                 text_width=22,
-                 text_theme='LABEL',
-                 text_feed=None,
-                 units='L',
-                 stage=False,
-                 api_vars={'maximum': 'r.resourceMax[LiquidFuel]',
-                           'current': 'r.resourceCurrent[LiquidFuel]',
-                           'total': 'r.resource[LiquidFuel]'},
-                 *args,
-                 **kwargs):
+        default_title, default_units, default_width, _ = resource_info(resource)
+        if title_value is None:
+            title_value = default_title
+        if text_width is None:
+            text_width = default_width
+        if units is None:
+            units = default_units
 
+        self.resource = resource
         self.units = units
-        self.api_vars = api_vars
+        self.api_vars = resource_api_vars(resource)
         self.stage = stage
 
-        super(LiquidFuelGauge, self).__init__(form,
-                                              parent,
-                                              height=height,
-                                              title_value=title_value,
-                                              text_width=text_width,
-                                              text_theme='LABEL',
-                                              gauge_theme_breakpoints=[0.2, 0.5],
-                                              gauge_themes=['DANGER', 'CAUTION', 'SAFE'],
-                                              *args,
-                                              **kwargs)
-
-
-class LiquidFuelStageGauge(LiquidFuelGauge):
-    def __init__(self,
-                 form,
-                 parent,
-                 stage=True,
-                 title_value=' Current Stage:',
-                 *args,
-                 **kwargs):
-        super(LiquidFuelStageGauge, self).__init__(form,
-                                                   parent,
-                                                   stage=stage,
-                                                   title_value=title_value,
-                                                   *args,
-                                                   **kwargs)
-
-
-class OxidizerGauge(TitledGaugeWithTextValues):
-    def __init__(self,
-                 form,
-                 parent,
-                 height=2,
-                 title_value='Oxidizer:',
-                 text_width=22,
-                 text_theme='LABEL',
-                 text_feed=None,
-                 units='L',
-                 stage=False,
-                 api_vars={'maximum': 'r.resourceMax[Oxidizer]',
-                           'current': 'r.resourceCurrent[Oxidizer]',
-                           'total': 'r.resource[Oxidizer]'},
-                 *args,
-                 **kwargs):
-
-        self.units = units
-        self.api_vars = api_vars
-        self.stage = stage
-
-        super(OxidizerGauge, self).__init__(form,
-                                              parent,
-                                              height=height,
-                                              title_value=title_value,
-                                              text_width=text_width,
-                                              text_theme='LABEL',
-                                              gauge_theme_breakpoints=[0.2, 0.5],
-                                              gauge_themes=['DANGER', 'CAUTION', 'SAFE'],
-                                              *args,
-                                              **kwargs)
-
-
-class OxidizerStageGauge(OxidizerGauge):
-    def __init__(self,
-                 form,
-                 parent,
-                 stage=True,
-                 title_value=' Current Stage:',
-                 *args,
-                 **kwargs):
-        super(OxidizerStageGauge, self).__init__(form,
-                                                   parent,
-                                                   stage=stage,
-                                                   title_value=title_value,
-                                                   *args,
-                                                   **kwargs)
-
-
-class MonopropellantGauge(TitledGaugeWithTextValues):
-    def __init__(self,
-                 form,
-                 parent,
-                 height=2,
-                 title_value='Monopropellant:',
-                 text_width=22,
-                 text_theme='LABEL',
-                 text_feed=None,
-                 units='L',
-                 stage=False,
-                 api_vars={'maximum': 'r.resourceMax[MonoPropellant]',
-                           'current': 'r.resourceCurrent[MonoPropellant]',
-                           'total': 'r.resource[MonoPropellant]'},
-                 *args,
-                 **kwargs):
+        super(ResourceGauge, self).__init__(form,
+                                            parent,
+                                            height=height,
+                                            title_value=title_value,
+                                            text_width=text_width,
+                                            text_theme='LABEL',
+                                            gauge_theme_breakpoints=[0.2, 0.5],
+                                            gauge_themes=['DANGER', 'CAUTION', 'SAFE'],
+                                            *args,
+                                            **kwargs)
 
-        self.units = units
-        self.api_vars = api_vars
-        self.stage = stage
+        #The rate of use and time until empty, following the values
+        self.burnvalues = self.add_widget(npyscreen2.TextField,
+                                          width=burn_width,
+                                          editable=False,
+                                          auto_manage=False)
 
-        super(MonopropellantGauge, self).__init__(form,
-                                              parent,
-                                              height=height,
-                                              title_value=title_value,
-                                              text_width=text_width,
-                                              text_theme='LABEL',
-                                              gauge_theme_breakpoints=[0.2, 0.5],
-                                              gauge_themes=['DANGER', 'CAUTION', 'SAFE'],
-                                              *args,
-                                              **kwargs)
+    def resize(self):
+        super(ResourceGauge, self).resize()
+        relx = self.textvalues.relx + self.textvalues.width + 1
+        self.burnvalues.multi_set(rely=self.rely + self.top_margin,
+                                  relx=relx,
+                                  max_height=self.height - self.top_margin - self.bottom_margin,
+                                  max_width=self.relx + self.width - self.right_margin - relx)
 
 
-#There appears to be some sort of bug with this
-class MonopropellantStageGauge(OxidizerGauge):
+class ResourceStageGauge(ResourceGauge):
     def __init__(self,
                  form,
                  parent,
@@ -182,78 +118,12 @@ class MonopropellantStageGauge(OxidizerGauge):
                  title_value=' Current Stage:',
                  *args,
                  **kwargs):
-        super(MonopropellantStageGauge, self).__init__(form,
-                                                   parent,
-                                                   stage=stage,
-                                                   title_value=title_value,
-                                                   *args,
-                                                   **kwargs)
-
-
-class IntakeAirGauge(TitledGaugeWithTextValues):
-    def __init__(self,
-                 form,
-                 parent,
-                 height=2,
-                 title_value='Intake Air:',
-                 text_width=22,
-                 text_theme='LABEL',
-                 text_feed=None,
-                 units='L',
-                 stage=False,
-                 api_vars={'maximum': 'r.resourceMax[IntakeAir]',
-                           'current': 'r.resourceCurrent[IntakeAir]',
-                           'total': 'r.resource[IntakeAir]'},
-                 *args,
-                 **kwargs):
-
-        self.units = units
-        self.api_vars = api_vars
-        self.stage = stage
-
-        super(IntakeAirGauge, self).__init__(form,
-                                              parent,
-                                              height=height,
-                                              title_value=title_value,
-                                              text_width=text_width,
-                                              text_theme='LABEL',
-                                              gauge_theme_breakpoints=[0.2, 0.5],
-                                              gauge_themes=['DANGER', 'CAUTION', 'SAFE'],
-                                              *args,
-                                              **kwargs)
-
-
-class XenonGasGauge(TitledGaugeWithTextValues):
-    def __init__(self,
-                 form,
-                 parent,
-                 height=2,
-                 title_value='Xenon Gas:',
-                 text_width=23,
-                 text_theme='LABEL',
-                 text_feed=None,
-                 units='hg',
-                 stage=False,
-                 api_vars={'maximum': 'r.resourceMax[XenonGas]',
-                           'current': 'r.resourceCurrent[XenonGas]',
-                           'total': 'r.resource[XenonGas]'},
-                 *args,
-                 **kwargs):
-
-        self.units = units
-        self.api_vars = api_vars
-        self.stage = stage
-
-        super(XenonGasGauge, self).__init__(form,
-                                              parent,
-                                              height=height,
-                                              title_value=title_value,
-                                              text_width=text_width,
-                                              text_theme='LABEL',
-                                              gauge_theme_breakpoints=[0.2, 0.5],
-                                              gauge_themes=['DANGER', 'CAUTION', 'SAFE'],
-                                              *args,
-                                              **kwargs)
+        super(ResourceStageGauge, self).__init__(form,
+                                                 parent,
+                                                 stage=stage,
+                                                 title_value=title_value,
+                                                 *args,
+                                                 **kwargs)
 
 
 class ThrottleGauge(TitledGaugeWithTextValues):
@@ -282,4 +152,4 @@ class ThrottleGauge(TitledGaugeWithTextValues):
                                             gauge_theme_breakpoints=[],
                                             gauge_themes=['COOLINVERSE'],
                                             *args,
-                                            **kwargs)
\ No newline at end of file
+                                            **kwargs)
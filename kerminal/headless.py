@@ -0,0 +1,270 @@
+# encoding: utf-8
+
+"""
+This module provides the headless mode of Kerminal, which maintains the
+connection to Telemachus and records data without any user interface.
+
+The daemon may be controlled by signals:
+  SIGINT, SIGTERM    Shut down cleanly, closing the data log.
+  SIGUSR1            Toggle data logging on and off.
+
+or, optionally, through a local control socket which accepts the same command
+lines as the Kerminal Command Line (one per line) and replies with any
+resulting messages. "quit" and "exit" shut down the daemon.
+"""
+
+from .commands import KerminalCommands
+from .communication import CommsThread
+
+import logging
+import os
+import signal
+import socketserver
+import threading
+import time
+
+log = logging.getLogger('kerminal.headless')
+
+
+class HeadlessForm(object):
+    """
+    Stands in for KerminalForm so that the Kerminal commands may be used
+    without a user interface. Messages are written to the log and collected
+    so they may be returned to a control socket client.
+    """
+    def __init__(self, parent_app):
+        self.parent_app = parent_app
+        self.messages = []
+
+    def _message(self, level, prefix, msg):
+        log.log(level, msg)
+        self.messages.append('{0}: {1}'.format(prefix, msg))
+
+    def info(self, msg):
+        self._message(logging.INFO, 'INFO', msg)
+
+    def warning(self, msg):
+        self._message(logging.WARNING, 'WARNING', msg)
+
+    def error(self, msg):
+        self._message(logging.ERROR, 'ERROR', msg)
+
+    def critical(self, msg):
+        self._message(logging.CRITICAL, 'CRITICAL', msg)
+
+    @property
+    def action_controller(self):
+        return self.parent_app.action_controller
+
+    def post_event(self, handler, *args):
+        #There is no UI thread to defer to
+        handler(*args)
+
+    def connecting(self, host, port):
+        self.info('Making connection to {0}:{1}'.format(host, port))
+
+    def show_text(self, msg=None):
+        if msg is not None:
+            self.messages.append(msg)
+
+    def show_smart(self):
+        pass
+
+    def collect(self):
+        messages, self.messages = self.messages, []
+        return messages
+
+
+class ControlHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        daemon = self.server.daemon
+        for line in self.rfile:
+            command_line = line.decode('utf-8').strip()
+            if not command_line:
+                continue
+            reply = daemon.execute(command_line)
+            self.wfile.write((reply + '\n').encode('utf-8'))
+            if daemon.stopped.is_set():
+                return
+
+
+class ControlServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class HeadlessDaemon(object):
+    """
+    Runs the CommsThread, with data logging, in the absence of a user
+    interface. This object mimics the small part of the npyscreen2.App
+    interface that the Kerminal commands make use of.
+    """
+    def __init__(self,
+                 address='localhost',
+                 port=8085,
+                 data_file=None,
+                 log_vars=None,
+                 rate=None,
+                 control_path=None,
+                 retry=None,
+                 relay=None,
+                 segment=None,
+                 metrics=None,
+                 plugins=True,
+                 comms_process=False,
+                 loop_factory=None):
+        self.address = address
+        self.port = port
+        self.data_file = data_file
+        self.log_vars = [] if log_vars is None else log_vars
+        self.rate = rate
+        self.control_path = control_path
+        self.retry = retry
+        self.relay = relay  # Keyword arguments for CommsThread.start_relay
+        self.segment = segment  # Index file of the shared memory segment
+        self.metrics = metrics  # Keyword arguments for CommsThread.start_metrics
+        self.load_plugins = plugins
+
+        self.stopped = threading.Event()
+        self.command_lock = threading.Lock()
+        self.control_server = None
+
+        if comms_process:
+            from .comms_process import ProcessCommsThread
+            self.stream = ProcessCommsThread(address=address, port=port,
+                                             loop_factory=loop_factory)
+        else:
+            self.stream = CommsThread(address=address, port=port,
+                                      loop_factory=loop_factory)
+        self.form = HeadlessForm(self)
+        self.action_controller = KerminalCommands(self.form, self)
+
+    #These two methods allow the "quit" command to stop the daemon
+    def set_next_form(self, form_id):
+        if form_id is None:
+            self.stop()
+
+    def switch_form_now(self):
+        pass
+
+    def execute(self, command_line):
+        """
+        Executes a command line as if it were typed at the Kerminal Command
+        Line and returns the resulting messages as a string.
+        """
+        with self.command_lock:
+            try:
+                self.action_controller.process_command_complete(command_line,
+                                                                None)
+            except Exception as e:
+                log.exception(e)
+                self.form.error('command "{}" failed'.format(command_line))
+            return '\n'.join(self.form.collect())
+
+    def stop(self, *args):
+        log.info('Headless daemon stopping')
+        self.stopped.set()
+
+    def toggle_logging(self, *args):
+        self.stream.data_log_on = not self.stream.data_log_on
+        log.info('Data logging toggled to {0}'.format(self.stream.data_log_on))
+
+    def install_signal_handlers(self):
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+        if hasattr(signal, 'SIGUSR1'):  # Not available on Windows
+            signal.signal(signal.SIGUSR1, self.toggle_logging)
+
+    def start_control_server(self):
+        if os.path.exists(self.control_path):
+            os.remove(self.control_path)
+        self.control_server = ControlServer(self.control_path, ControlHandler)
+        self.control_server.daemon = self
+        control_thread = threading.Thread(target=self.control_server.serve_forever)
+        control_thread.daemon = True
+        control_thread.start()
+        log.info('Control socket listening at {0}'.format(self.control_path))
+
+    def request_connection(self):
+        """
+        Configures the logging and subscriptions for a fresh connection and
+        instructs the CommsThread to connect.
+        """
+        #Until the server's version is confirmed every variable is allowed
+        for var in self.log_vars:
+            self.stream.data_log_vars.add(var)
+        if self.rate is not None:
+            self.stream.msg_queue.put({'rate': self.rate})
+        self.stream.address = self.address
+        self.stream.port = self.port
+        self.stream.connect_event.clear()
+        self.stream.make_connection.set()
+        log.info('Making connection to {0}:{1}'.format(self.address, self.port))
+
+    def run(self):
+        if self.data_file is not None:
+            self.stream.data_log_file = self.data_file
+        self.stream.data_log_on = True
+
+        self.install_signal_handlers()
+        if self.control_path is not None:
+            self.start_control_server()
+
+        if self.load_plugins:
+            self.stream.plugins.discover()
+            self.stream.plugins.start(self.stream, self.action_controller)
+        self.stream.start()
+        if self.relay is not None:
+            relay = self.stream.start_relay(**self.relay)
+            if relay.error is not None:
+                log.error('Relay not started: {0}'.format(relay.error))
+        if self.segment is not None:
+            try:
+                self.stream.start_segment(self.segment)
+            except (OSError, RuntimeError) as e:
+                log.error('Shared memory not started: {0}'.format(e))
+        if self.metrics is not None:
+            try:
+                self.stream.start_metrics(**self.metrics)
+            except OSError as e:
+                log.error('Metrics not started: {0}'.format(e))
+        self.request_connection()
+
+        #Waiting with a timeout keeps the main thread responsive to signals
+        waited = 0
+        while not self.stopped.wait(1):
+            if self.stream.connected or self.stream.make_connection.is_set():
+                waited = 0
+                continue
+            #The connection failed or was lost
+            if self.retry is None:
+                log.error('Connection to {0}:{1} lost'.format(self.address,
+                                                               self.port))
+                break
+            waited += 1
+            if waited >= self.retry:
+                waited = 0
+                self.request_connection()
+
+        self.shutdown()
+
+    def shutdown(self):
+        if self.control_server is not None:
+            self.control_server.shutdown()
+            self.control_server.server_close()
+            try:
+                os.remove(self.control_path)
+            except OSError:
+                pass
+        self.stream.data_log_on = False
+        if self.stream.relay is not None:
+            self.stream.relay.stop()
+        if self.stream.metrics_server is not None:
+            self.stream.metrics_server.stop()
+        self.stream.plugins.stop()
+        self.stream.close_connection()
+        #Give the closing handshake a moment so the data log is flushed
+        for _ in range(50):
+            if not self.stream.connected:
+                break
+            time.sleep(0.1)
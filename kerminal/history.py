@@ -0,0 +1,146 @@
+# encoding: utf-8
+
+"""
+Persistent command history for the Kerminal Command Line.
+
+Commands are appended to a history file as they are executed, and the file is
+only read when the history is first used. Once it holds twice the entries kept,
+it is rewritten with only those, so it is never long to read. Reverse search is served by a
+trigram index, built on the first search and extended as commands are added,
+so that searches stay fast however long the history grows.
+"""
+
+import array
+import bisect
+import logging
+import os
+
+log = logging.getLogger('kerminal.history')
+
+DEFAULT_HISTORY_FILE = os.path.join(os.path.expanduser('~'), '.kerminal_history')
+
+
+def _trigrams(text):
+    return set(text[i:i + 3] for i in range(len(text) - 2))
+
+
+class CommandHistory(object):
+    """
+    A list-like history of command lines, backed by an append-only file.
+    Indexing works as for a list, including negative indices.
+    """
+    def __init__(self, path=DEFAULT_HISTORY_FILE, max_entries=50000):
+        self.path = path
+        self.max_entries = max_entries
+        self._entries = None  # Loaded on first use
+        self._index = None  # trigram -> array of entry positions, ascending
+
+    @property
+    def entries(self):
+        if self._entries is None:
+            self._entries = self._load()
+        return self._entries
+
+    def _load(self):
+        if self.path is None or not os.path.isfile(self.path):
+            return []
+        try:
+            with open(self.path, 'r', encoding='utf-8', errors='replace') as inf:
+                lines = [line.rstrip('\n') for line in inf]
+        except OSError as e:
+            log.warning('Could not read history file: {0}'.format(e))
+            return []
+        lines = [line for line in lines if line]
+        if len(lines) > 2 * self.max_entries:
+            self._rewrite(lines[-self.max_entries:])
+        return lines[-self.max_entries:]
+
+    def _rewrite(self, lines):
+        temp_file = self.path + '.tmp'
+        try:
+            with open(temp_file, 'w', encoding='utf-8') as outf:
+                outf.writelines(line + '\n' for line in lines)
+            os.replace(temp_file, self.path)
+        except OSError as e:
+            log.warning('Could not rewrite history file: {0}'.format(e))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, index):
+        return self.entries[index]
+
+    def append(self, line):
+        line = line.strip()
+        if not line:
+            return
+        entries = self.entries
+        if entries and entries[-1] == line:  # Ignore immediate repeats
+            return
+        entries.append(line)
+        if self._index is not None:
+            self._add_to_index(len(entries) - 1, line)
+        if len(entries) > 2 * self.max_entries:
+            self._compact()
+        elif self.path is not None:
+            try:
+                with open(self.path, 'a', encoding='utf-8') as outf:
+                    outf.write(line + '\n')
+            except OSError as e:
+                log.warning('Could not write history file: {0}'.format(e))
+
+    def _compact(self):
+        #Keeps only the last max_entries, in memory and in the file; as
+        #positions change, the index is built again on the next search
+        del self._entries[:-self.max_entries]
+        self._index = None
+        if self.path is not None:
+            self._rewrite(self._entries)
+
+    def _add_to_index(self, position, line):
+        for trigram in _trigrams(line):
+            postings = self._index.get(trigram)
+            if postings is None:
+                postings = self._index[trigram] = array.array('l')
+            postings.append(position)
+
+    def _build_index(self):
+        self._index = {}
+        for position, line in enumerate(self.entries):
+            self._add_to_index(position, line)
+
+    def search(self, text, before=None):
+        """
+        Returns the position of the most recent entry containing text, looking
+        only at entries earlier than position before (if given), or None.
+        """
+        entries = self.entries
+        if before is None or before > len(entries):
+            before = len(entries)
+        if len(text) < 3:  # Too short for the index, though matches are common
+            for position in range(before - 1, -1, -1):
+                if text in entries[position]:
+                    return position
+            return None
+
+        if self._index is None:
+            self._build_index()
+        postings = []
+        for trigram in _trigrams(text):
+            found = self._index.get(trigram)
+            if found is None:
+                return None
+            postings.append(found)
+        #Walk back through the shortest list, checking the others by bisection
+        postings.sort(key=len)
+        shortest, others = postings[0], postings[1:]
+        for i in range(bisect.bisect_left(shortest, before) - 1, -1, -1):
+            position = shortest[i]
+            for other in others:
+                j = bisect.bisect_left(other, position)
+                if j == len(other) or other[j] != position:
+                    break
+            else:
+                if text in entries[position]:
+                    return position
+        return None
@@ -0,0 +1,100 @@
+# encoding: utf-8
+
+"""
+Internal counters, and the text metrics page (in the Prometheus exposition
+format) presenting them with selected live values, for scraping by monitoring
+tools; the page is served by kerminal.metrics_server.
+
+The page is rendered from a template made once for the selected variables, so
+a request reads only the counters and those variables; a scrape every second
+costs next to nothing.
+"""
+
+#Variables served when none are selected
+DEFAULT_VARIABLES = ['v.altitude', 'v.verticalSpeed', 'v.surfaceSpeed',
+                     'v.geeForce', 'v.dynamicPressure']
+
+#(name, type, help) of the counters, in the order they are served
+_COUNTERS = [('kerminal_frames_received_total', 'counter',
+              'Messages received from the server.'),
+             ('kerminal_decode_failures_total', 'counter',
+              'Messages from the server which could not be decoded.'),
+             ('kerminal_outbound_queue_depth', 'gauge',
+              'Items waiting to be sent to the server.'),
+             ('kerminal_subscriptions_active', 'gauge',
+              'Api variables subscribed.'),
+             ('kerminal_log_rows_written_total', 'counter',
+              'Rows written to the data log.'),
+             ('kerminal_log_rows_dropped_total', 'counter',
+              'Rows which could not be written to the data log.'),
+             ('kerminal_render_seconds_sum', 'counter',
+              'Time spent updating and drawing the interface.'),
+             ('kerminal_render_seconds_count', 'counter',
+              'Updates of the interface.'),
+             ]
+
+
+def _sample(value):
+    if isinstance(value, float):
+        return repr(value)
+    if isinstance(value, int):  # Including bool
+        return str(int(value))
+    return 'NaN'
+
+
+class Metrics(object):
+    """
+    The internal counters. They are plain attributes, incremented by the thread
+    which owns them, so counting costs no more than an addition.
+    """
+    def __init__(self):
+        self.frames_received = 0
+        self.decode_failures = 0
+        self.log_rows_written = 0
+        self.log_rows_dropped = 0
+        self.render_seconds = 0.0
+        self.renders = 0
+
+    def render(self, seconds):
+        self.render_seconds += seconds
+        self.renders += 1
+
+
+class MetricsPage(object):
+    """
+    Renders the metrics page for a stream (a CommsThread) and a list of api
+    variables.
+    """
+    def __init__(self, stream, variables=None):
+        self.stream = stream
+        self.variables = list(DEFAULT_VARIABLES if variables is None else variables)
+        lines = []
+        for name, kind, description in _COUNTERS:
+            lines.append('# HELP {0} {1}'.format(name, description))
+            lines.append('# TYPE {0} {1}'.format(name, kind))
+            lines.append(name + ' {}')
+        if self.variables:
+            lines.append('# HELP kerminal_telemetry Live values of api variables.')
+            lines.append('# TYPE kerminal_telemetry gauge')
+            for key in self.variables:
+                label = key.replace('\\', '\\\\').replace('"', '\\"')
+                #Braces are doubled, the template being filled by format
+                label = label.replace('{', '{{').replace('}', '}}')
+                lines.append('kerminal_telemetry{{key="' + label + '"}} {}')
+        self.template = '\n'.join(lines) + '\n'
+
+    def render(self):
+        stream = self.stream
+        metrics = stream.metrics
+        manager = stream.subscription_manager
+        data = stream.data
+        values = [metrics.frames_received,
+                  metrics.decode_failures,
+                  stream.msg_queue.qsize(),
+                  sum(1 for count in list(manager.map.values()) if count > 0),
+                  metrics.log_rows_written,
+                  metrics.log_rows_dropped,
+                  metrics.render_seconds,
+                  metrics.renders]
+        values.extend(data.get(key) for key in self.variables)
+        return self.template.format(*[_sample(v) for v in values])
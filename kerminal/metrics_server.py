@@ -0,0 +1,60 @@
+# encoding: utf-8
+
+"""
+The optional HTTP listener serving the metrics page, at "/metrics".
+"""
+
+import http.server
+import logging
+import socketserver
+import threading
+
+from .metrics import MetricsPage
+
+log = logging.getLogger('kerminal.metrics')
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.page.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug(format % args)
+
+
+class MetricsServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """
+    Serves a MetricsPage; the selected variables are subscribed for as long as
+    the server runs.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, stream, variables=None):
+        http.server.HTTPServer.__init__(self, address, MetricsHandler)
+        self.stream = stream
+        self.page = MetricsPage(stream, variables)
+        stream.add_subscriber(self)
+
+    def subscribed_keys(self):
+        return self.page.variables
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        log.info('Metrics served at http://{0}:{1}/metrics'.format(*self.server_address[:2]))
+        return thread
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self.stream.remove_subscriber(self)
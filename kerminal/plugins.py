@@ -0,0 +1,319 @@
+# encoding: utf-8
+
+"""
+Plugins add telemetry consumers and commands to Kerminal without changes to
+Kerminal itself. A plugin is registered by its package as an entry point in
+the "kerminal.plugins" group:
+
+    setup(...,
+          entry_points={'kerminal.plugins': ['mylogger = mypackage:MyLogger']})
+
+The entry point names a class (created with no arguments), or any other object,
+with some of the following attributes:
+
+  consume(frame)   Called with each message from the server, a read-only
+                   mapping of api variables to values, after it is processed.
+  keys             The api variables the plugin needs, subscribed for it.
+                   Process plugins receive only these (and "sys.time").
+  commands         A dict of command names to command functions, written as
+                   those in kerminal.commands, added to the command line.
+  mode             "thread" (the default) or "process".
+  queue_size       The number of frames which may wait for the plugin; when
+                   it falls behind, its oldest frames are dropped.
+  start(), stop()  Called as the plugin is started and stopped, in the
+                   thread or process which consumes its frames.
+
+Each plugin consumes frames in its own worker, a thread or a process, fed by a
+bounded queue, so a slow plugin loses its own frames rather than slowing the
+reception of messages. "plugins" on the command line shows their state.
+"""
+
+import collections
+import importlib
+import logging
+import queue
+import threading
+import time
+import types
+
+log = logging.getLogger('kerminal.plugins')
+
+ENTRY_POINT_GROUP = 'kerminal.plugins'
+DEFAULT_QUEUE_SIZE = 64
+
+EntryPoint = collections.namedtuple('EntryPoint', ['name', 'value'])
+
+
+def entry_points(group=ENTRY_POINT_GROUP):
+    """
+    Returns the installed EntryPoints of the group.
+    """
+    try:
+        from importlib import metadata
+    except ImportError:  # Before Python 3.8
+        import pkg_resources
+        return [EntryPoint(ep.name, '{0}:{1}'.format(ep.module_name, '.'.join(ep.attrs)))
+                for ep in pkg_resources.iter_entry_points(group)]
+    found = metadata.entry_points()
+    if hasattr(found, 'select'):
+        found = found.select(group=group)
+    else:  # Before Python 3.10, a dict by group
+        found = found.get(group, [])
+    return [EntryPoint(ep.name, ep.value) for ep in found]
+
+
+def load(value):
+    """
+    Returns the plugin for an entry point value, as "package.module:Name".
+    """
+    module_name, _, attrs = value.partition(':')
+    obj = importlib.import_module(module_name.strip())
+    for attr in filter(None, attrs.strip().split('.')):
+        obj = getattr(obj, attr)
+    return obj() if isinstance(obj, type) else obj
+
+
+def _call_hook(plugin, name):
+    hook = getattr(plugin, name, None)
+    if hook is not None:
+        hook()
+
+
+class WorkerStats(object):
+    """
+    What a worker has done: frames consumed, dropped and failed, the CPU
+    seconds spent consuming them, and the lag (seconds from a frame's arrival
+    to its consumption) of the last frame and the worst one.
+    """
+    fields = ('consumed', 'dropped', 'errors', 'cpu', 'lag', 'max_lag')
+
+    def __init__(self):
+        for field in self.fields:
+            setattr(self, field, 0)
+
+    def consumed_frame(self, arrival, cpu):
+        self.consumed += 1
+        self.cpu += cpu
+        if arrival is not None:
+            self.lag = time.time() - arrival
+            self.max_lag = max(self.max_lag, self.lag)
+
+
+class ThreadWorker(object):
+    mode = 'thread'
+
+    def __init__(self, name, plugin, keys, queue_size):
+        self.name = name
+        self.plugin = plugin
+        self.keys = keys
+        self.frames = queue.Queue(maxsize=queue_size)
+        self.stats = WorkerStats()
+        self.thread = threading.Thread(target=self.run, name='plugin ' + name)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.offer(None)
+
+    def backlog(self):
+        return self.frames.qsize()
+
+    def offer(self, frame):
+        #The oldest frame makes way, so the plugin sees the latest data
+        while True:
+            try:
+                self.frames.put_nowait(frame)
+                return
+            except queue.Full:
+                try:
+                    self.frames.get_nowait()
+                    self.stats.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def run(self):
+        try:
+            _call_hook(self.plugin, 'start')
+        except Exception as e:
+            log.exception(e)
+        consume = self.plugin.consume
+        while True:
+            frame = self.frames.get()
+            if frame is None:
+                break
+            begin = time.thread_time()
+            try:
+                consume(frame)
+            except Exception as e:
+                self.stats.errors += 1
+                log.exception(e)
+            self.stats.consumed_frame(frame.get('sys.time'), time.thread_time() - begin)
+        try:
+            _call_hook(self.plugin, 'stop')
+        except Exception as e:
+            log.exception(e)
+
+
+def _process_main(value, frames, shared):
+    #The plugin is loaded afresh in the child process
+    plugin = load(value)
+    stats = WorkerStats()
+    _call_hook(plugin, 'start')
+    while True:
+        frame = frames.get()
+        if frame is None:
+            break
+        begin = time.process_time()
+        try:
+            plugin.consume(types.MappingProxyType(frame))
+        except Exception as e:
+            stats.errors += 1
+            log.exception(e)
+        stats.consumed_frame(frame.get('sys.time'), time.process_time() - begin)
+        shared[:] = [stats.consumed, stats.errors, stats.cpu, stats.lag, stats.max_lag]
+    _call_hook(plugin, 'stop')
+
+
+class ProcessWorker(object):
+    mode = 'process'
+
+    def __init__(self, name, keys, queue_size, value):
+        import multiprocessing  # Only needed by process plugins
+        self.name = name
+        self.keys = keys
+        self.frames = multiprocessing.Queue(maxsize=queue_size)
+        #consumed, errors, cpu, lag, max_lag; written by the child process
+        self.shared = multiprocessing.Array('d', 5, lock=False)
+        self.dropped = 0
+        self.process = multiprocessing.Process(target=_process_main,
+                                               args=(value, self.frames, self.shared),
+                                               name='plugin ' + name)
+        self.process.daemon = True
+
+    @property
+    def stats(self):
+        stats = WorkerStats()
+        (stats.consumed, stats.errors, stats.cpu, stats.lag,
+         stats.max_lag) = self.shared[:]
+        stats.consumed, stats.errors = int(stats.consumed), int(stats.errors)
+        stats.dropped = self.dropped
+        if not self.process.is_alive() and self.process.exitcode:
+            stats.errors += 1  # The process failed
+        return stats
+
+    def start(self):
+        self.process.start()
+
+    def stop(self):
+        try:
+            self.frames.put(None, timeout=1)
+        except queue.Full:
+            self.process.terminate()
+
+    def backlog(self):
+        try:
+            return self.frames.qsize()
+        except NotImplementedError:  # macOS
+            return 0
+
+    def offer(self, frame):
+        #Frames are pickled to the process, so only its keys are sent
+        if self.keys:
+            arrival = frame.get('sys.time')
+            frame = {k: frame[k] for k in self.keys if k in frame}
+            frame['sys.time'] = arrival
+        else:
+            frame = dict(frame)
+        #The oldest frame makes way, as for a ThreadWorker
+        try:
+            self.frames.put_nowait(frame)
+        except queue.Full:
+            self.dropped += 1
+            try:
+                self.frames.get_nowait()
+                self.frames.put_nowait(frame)
+            except (queue.Empty, queue.Full):  # The oldest is still in the pipe
+                pass
+
+
+class PluginManager(object):
+    """
+    The installed plugins and their workers. `publish` is called by the
+    communication thread with each message.
+    """
+    def __init__(self):
+        self.workers = []
+        self.commands = {}
+        self.failed = {}  # name -> reason the plugin could not be loaded
+        self.started = False
+        self.stream = None
+
+    def __bool__(self):
+        return bool(self.workers)
+
+    def discover(self, group=ENTRY_POINT_GROUP):
+        """
+        Loads the installed plugins, without starting them.
+        """
+        try:
+            found = entry_points(group)
+        except Exception as e:
+            log.exception(e)
+            return
+        for entry_point in found:
+            self.add(entry_point.name, entry_point.value)
+
+    def add(self, name, value):
+        """
+        Loads a plugin from its entry point value, as "package.module:Name".
+        """
+        try:
+            plugin = load(value)
+        except Exception as e:
+            log.exception(e)
+            self.failed[name] = str(e) or e.__class__.__name__
+            return None
+        name = getattr(plugin, 'name', name)
+        queue_size = getattr(plugin, 'queue_size', DEFAULT_QUEUE_SIZE)
+        keys = list(getattr(plugin, 'keys', ()) or ())
+        worker = None
+        if hasattr(plugin, 'consume'):
+            if getattr(plugin, 'mode', 'thread') == 'process':
+                worker = ProcessWorker(name, keys, queue_size, value)
+            else:
+                worker = ThreadWorker(name, plugin, keys, queue_size)
+            self.workers.append(worker)
+        for command, func in (getattr(plugin, 'commands', None) or {}).items():
+            self.commands[command] = func
+        log.info('Plugin {0} loaded'.format(name))
+        return worker
+
+    def start(self, stream, action_controller=None):
+        """
+        Starts the workers, subscribing their keys on the stream, and adds the
+        plugins' commands to the action controller (KerminalCommands).
+        """
+        if self.started:
+            return
+        self.started = True
+        if action_controller is not None:
+            action_controller.add_commands(self.commands)
+        self.stream = stream
+        stream.add_subscriber(self)
+        for worker in self.workers:
+            worker.start()
+
+    def subscribed_keys(self):
+        #Each worker's keys are subscribed for it
+        return [key for worker in self.workers for key in worker.keys]
+
+    def stop(self):
+        for worker in self.workers:
+            worker.stop()
+
+    def publish(self, msg):
+        frame = types.MappingProxyType(msg)
+        for worker in self.workers:
+            worker.offer(frame)
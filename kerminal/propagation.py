@@ -0,0 +1,222 @@
+# encoding: utf-8
+
+"""
+Kepler propagation of the craft's orbit from its orbital elements (o.sma,
+o.eccentricity, o.maae, o.epoch, o.period, and for positions o.inclination,
+o.lan, o.argumentOfPeriapsis).
+
+This lets the interface advance values such as the time to apoapsis between
+messages from the server, so that the display stays smooth at a low rate. The
+propagator works on arrays of times when NumPy is available, such as for
+predicting points along the orbit, and on single times with or without it.
+"""
+
+import math
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+TAU = 2 * math.pi
+
+ELEMENTS = ['o.sma', 'o.eccentricity', 'o.maae', 'o.epoch', 'o.period']
+ORIENTATION = ['o.inclination', 'o.lan', 'o.argumentOfPeriapsis']
+
+#The quantities a KeplerPropagator can give, by the api variable they match
+QUANTITIES = {'o.timeToAp': 'time_to_apoapsis',
+              'o.timeToPe': 'time_to_periapsis',
+              'o.relativeVelocity': 'speed',
+              'o.trueAnomaly': 'true_anomaly'}
+
+#Quantities wrapping around, by their cycle (None for the orbital period)
+_CYCLIC = {'o.timeToAp': None,
+           'o.timeToPe': None,
+           'o.trueAnomaly': 360.0}
+
+
+def _solve_kepler_scalar(mean_anomaly, eccentricity, tolerance=1e-12):
+    E = mean_anomaly if eccentricity < 0.8 else math.pi
+    for _ in range(50):
+        delta = ((E - eccentricity * math.sin(E) - mean_anomaly) /
+                 (1 - eccentricity * math.cos(E)))
+        E -= delta
+        if abs(delta) < tolerance:
+            break
+    return E
+
+
+def _solve_kepler_array(mean_anomaly, eccentricity, tolerance=1e-12):
+    if eccentricity < 0.8:
+        E = mean_anomaly.copy()
+    else:
+        E = numpy.full_like(mean_anomaly, math.pi)
+    for _ in range(50):
+        delta = ((E - eccentricity * numpy.sin(E) - mean_anomaly) /
+                 (1 - eccentricity * numpy.cos(E)))
+        E -= delta
+        if numpy.max(numpy.abs(delta)) < tolerance:
+            break
+    return E
+
+
+class KeplerPropagator(object):
+    """
+    An elliptical orbit given by its semimajor axis (m), eccentricity, mean
+    anomaly at epoch (radians), epoch (s) and period (s). Methods take a
+    universal time, or with NumPy an array of them.
+    """
+    def __init__(self, sma, eccentricity, maae, epoch, period,
+                 inclination=0.0, lan=0.0, argument_of_periapsis=0.0):
+        if not 0 <= eccentricity < 1 or sma <= 0 or period <= 0:
+            raise ValueError('not an elliptical orbit')
+        self.sma = sma
+        self.eccentricity = eccentricity
+        self.maae = maae
+        self.epoch = epoch
+        self.period = period
+        self.mean_motion = TAU / period
+        self.mu = self.mean_motion ** 2 * sma ** 3
+        self.orientation = (math.radians(inclination), math.radians(lan),
+                            math.radians(argument_of_periapsis))
+
+    @classmethod
+    def from_data(cls, data):
+        """
+        Returns the propagator for the elements in the data dictionary, or
+        None if they are missing or do not describe an elliptical orbit.
+        """
+        try:
+            elements = [float(data[key]) for key in ELEMENTS]
+            orientation = [float(data.get(key, 0.0)) for key in ORIENTATION]
+            return cls(*(elements + orientation))
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def _is_array(self, t):
+        return numpy is not None and isinstance(t, numpy.ndarray)
+
+    def mean_anomaly(self, t):
+        M = self.maae + self.mean_motion * (t - self.epoch)
+        return M % TAU
+
+    def eccentric_anomaly(self, t):
+        M = self.mean_anomaly(t)
+        if self._is_array(M):
+            return _solve_kepler_array(M, self.eccentricity)
+        return _solve_kepler_scalar(M, self.eccentricity)
+
+    def true_anomaly(self, t):
+        """
+        The true anomaly in degrees, from 0 to 360.
+        """
+        E = self.eccentric_anomaly(t)
+        e = self.eccentricity
+        factor = math.sqrt((1 + e) / (1 - e))
+        if self._is_array(E):
+            nu = 2 * numpy.arctan(factor * numpy.tan(E / 2))
+            return numpy.degrees(nu % TAU)
+        return math.degrees((2 * math.atan(factor * math.tan(E / 2))) % TAU)
+
+    def radius(self, t):
+        E = self.eccentric_anomaly(t)
+        cos = numpy.cos if self._is_array(E) else math.cos
+        return self.sma * (1 - self.eccentricity * cos(E))
+
+    def speed(self, t):
+        r = self.radius(t)
+        sqrt = numpy.sqrt if self._is_array(r) else math.sqrt
+        return sqrt(self.mu * (2 / r - 1 / self.sma))
+
+    def time_to_periapsis(self, t):
+        return ((TAU - self.mean_anomaly(t)) % TAU) / self.mean_motion
+
+    def time_to_apoapsis(self, t):
+        return ((math.pi - self.mean_anomaly(t)) % TAU) / self.mean_motion
+
+    def positions(self, times):
+        """
+        Returns the positions (x, y, z) in meters relative to the orbited
+        body's center at each of times, as an array of shape (len(times), 3).
+        Requires NumPy.
+        """
+        if numpy is None:
+            raise RuntimeError('predicting positions requires NumPy')
+        times = numpy.asarray(times, dtype=float)
+        E = self.eccentric_anomaly(times)
+        e, a = self.eccentricity, self.sma
+        #Position in the orbital plane, periapsis along x
+        x = a * (numpy.cos(E) - e)
+        y = a * math.sqrt(1 - e * e) * numpy.sin(E)
+        inc, lan, argpe = self.orientation
+        cw, sw = math.cos(argpe), math.sin(argpe)
+        co, so = math.cos(lan), math.sin(lan)
+        ci, si = math.cos(inc), math.sin(inc)
+        rotation = numpy.array([[co * cw - so * sw * ci, -co * sw - so * cw * ci],
+                                [so * cw + co * sw * ci, -so * sw + co * cw * ci],
+                                [sw * si, cw * si]])
+        return numpy.stack([x, y]).T.dot(rotation.T)
+
+    def quantity(self, key, t):
+        """
+        The value of the api variable key (one of QUANTITIES) at time t.
+        """
+        return getattr(self, QUANTITIES[key])(t)
+
+
+class OrbitInterpolator(object):
+    """
+    Advances orbital values from the last message to the present. The game
+    clock's rate (which time warp changes) is estimated from successive
+    messages, and values are advanced by at most max_extrapolation seconds of
+    wall clock time, in case the server has gone quiet.
+    """
+    def __init__(self, data, max_extrapolation=10.0):
+        self.data = data
+        self.max_extrapolation = max_extrapolation
+        self.clock = None  # (universal time, wall time) of the last message
+        self.clock_rate = 1.0
+        self._elements = None
+        self.propagator = None
+
+    def _observe(self):
+        #Called as values are read, which is after each new message
+        ut, wall = self.data.get('t.universalTime'), self.data.get('sys.time')
+        if not isinstance(ut, (int, float)) or not isinstance(wall, (int, float)):
+            return None
+        if self.clock is not None and self.clock != (ut, wall):
+            last_ut, last_wall = self.clock
+            if wall > last_wall and ut >= last_ut:
+                self.clock_rate = (ut - last_ut) / (wall - last_wall)
+        self.clock = (ut, wall)
+
+        elements = tuple(self.data.get(key) for key in ELEMENTS + ORIENTATION)
+        if elements != self._elements:
+            self._elements = elements
+            self.propagator = KeplerPropagator.from_data(self.data)
+        return ut, wall
+
+    def value(self, key, now=None):
+        """
+        Returns the value of key (one of QUANTITIES) advanced to now (by the
+        wall clock), or its last received value if it cannot be advanced.
+        """
+        last = self.data.get(key)
+        observed = self._observe()
+        if (observed is None or self.propagator is None or
+                not isinstance(last, (int, float)) or self.data.get('p.paused')):
+            return last
+        ut, wall = observed
+        if now is None:
+            now = time.time()
+        elapsed = min(max(now - wall, 0.0), self.max_extrapolation)
+        if not elapsed:
+            return last
+        #The change is predicted, so it is anchored to the exact last value
+        future = ut + elapsed * self.clock_rate
+        value = last + (self.propagator.quantity(key, future) -
+                        self.propagator.quantity(key, ut))
+        if key in _CYCLIC:  # Keep countdowns and angles within their cycle
+            value %= self.propagator.period if _CYCLIC[key] is None else _CYCLIC[key]
+        return value
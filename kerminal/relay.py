@@ -0,0 +1,283 @@
+# encoding: utf-8
+
+"""
+A relay re-broadcasting the data of Kerminal's single connection to Telemachus
+to any number of local clients, so that several people may watch one craft
+while the game serves only one client.
+
+Clients speak the Telemachus protocol, either over a websocket (at any path,
+such as "/datalink", so another Kerminal may connect to the relay as to the
+game) or over plain TCP with one JSON message per line. A client subscribes
+with {"+": [...]}, unsubscribes with {"-": [...]} and sets its interval with
+{"rate": <milliseconds>}; actions ({"run": [...]}) are forwarded only if the
+relay allows control. Each of these lists is of strings, anything else a
+client sends under them is ignored. Each client receives only its own keys.
+
+Subscriptions of every client join the reference counts of the connection's
+SubscriptionManager (the relay being a subscriber of the CommsThread, so they
+are made again on each connection), so the game is asked for each key once,
+and only for as long as someone uses it.
+"""
+
+import array
+import asyncio
+import json
+import logging
+import threading
+import time
+
+from autobahn.asyncio.websocket import WebSocketServerProtocol,\
+                                       WebSocketServerFactory
+
+log = logging.getLogger('kerminal.relay')
+
+#Frames are not sent to a client with more than this many bytes waiting to go
+#out to it; a slow client misses frames rather than holding them in memory
+MAX_BACKLOG = 1 << 20
+
+
+def _encode_value(value):
+    #Sensor readings, which are otherwise sent as the server sent them, a pair
+    #of lists (SensorFrame being a tuple)
+    if isinstance(value, array.array):
+        return value.tolist()
+    raise TypeError('{0!r} is not JSON serializable'.format(value))
+
+
+def _keys(msg, field):
+    #The strings listed in a client's message under field; anything else the
+    #client sent there is ignored
+    keys = msg.get(field, [])
+    if not isinstance(keys, list):
+        log.debug('Relay ignored {0!r}: {1!r} is not a list'.format(field, keys))
+        return []
+    strings = [key for key in keys if isinstance(key, str)]
+    if len(strings) != len(keys):
+        log.debug('Relay ignored the items of {0!r} which are not strings'.format(field))
+    return strings
+
+
+def encode_frame(frame):
+    return json.dumps(frame, separators=(',', ':'),
+                      default=_encode_value).encode('utf-8')
+
+
+class RelayClient(object):
+    """
+    The subscriptions and send schedule of one client of the relay.
+    """
+    def __init__(self, protocol):
+        self.protocol = protocol
+        self.keys = set()
+        self.signature = frozenset()  # Clients with the same keys share frames
+        self.interval = 0.0
+        self.next_send = 0.0
+
+
+class RelayProtocolMixin(object):
+    """
+    The part of the relay's protocols common to websocket and TCP clients.
+    Each provides `send_frame(frame)` and `relay`.
+    """
+    def backlog(self):
+        transport = getattr(self, 'transport', None)
+        return transport.get_write_buffer_size() if transport is not None else 0
+
+
+class WebSocketRelayProtocol(RelayProtocolMixin, WebSocketServerProtocol):
+
+    @property
+    def relay(self):
+        return self.factory.relay
+
+    def onOpen(self):
+        self.relay.add_client(self)
+
+    def onMessage(self, payload, isBinary):
+        if isBinary:
+            log.debug('Relay received binary data: {0}'.format(payload))
+            return
+        self.relay.receive(self, payload.decode('utf-8', 'replace'))
+
+    def onClose(self, wasClean, code, reason):
+        self.relay.remove_client(self)
+
+    def send_frame(self, frame):
+        self.sendMessage(frame)
+
+
+class TcpRelayProtocol(RelayProtocolMixin, asyncio.Protocol):
+
+    def __init__(self, relay):
+        self.relay = relay
+        self.transport = None
+        self.buffer = b''
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.relay.add_client(self)
+
+    def data_received(self, data):
+        self.buffer += data
+        *lines, self.buffer = self.buffer.split(b'\n')
+        for line in lines:
+            if line.strip():
+                self.relay.receive(self, line.decode('utf-8', 'replace'))
+
+    def connection_lost(self, exc):
+        self.relay.remove_client(self)
+
+    def send_frame(self, frame):
+        self.transport.write(frame + b'\n')
+
+
+class RelayThread(threading.Thread):
+    """
+    Serves the relay's clients on an event loop of its own, so that they are
+    unaffected by the upstream connection being lost and made again.
+    `publish` is called by the communication thread with each message.
+    """
+    def __init__(self, stream, websocket=None, tcp=None, allow_control=False):
+        super(RelayThread, self).__init__()
+        self.daemon = True
+        self.stream = stream
+        self.websocket = websocket  # (host, port) or None
+        self.tcp = tcp  # (host, port) or None
+        self.allow_control = allow_control
+        self.loop = None
+        self.servers = []
+        self.clients = {}  # protocol -> RelayClient
+        self.ready = threading.Event()
+        self.error = None
+
+    def run(self):
+        self.loop = self.stream.loop_factory()
+        asyncio.set_event_loop(self.loop)
+        try:
+            if self.websocket is not None:
+                host, port = self.websocket
+                factory = WebSocketServerFactory('ws://{0}:{1}'.format(host, port))
+                factory.protocol = WebSocketRelayProtocol
+                factory.relay = self
+                self.servers.append(self.loop.run_until_complete(
+                    self.loop.create_server(factory, host, port)))
+                log.info('Relay listening for websockets on {0}:{1}'.format(host, port))
+            if self.tcp is not None:
+                host, port = self.tcp
+                self.servers.append(self.loop.run_until_complete(
+                    self.loop.create_server(lambda: TcpRelayProtocol(self), host, port)))
+                log.info('Relay listening for TCP on {0}:{1}'.format(host, port))
+        except OSError as e:
+            log.error('Relay could not listen: {0}'.format(e))
+            self.error = e
+            self.ready.set()
+            self._close()
+            return
+        self.ready.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            self._close()
+
+    def _close(self):
+        for server in self.servers:
+            server.close()
+        self.loop.close()
+        self.loop = None
+
+    def stop(self):
+        loop = self.loop
+        if loop is not None:
+            loop.call_soon_threadsafe(loop.stop)
+
+    #The methods below run on the relay's loop
+
+    #The clients and their keys change while holding the stream's
+    #subscription_lock, as the CommsThread reads them with each new connection
+
+    def add_client(self, protocol):
+        with self.stream.subscription_lock:
+            self.clients[protocol] = RelayClient(protocol)
+        log.info('Relay client connected, {0} in all'.format(len(self.clients)))
+
+    def remove_client(self, protocol):
+        with self.stream.subscription_lock:
+            client = self.clients.pop(protocol, None)
+            if client is None:
+                return
+            self.unsubscribe(client, list(client.keys))
+        log.info('Relay client disconnected, {0} in all'.format(len(self.clients)))
+
+    def receive(self, protocol, text):
+        client = self.clients.get(protocol)
+        if client is None:
+            return
+        try:
+            msg = json.loads(text)
+        except ValueError:
+            log.debug('Relay could not parse: {0}'.format(text))
+            return
+        if not isinstance(msg, dict):
+            return
+        self.subscribe(client, _keys(msg, '+'))
+        self.unsubscribe(client, _keys(msg, '-'))
+        if 'rate' in msg:
+            try:
+                client.interval = max(float(msg['rate']), 0.0) / 1000
+            except (TypeError, ValueError):
+                pass
+        actions = _keys(msg, 'run')
+        if actions:
+            if self.allow_control:
+                self.stream.msg_queue.put({'run': actions})
+            else:
+                log.warning('Relay client actions ignored, control is not allowed')
+
+    def subscribe(self, client, keys):
+        with self.stream.subscription_lock:
+            for key in keys:
+                if key not in client.keys:
+                    client.keys.add(key)
+                    self.stream.subscription_manager.add(key)
+        client.signature = frozenset(client.keys)
+
+    def unsubscribe(self, client, keys):
+        with self.stream.subscription_lock:
+            for key in keys:
+                if key in client.keys:
+                    client.keys.discard(key)
+                    self.stream.subscription_manager.drop(key)
+        client.signature = frozenset(client.keys)
+
+    def broadcast(self, msg):
+        now = msg.get('sys.time') or time.time()
+        frames = {}  # signature -> encoded frame
+        for protocol, client in list(self.clients.items()):
+            if not client.keys or now < client.next_send:
+                continue
+            if protocol.backlog() > MAX_BACKLOG:
+                continue
+            frame = frames.get(client.signature)
+            if frame is None:
+                frame = encode_frame({k: msg[k] for k in client.signature if k in msg})
+                frames[client.signature] = frame
+            protocol.send_frame(frame)
+            #A little slack keeps a client's interval from skipping frames
+            #which arrive slightly early
+            client.next_send = now + 0.9 * client.interval
+
+    #The methods below may be called from any thread
+
+    def publish(self, msg):
+        loop = self.loop
+        if loop is None or not self.clients:
+            return
+        try:
+            loop.call_soon_threadsafe(self.broadcast, msg)
+        except RuntimeError:  # The loop has closed
+            pass
+
+    def subscribed_keys(self):
+        #Each client's keys are subscribed once for it
+        with self.stream.subscription_lock:
+            return [key for client in self.clients.values() for key in client.keys]
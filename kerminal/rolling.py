@@ -0,0 +1,268 @@
+# encoding: utf-8
+
+"""
+Rolling statistics over recent values of any plotable, as virtual keys of the
+form "<api variable>:<statistic><window>", for instance "v.altitude:rate10s"
+or "v.verticalSpeed:max1m". The statistics are min, max, mean, std (standard
+deviation) and rate (rate of change per second, by least squares), and windows
+are measured on the game clock. Two more suit consumables such as resources:
+trend, a rate of change which restarts on sudden steps (staging, transfers),
+and empty, the time until the value reaches zero at that rate.
+
+Each window keeps running sums and monotonic deques of its samples, so that
+adding a sample, dropping expired ones and reading any statistic all take
+constant time (amortized), however long the window.
+"""
+
+import collections
+import math
+import re
+import threading
+
+from . import utils
+
+STATISTICS = ('min', 'max', 'mean', 'std', 'rate', 'trend', 'empty')
+
+#Statistics computed by a RobustRateWindow
+ROBUST_STATISTICS = ('trend', 'empty')
+
+_virtual_key = re.compile(r'^(?P<key>.+):(?P<statistic>{0})(?P<window>\d.*)$'.format(
+                          '|'.join(STATISTICS)))
+
+CLOCK = 't.universalTime'
+
+
+def parse_key(key):
+    """
+    Returns (api variable, statistic, window in seconds) for a virtual key, or
+    None if key is not one.
+    """
+    match = _virtual_key.match(key)
+    if match is None:
+        return None
+    try:
+        window = utils.parse_duration(match.group('window'))
+    except ValueError:
+        return None
+    if window <= 0:
+        return None
+    return match.group('key'), match.group('statistic'), window
+
+
+class RollingWindow(object):
+    """
+    The samples of one value over the last `seconds` of the clock.
+    """
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.clear()
+
+    def clear(self):
+        self.samples = collections.deque()
+        self.minima = collections.deque()  # Increasing values
+        self.maxima = collections.deque()  # Decreasing values
+        self._rebase(None)
+
+    def _rebase(self, origin):
+        #Sums are of times and values relative to an origin sample near the
+        #window, which keeps their precision for large values such as universal
+        #time. Rebasing costs the window's length, but happens at most once per
+        #window's length of samples
+        self.origin = origin
+        self.sum_t = self.sum_v = self.sum_tt = self.sum_vv = self.sum_tv = 0.0
+        for t, value in self.samples:
+            self._accumulate(t, value, 1)
+
+    def _accumulate(self, t, value, sign):
+        dt, dv = t - self.origin[0], value - self.origin[1]
+        self.sum_t += sign * dt
+        self.sum_v += sign * dv
+        self.sum_tt += sign * dt * dt
+        self.sum_vv += sign * dv * dv
+        self.sum_tv += sign * dt * dv
+
+    def __len__(self):
+        return len(self.samples)
+
+    def add(self, t, value):
+        if self.samples and t <= self.samples[-1][0]:
+            if t < self.samples[-1][0]:  # The clock went back, as on a revert
+                self.clear()
+            else:  # No time has passed, as when paused
+                return
+        if self.origin is None:
+            self.origin = (t, value)
+        self.samples.append((t, value))
+        self._accumulate(t, value, 1)
+        while self.minima and self.minima[-1][1] >= value:
+            self.minima.pop()
+        self.minima.append((t, value))
+        while self.maxima and self.maxima[-1][1] <= value:
+            self.maxima.pop()
+        self.maxima.append((t, value))
+        self._expire(t - self.seconds)
+        if self.samples[0][0] - self.origin[0] > self.seconds:
+            self._rebase(self.samples[0])
+
+    def _expire(self, cutoff):
+        samples = self.samples
+        while samples[0][0] < cutoff:
+            t, value = samples.popleft()
+            self._accumulate(t, value, -1)
+        while self.minima[0][0] < cutoff:
+            self.minima.popleft()
+        while self.maxima[0][0] < cutoff:
+            self.maxima.popleft()
+
+    def min(self):
+        return self.minima[0][1] if self.minima else None
+
+    def max(self):
+        return self.maxima[0][1] if self.maxima else None
+
+    def mean(self):
+        n = len(self.samples)
+        return self.origin[1] + self.sum_v / n if n else None
+
+    def std(self):
+        n = len(self.samples)
+        if not n:
+            return None
+        mean = self.sum_v / n
+        return math.sqrt(max(self.sum_vv / n - mean * mean, 0.0))
+
+    def rate(self):
+        n = len(self.samples)
+        denominator = n * self.sum_tt - self.sum_t * self.sum_t
+        if n < 2 or denominator <= 0:
+            return None
+        return (n * self.sum_tv - self.sum_t * self.sum_v) / denominator
+
+
+class RobustRateWindow(RollingWindow):
+    """
+    A RollingWindow for the rate of change of a value which follows a trend
+    but may step suddenly, as a resource does on staging. A sample far off the
+    trend fitted to the window starts the window afresh, so steps do not skew
+    the rate.
+    """
+    def __init__(self, seconds, tolerance=6.0, minimum_step=0.005):
+        #A step exceeds tolerance standard deviations of the residuals, and
+        #the minimum_step fraction of the value
+        self.tolerance = tolerance
+        self.minimum_step = minimum_step
+        super(RobustRateWindow, self).__init__(seconds)
+
+    def _residual_deviation(self, n, slope):
+        mean_t, mean_v = self.sum_t / n, self.sum_v / n
+        variance = (self.sum_vv / n - mean_v * mean_v -
+                    slope * slope * (self.sum_tt / n - mean_t * mean_t))
+        return math.sqrt(max(variance, 0.0))
+
+    def add(self, t, value):
+        n = len(self.samples)
+        slope = self.rate() if n >= 3 else None
+        if slope is not None:
+            #The fitted line passes through the means
+            predicted = (self.origin[1] + self.sum_v / n +
+                         slope * (t - self.origin[0] - self.sum_t / n))
+            limit = max(self.tolerance * self._residual_deviation(n, slope),
+                        self.minimum_step * abs(predicted))
+            if abs(value - predicted) > limit:
+                self.clear()
+        super(RobustRateWindow, self).add(t, value)
+
+    def trend(self):
+        return self.rate()
+
+    def empty(self):
+        slope = self.rate()
+        if slope is None or slope >= 0:
+            return None
+        return max(self.samples[-1][1], 0.0) / -slope
+
+
+class RollingStatistics(object):
+    """
+    The active virtual keys and their windows; virtual keys with the same api
+    variable and window share a window. Keys are activated and deactivated
+    (by the SubscriptionManager) from any thread, `update` is called by the
+    communication thread for each message.
+    """
+    def __init__(self):
+        self.windows = {}  # (api variable, seconds, robust) -> RollingWindow
+        self.active = {}  # virtual key -> [activation count, parsed key]
+        self.lock = threading.Lock()
+        self._plan()
+
+    def handles(self, key):
+        return parse_key(key) is not None
+
+    def requirements(self, key):
+        return [parse_key(key)[0], CLOCK]
+
+    def activate(self, key):
+        with self.lock:
+            if key in self.active:
+                self.active[key][0] += 1
+                return
+            parsed = parse_key(key)
+            self.active[key] = [1, parsed]
+            window_key = self._window_key(parsed)
+            if window_key not in self.windows:
+                if window_key[2]:
+                    self.windows[window_key] = RobustRateWindow(window_key[1])
+                else:
+                    self.windows[window_key] = RollingWindow(window_key[1])
+            self._plan()
+
+    def _window_key(self, parsed):
+        base, statistic, seconds = parsed
+        return base, seconds, statistic in ROBUST_STATISTICS
+
+    def deactivate(self, key):
+        with self.lock:
+            if key not in self.active:
+                return
+            self.active[key][0] -= 1
+            if self.active[key][0]:
+                return
+            del self.active[key]
+            in_use = set(self._window_key(parsed) for _, parsed in self.active.values())
+            for window_key in list(self.windows):
+                if window_key not in in_use:
+                    del self.windows[window_key]
+            self._plan()
+
+    def clear(self):
+        with self.lock:
+            self.active.clear()
+            self.windows.clear()
+            self._plan()
+
+    def _plan(self):
+        #(window, api variable, [(virtual key, statistic method name), ...])
+        plan = []
+        for window_key, window in self.windows.items():
+            outputs = [(key, parsed[1]) for key, (_, parsed) in self.active.items()
+                       if self._window_key(parsed) == window_key]
+            plan.append((window, window_key[0], outputs))
+        self.plan = plan
+
+    def update(self, msg, previous):
+        """
+        Adds the samples in msg to the windows, and the statistics of the
+        active virtual keys to msg.
+        """
+        plan = self.plan
+        if not plan:
+            return
+        now = msg.get(CLOCK, previous.get(CLOCK))
+        if not isinstance(now, (int, float)):
+            return
+        for window, base, outputs in plan:
+            value = msg.get(base)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                window.add(now, value)
+            for key, statistic in outputs:
+                msg[key] = getattr(window, statistic)()
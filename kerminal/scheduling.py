@@ -0,0 +1,87 @@
+# encoding: utf-8
+
+"""
+The scheduling module holds commands waiting for the game clock to reach their
+deadline. Deadlines are checked against the clock values in each incoming
+message from the server, so the precision of execution is that of the message
+rate rather than that of the user interface.
+"""
+
+import collections
+import heapq
+import itertools
+import threading
+
+#The game clocks a command may be scheduled against
+CLOCKS = {'ut': 't.universalTime',
+          'met': 'v.missionTime'}
+
+ScheduledCommand = collections.namedtuple('ScheduledCommand',
+                                          ['number', 'clock', 'deadline',
+                                           'command', 'messages', 'notify'])
+
+
+class CommandScheduler(object):
+    """
+    A priority heap of ScheduledCommands per clock key. The scheduling methods
+    may be called from any thread, `due` is called from the communication
+    thread for each message.
+    """
+    def __init__(self):
+        self.heaps = {key: [] for key in CLOCKS.values()}
+        self.counter = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return sum(len(heap) for heap in self.heaps.values())
+
+    def schedule(self, clock, deadline, command, messages, notify=None):
+        """
+        Schedules the messages (dicts to be sent to the server) to be sent once
+        the clock ("ut" or "met") reaches the deadline. notify, if given, is
+        called with the ScheduledCommand after its messages are sent.
+        """
+        entry = ScheduledCommand(next(self.counter), clock, deadline, command,
+                                 messages, notify)
+        with self.lock:
+            heapq.heappush(self.heaps[CLOCKS[clock]],
+                           (deadline, entry.number, entry))
+        return entry
+
+    def due(self, msg):
+        """
+        Pops and returns the ScheduledCommands whose deadlines have been reached
+        according to the clock values in msg.
+        """
+        ready = []
+        for key, heap in self.heaps.items():
+            #Cheap exits for the common case of nothing being due
+            if not heap or key not in msg:
+                continue
+            now = msg[key]
+            if not isinstance(now, (int, float)) or heap[0][0] > now:
+                continue
+            with self.lock:
+                while heap and heap[0][0] <= now:
+                    ready.append(heapq.heappop(heap)[2])
+        return ready
+
+    def pending(self):
+        with self.lock:
+            entries = [item[2] for heap in self.heaps.values() for item in heap]
+        return sorted(entries, key=lambda e: e.number)
+
+    def cancel(self, number):
+        with self.lock:
+            for heap in self.heaps.values():
+                for i, item in enumerate(heap):
+                    if item[1] == number:
+                        heap.pop(i)
+                        heapq.heapify(heap)
+                        return True
+        return False
+
+    def clear(self):
+        with self.lock:
+            for heap in self.heaps.values():
+                del heap[:]
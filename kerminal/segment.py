@@ -0,0 +1,244 @@
+# encoding: utf-8
+
+"""
+A shared memory segment holding the latest value of every numeric key
+received, for other processes on the same host (autopilot scripts, plotting)
+to read at memory speed, without a connection of their own.
+
+The segment has a fixed layout: a 64 byte header followed by slots of one
+little-endian double each. Values which are not numbers are written as nan.
+
+  offset  type     field
+  0       8s       magic, b'KERMSEG1'
+  8       uint32   layout version
+  12      uint32   capacity (number of slots)
+  16      uint64   sequence
+  24      uint64   frames written
+  32      double   time of the last frame (sys.time)
+  40      uint32   slots in use
+  64      double   slot 0, and so on
+
+The sequence is a seqlock: it is odd while a frame is being written and even
+otherwise. A reader takes the sequence, copies what it wants, and takes the
+sequence again; the copy is consistent if both are the same even number.
+
+Keys are given slots as they are first received, and never move. The index
+file (JSON) names the segment and maps each key to the byte offset of its slot;
+it is rewritten after each frame which adds keys, once the frame is written,
+and readers notice it as a change in the slots in use. Until it is rewritten
+a reader only lacks the new keys. SegmentReader does all of this for Python
+readers.
+"""
+
+import json
+import logging
+import math
+import os
+import struct
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # Before Python 3.8
+    shared_memory = None
+
+log = logging.getLogger('kerminal.segment')
+
+MAGIC = b'KERMSEG1'
+LAYOUT_VERSION = 1
+HEADER_SIZE = 64
+SLOT_SIZE = 8
+DEFAULT_CAPACITY = 4096
+
+_HEADER = struct.Struct('<8sII')
+_SEQUENCE = struct.Struct('<Q')
+_FRAME = struct.Struct('<QdI')
+_VALUE = struct.Struct('<d')
+
+SEQUENCE_OFFSET = 16
+FRAME_OFFSET = 24
+
+#Names of the segments created by this process, which its readers leave
+#registered with the resource tracker, for the writer to unlink
+_CREATED = set()
+
+
+def _number(value):
+    if isinstance(value, float):
+        return value
+    if isinstance(value, int):  # Including bool
+        return float(value)
+    return math.nan
+
+
+class SegmentWriter(object):
+    """
+    Creates the segment and its index file, and writes each message into it.
+    `publish` is called by the communication thread.
+    """
+    def __init__(self, index_file, name=None, capacity=DEFAULT_CAPACITY):
+        if shared_memory is None:
+            raise RuntimeError('shared memory requires Python 3.8 or higher')
+        self.index_file = index_file
+        self.capacity = capacity
+        self.shm = shared_memory.SharedMemory(name=name, create=True,
+                                              size=HEADER_SIZE + capacity * SLOT_SIZE)
+        _CREATED.add(self.shm.name)
+        self.buf = self.shm.buf
+        _HEADER.pack_into(self.buf, 0, MAGIC, LAYOUT_VERSION, capacity)
+        _SEQUENCE.pack_into(self.buf, SEQUENCE_OFFSET, 0)
+        _FRAME.pack_into(self.buf, FRAME_OFFSET, 0, 0.0, 0)
+        for i in range(capacity):
+            _VALUE.pack_into(self.buf, HEADER_SIZE + i * SLOT_SIZE, math.nan)
+        self.sequence = 0
+        self.frames = 0
+        self.offsets = {}  # key -> byte offset of its slot
+        self.full = False
+        self._write_index()
+        log.info('Shared memory segment {0} described by {1}'.format(self.shm.name,
+                                                                     index_file))
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def _write_index(self):
+        index = {'name': self.shm.name,
+                 'layout': LAYOUT_VERSION,
+                 'capacity': self.capacity,
+                 'header': HEADER_SIZE,
+                 'keys': self.offsets}
+        temp_file = self.index_file + '.tmp'
+        try:
+            with open(temp_file, 'w') as outf:
+                json.dump(index, outf, indent=1, sort_keys=True)
+            os.replace(temp_file, self.index_file)
+        except OSError as e:
+            log.warning('Could not write segment index: {0}'.format(e))
+
+    def _allocate(self, key):
+        if len(self.offsets) >= self.capacity:
+            if not self.full:
+                log.warning('Shared memory segment is full, {0} not published'.format(key))
+                self.full = True
+            return None
+        offset = HEADER_SIZE + len(self.offsets) * SLOT_SIZE
+        self.offsets[key] = offset
+        return offset
+
+    def publish(self, msg):
+        buf, offsets = self.buf, self.offsets
+        allocated = len(offsets)
+        sequence = self.sequence + 1
+        _SEQUENCE.pack_into(buf, SEQUENCE_OFFSET, sequence)  # Odd, writing
+        for key, value in msg.items():
+            offset = offsets.get(key)
+            if offset is None:
+                #Slots are only given to keys with numbers
+                if not isinstance(value, (int, float)) or self.full:
+                    continue
+                offset = self._allocate(key)
+                if offset is None:
+                    continue
+            _VALUE.pack_into(buf, offset, _number(value))
+        self.frames += 1
+        _FRAME.pack_into(buf, FRAME_OFFSET, self.frames,
+                         _number(msg.get('sys.time')), len(offsets))
+        self.sequence = sequence + 1
+        _SEQUENCE.pack_into(buf, SEQUENCE_OFFSET, self.sequence)  # Even, done
+        #Outside of the write, which readers wait on
+        if len(offsets) != allocated:
+            self._write_index()
+
+    def close(self):
+        """
+        Removes the segment and its index file.
+        """
+        if self.shm is None:
+            return
+        self.buf = None
+        _CREATED.discard(self.shm.name)
+        self.shm.close()
+        self.shm.unlink()
+        self.shm = None
+        try:
+            os.remove(self.index_file)
+        except OSError:
+            pass
+
+
+class SegmentReader(object):
+    """
+    Reads a segment given its index file, for use by other processes.
+
+    values = SegmentReader('kerminal-segment.json').read(['v.altitude'])
+    """
+    def __init__(self, index_file):
+        if shared_memory is None:
+            raise RuntimeError('shared memory requires Python 3.8 or higher')
+        self.index_file = index_file
+        with open(index_file, 'r') as inf:
+            index = json.load(inf)
+        try:
+            self.shm = shared_memory.SharedMemory(index['name'], track=False)
+        except TypeError:  # Before Python 3.13, which would unlink it on exit
+            from multiprocessing import resource_tracker
+            self.shm = shared_memory.SharedMemory(index['name'])
+            if index['name'] not in _CREATED:
+                resource_tracker.unregister(self.shm._name, 'shared_memory')
+        self.buf = self.shm.buf
+        magic, layout, self.capacity = _HEADER.unpack_from(self.buf, 0)
+        if magic != MAGIC or layout != LAYOUT_VERSION:
+            self.close()
+            raise ValueError('{0} is not a Kerminal segment of layout {1}'.format(
+                             index['name'], LAYOUT_VERSION))
+        self.offsets = index['keys']
+
+    def values(self):
+        """
+        Returns a zero-copy view of the slots as doubles, to be read between
+        two equal readings of `sequence` (see `read`).
+        """
+        return self.buf[HEADER_SIZE:HEADER_SIZE + self.capacity * SLOT_SIZE].cast('d')
+
+    @property
+    def sequence(self):
+        return _SEQUENCE.unpack_from(self.buf, SEQUENCE_OFFSET)[0]
+
+    def frame(self):
+        """
+        Returns (frames written, time of the last frame, slots in use).
+        """
+        return _FRAME.unpack_from(self.buf, FRAME_OFFSET)
+
+    def refresh(self):
+        """
+        Re-reads the index file if keys have been added since it was read.
+        """
+        if self.frame()[2] != len(self.offsets):
+            with open(self.index_file, 'r') as inf:
+                self.offsets = json.load(inf)['keys']
+
+    def read(self, keys=None):
+        """
+        Returns a consistent {key: value} of the given keys, or of all keys.
+        Keys not in the segment are left out.
+        """
+        self.refresh()
+        if keys is None:
+            keys = list(self.offsets)
+        wanted = [(k, self.offsets[k]) for k in keys if k in self.offsets]
+        buf = self.buf
+        while True:
+            before = _SEQUENCE.unpack_from(buf, SEQUENCE_OFFSET)[0]
+            if before & 1:  # A frame is being written
+                continue
+            values = {k: _VALUE.unpack_from(buf, offset)[0] for k, offset in wanted}
+            if _SEQUENCE.unpack_from(buf, SEQUENCE_OFFSET)[0] == before:
+                return values
+
+    def close(self):
+        if self.shm is None:
+            return
+        self.buf = None
+        self.shm.close()
+        self.shm = None
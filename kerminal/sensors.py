@@ -0,0 +1,82 @@
+# encoding: utf-8
+
+"""
+Decoding of the sensor api variables (s.sensor.temp, s.sensor.pres,
+s.sensor.grav, s.sensor.acc). The server sends each as a pair of lists, the
+sensor names and their readings, sometimes encoded as a string. These are
+decoded once as they arrive into SensorFrames holding every sensor's reading.
+"""
+
+import array
+import ast
+import collections
+import functools
+import json
+import math
+import re
+
+_number = re.compile(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+
+
+def _reading(value):
+    #Readings may be numbers, or strings which may carry units
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = _number.search(str(value))
+    return float(match.group()) if match else math.nan
+
+
+class SensorFrame(collections.namedtuple('SensorFrame', ['names', 'values'])):
+    """
+    The readings of all sensors of one type: a tuple of sensor names and an
+    array of their readings, nan where a reading could not be read. As a string
+    it is the comma separated readings, which is how it is written to logs.
+    """
+    __slots__ = ()
+
+    @property
+    def count(self):
+        #The number of sensors; the length of the frame is that of the tuple
+        return len(self.values)
+
+    def __str__(self):
+        return ','.join(repr(value) for value in self.values)
+
+
+def _decode(payload):
+    if not isinstance(payload, (list, tuple)) or len(payload) != 2:
+        return None
+    names, readings = payload
+    if not isinstance(readings, (list, tuple)):  # A single sensor, unwrapped
+        names, readings = [names], [readings]
+    if not isinstance(names, (list, tuple)):
+        names = [names]
+    values = array.array('d', (_reading(r) for r in readings))
+    names = tuple(str(n) for n in names[:len(values)])
+    names += tuple('Sensor {0}'.format(i + 1) for i in range(len(names), len(values)))
+    return SensorFrame(names, values)
+
+
+@functools.lru_cache(maxsize=32)
+def _decode_text(text):
+    #Unchanged readings arrive as the same string, and are decoded only once
+    for loads in (json.loads, ast.literal_eval):
+        try:
+            return _decode(loads(text))
+        except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError):
+            continue
+    return None
+
+
+def decode_sensor_frame(value):
+    """
+    Returns the SensorFrame for a sensor api variable's value, or None if there
+    are no readings.
+    """
+    if value is None or isinstance(value, SensorFrame):
+        return value
+    if isinstance(value, str):
+        if value in ('', 'None'):
+            return None
+        return _decode_text(value)
+    return _decode(value)
@@ -1,6 +1,10 @@
 # encoding: utf-8
 
 
+import collections
+
+from .sensors import decode_sensor_frame
+
 #The information in this module was gleaned from DataLinkHandlers.cs
 #https://github.com/richardbunt/Telemachus/blob/master/Telemachus/src/DataLinkHandlers.cs
 
@@ -241,6 +245,7 @@ plotables = flight_plotables + target_plotables + docking_plotables + \
 resources = ['r.resource',         # Resource Information [string resource type]
              'r.resourceCurrent',  # Resource Information for Current Stage [string resource type]
              'r.resourceMax',      # Max Resource Information [string resource type]
+             'r.resourceNameList', # List of resource names carried by the vessel
              ]
 
 apis = ['a.api',        # API Listing
@@ -248,3 +253,246 @@ apis = ['a.api',        # API Listing
         'a.apiSubSet',  # Subset of the API Listing [string api1, string api2, ... , string apiN]
         'a.version',    # Telemachus Version
         ]
+
+
+#The registry below gives each api variable its kind, value type, units and a
+#display name, and a parser normalizing the values sent by the server
+
+
+def parse_float(value):
+    if type(value) is float:
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None  # Missing values arrive as null or as "None"
+
+
+def parse_int(value):
+    if type(value) is int:
+        return value
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_bool(value):
+    if isinstance(value, str):
+        return {'true': True, 'false': False}.get(value.lower())
+    return None if value is None else bool(value)
+
+
+def parse_str(value):
+    return None if value is None else str(value)
+
+
+def parse_raw(value):
+    return value
+
+
+_parsers = {'float': parse_float,
+            'int': parse_int,
+            'bool': parse_bool,
+            'str': parse_str,
+            'raw': parse_raw,
+            'sensor': decode_sensor_frame}
+
+
+ApiVariable = collections.namedtuple('ApiVariable', ['key', 'name', 'kind',
+                                                     'type', 'units', 'parser'])
+
+#key: (display name, type, units) for each plotable, the type of an action is
+#the type of its argument, if any
+_plotable_info = {
+    'f.throttle': ('Throttle', 'float', None),
+    'v.rcsValue': ('RCS', 'bool', None),
+    'v.sasValue': ('SAS', 'bool', None),
+    'v.lightValue': ('Lights', 'bool', None),
+    'v.brakeValue': ('Brakes', 'bool', None),
+    'v.gearValue': ('Gear', 'bool', None),
+    'tar.o.sma': ('Target Semimajor Axis', 'float', 'm'),
+    'tar.o.lan': ('Target Longitude of Ascending Node', 'float', 'deg'),
+    'tar.o.maae': ('Target Mean Anomaly at Epoch', 'float', 'rad'),
+    'tar.name': ('Target Name', 'str', None),
+    'tar.type': ('Target Type', 'str', None),
+    'tar.distance': ('Target Distance', 'float', 'm'),
+    'tar.o.velocity': ('Target Velocity', 'float', 'm/s'),
+    'tar.o.PeA': ('Target Periapsis', 'float', 'm'),
+    'tar.o.ApA': ('Target Apoapsis', 'float', 'm'),
+    'tar.o.timeToAp': ('Target Time to Apoapsis', 'float', 's'),
+    'tar.o.timeToPe': ('Target Time to Periapsis', 'float', 's'),
+    'tar.o.inclination': ('Target Inclination', 'float', 'deg'),
+    'tar.o.eccentricity': ('Target Eccentricity', 'float', None),
+    'tar.o.period': ('Target Orbital Period', 'float', 's'),
+    'tar.o.relativeVelocity': ('Target Relative Velocity', 'float', 'm/s'),
+    'tar.o.orbitingBody': ('Target Orbiting Body', 'str', None),
+    'tar.o.argumentOfPeriapsis': ('Target Argument of Periapsis', 'float', 'deg'),
+    'tar.o.timeToTransition1': ('Target Time to Transition 1', 'float', 's'),
+    'tar.o.timeToTransition2': ('Target Time to Transition 2', 'float', 's'),
+    'tar.o.timeOfPeriapsisPassage': ('Target Time of Periapsis Passage', 'float', 's'),
+    'dock.ax': ('Docking x Angle', 'float', 'deg'),
+    'dock.ay': ('Relative Pitch Angle', 'float', 'deg'),
+    'dock.az': ('Docking z Angle', 'float', 'deg'),
+    'dock.x': ('Target x Distance', 'float', 'm'),
+    'dock.y': ('Target y Distance', 'float', 'm'),
+    'n.heading': ('Heading', 'float', 'deg'),
+    'n.pitch': ('Pitch', 'float', 'deg'),
+    'n.roll': ('Roll', 'float', 'deg'),
+    'n.rawheading': ('Raw Heading', 'float', 'deg'),
+    'n.rawpitch': ('Raw Pitch', 'float', 'deg'),
+    'n.rawroll': ('Raw Roll', 'float', 'deg'),
+    'v.altitude': ('Altitude', 'float', 'm'),
+    'v.heightFromTerrain': ('Height from Terrain', 'float', 'm'),
+    'v.terrainHeight': ('Terrain Height', 'float', 'm'),
+    'v.missionTime': ('Mission Time', 'float', 's'),
+    'v.surfaceVelocity': ('Surface Velocity', 'float', 'm/s'),
+    'v.surfaceVelocityx': ('Surface Velocity x', 'float', 'm/s'),
+    'v.surfaceVelocityy': ('Surface Velocity y', 'float', 'm/s'),
+    'v.surfaceVelocityz': ('Surface Velocity z', 'float', 'm/s'),
+    'v.angularVelocity': ('Angular Velocity', 'float', 'rad/s'),
+    'v.orbitalVelocity': ('Orbital Velocity', 'float', 'm/s'),
+    'v.surfaceSpeed': ('Surface Speed', 'float', 'm/s'),
+    'v.verticalSpeed': ('Vertical Speed', 'float', 'm/s'),
+    'v.geeForce': ('G-Force', 'float', 'g'),
+    'v.atmosphericDensity': ('Atmospheric Density', 'float', 'kg/m3'),
+    'v.long': ('Longitude', 'float', 'deg'),
+    'v.lat': ('Latitude', 'float', 'deg'),
+    'v.dynamicPressure': ('Dynamic Pressure', 'float', 'Pa'),
+    'v.name': ('Name', 'str', None),
+    'v.body': ('Body Name', 'str', None),
+    'v.angleToPrograde': ('Angle to Prograde', 'float', 'deg'),
+    'o.relativeVelocity': ('Relative Velocity', 'float', 'm/s'),
+    'o.PeA': ('Periapsis', 'float', 'm'),
+    'o.ApA': ('Apoapsis', 'float', 'm'),
+    'o.timeToAp': ('Time to Apoapsis', 'float', 's'),
+    'o.timeToPe': ('Time to Periapsis', 'float', 's'),
+    'o.inclination': ('Inclination', 'float', 'deg'),
+    'o.eccentricity': ('Eccentricity', 'float', None),
+    'o.epoch': ('Epoch', 'float', 's'),
+    'o.period': ('Orbital Period', 'float', 's'),
+    'o.argumentOfPeriapsis': ('Argument of Periapsis', 'float', 'deg'),
+    'o.timeToTransition1': ('Time to Transition 1', 'float', 's'),
+    'o.timeToTransition2': ('Time to Transition 2', 'float', 's'),
+    'o.sma': ('Semimajor Axis', 'float', 'm'),
+    'o.lan': ('Longitude of Ascending Node', 'float', 'deg'),
+    'o.maae': ('Mean Anomaly at Epoch', 'float', 'rad'),
+    'o.timeOfPeriapsisPassage': ('Time of Periapsis Passage', 'float', 's'),
+    'o.trueAnomaly': ('True Anomaly', 'float', 'deg'),
+    's.sensor.temp': ('Temperature Sensors', 'sensor', 'C'),
+    's.sensor.pres': ('Pressure Sensors', 'sensor', 'Pa'),
+    's.sensor.grav': ('Gravity Sensors', 'sensor', 'm/s2'),
+    's.sensor.acc': ('Acceleration Sensors', 'sensor', 'g'),
+    'p.paused': ('Paused', 'int', None),
+    'a.version': ('Telemachus Version', 'str', None),
+    't.universalTime': ('Universal Time', 'float', 's'),
+    #Bracketed variables, such as r.resource[LiquidFuel], use their base key
+    'r.resource': ('Resource', 'float', None),
+    'r.resourceCurrent': ('Resource in Current Stage', 'float', None),
+    'r.resourceMax': ('Maximum Resource', 'float', None),
+    'r.resourceNameList': ('Resource Names', 'raw', None),
+    'sys.time': ('System Time', 'float', 's'),
+    }
+
+_action_info = {
+    'mj.surface': ('Surface', 'float', 'deg'),
+    'mj.surface2': ('Surface', 'float', 'deg'),
+    'v.setYaw': ('Yaw', 'float', None),
+    'v.setPitch': ('Pitch', 'float', None),
+    'v.setRoll': ('Roll', 'float', None),
+    'v.setFbW': ('Set Fly by Wire', 'bool', None),
+    'v.setPitchYawRollXYZ': ('Set Pitch, Yaw, Roll, X, Y and Z', 'float', None),
+    'f.setThrottle': ('Set Throttle', 'float', None),
+    't.timeWarp': ('Time Warp', 'int', None),
+    }
+
+
+class ApiRegistry(object):
+    """
+    A mapping of api variable to ApiVariable. Variables with a bracketed
+    argument, such as r.resource[LiquidFuel], are looked up by their base key
+    and then remembered, so every lookup is a single dictionary access.
+    """
+    def __init__(self):
+        self.variables = {}
+
+    def register(self, key, name, kind, type_='raw', units=None):
+        variable = ApiVariable(key, name, kind, type_, units, _parsers[type_])
+        self.variables[key] = variable
+        return variable
+
+    def get(self, key, default=None):
+        variable = self.variables.get(key)
+        if variable is None and ':' in key:  # A rolling statistic
+            base_key, statistic = key.rsplit(':', 1)
+            base = self.get(base_key)
+            if base is None:
+                return default
+            units = base.units
+            if statistic.startswith('empty'):
+                units = 's'
+            elif units is not None and statistic.startswith(('rate', 'trend')):
+                units = units + '/s'
+            variable = base._replace(key=key, kind='statistic', units=units,
+                                     name='{0} ({1})'.format(base.name, statistic))
+            self.variables[key] = variable
+        elif variable is None and key.endswith(']') and '[' in key:
+            base_key, argument = key[:-1].split('[', 1)
+            base = self.variables.get(base_key)
+            if base is None:
+                return default
+            variable = base._replace(key=key,
+                                     name='{0} ({1})'.format(base.name, argument))
+            self.variables[key] = variable
+        return default if variable is None else variable
+
+    def __getitem__(self, key):
+        variable = self.get(key)
+        if variable is None:
+            raise KeyError(key)
+        return variable
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def is_action(self, key):
+        variable = self.get(key)
+        return variable is not None and variable.kind == 'action'
+
+    def is_plotable(self, key):
+        variable = self.get(key)
+        return variable is not None and variable.kind == 'plotable'
+
+    def parse(self, key, value):
+        variable = self.get(key)
+        return value if variable is None else variable.parser(value)
+
+    def parse_message(self, msg):
+        """
+        Parses, in place, each value of a message from the server for which the
+        api variable is known. Unknown variables are left untouched.
+        """
+        get = self.get
+        for key, value in msg.items():
+            variable = get(key)
+            if variable is not None:
+                msg[key] = variable.parser(value)
+        return msg
+
+
+API = ApiRegistry()
+
+for _key in plotables + paused_plotables + resources + ['sys.time']:
+    if '[' in _key:  # Found through the base key
+        continue
+    _name, _type, _units = _plotable_info.get(_key, (_key, 'raw', None))
+    API.register(_key, _name, 'plotable', _type, _units)
+
+for _key in mj_actions + vessel_actions + flight_actions + time_warp_actions + \
+            mapview_actions:
+    _name, _type, _units = _action_info.get(_key, (_key, 'raw', None))
+    API.register(_key, _name, 'action', _type, _units)
+
+for _key in apis:
+    if _key not in API.variables:
+        API.register(_key, _key, 'api', 'raw')
@@ -0,0 +1,273 @@
+# encoding: utf-8
+
+"""
+The triggers module holds commands waiting for a condition on the live data to
+become true, as in "v.altitude > 70000 and o.ApA > 80000".
+
+Each condition is compiled once into a tree of closures, and triggers are
+indexed by the api variables their conditions reference. For each incoming
+message only the triggers with an input whose value has changed are
+evaluated, so triggers waiting on unchanging data cost nothing.
+"""
+
+import ast
+import itertools
+import operator
+import sys
+import threading
+
+_compare_ops = {ast.Gt: operator.gt,
+                ast.GtE: operator.ge,
+                ast.Lt: operator.lt,
+                ast.LtE: operator.le,
+                ast.Eq: operator.eq,
+                ast.NotEq: operator.ne}
+
+_binary_ops = {ast.Add: operator.add,
+               ast.Sub: operator.sub,
+               ast.Mult: operator.mul,
+               ast.Div: operator.truediv,
+               ast.Mod: operator.mod,
+               ast.Pow: operator.pow}
+
+_unary_ops = {ast.USub: operator.neg,
+              ast.UAdd: operator.pos,
+              ast.Not: operator.not_}
+
+#Literal node types differ between Python versions
+if sys.version_info >= (3, 8):
+    _literal_types = (ast.Constant, )
+else:
+    _literal_types = (ast.Num, ast.Str, ast.NameConstant)
+
+
+def _key_name(node):
+    """
+    Returns the api variable named by an expression node such as "v.altitude",
+    "tar.o.ApA", or "r.resource[LiquidFuel]", or None if the node is not one.
+    """
+    if isinstance(node, ast.Name):
+        return node.id
+    elif isinstance(node, ast.Attribute):
+        base = _key_name(node.value)
+        if base is not None:
+            return '{0}.{1}'.format(base, node.attr)
+    elif isinstance(node, ast.Subscript):
+        base = _key_name(node.value)
+        index = node.slice
+        if not isinstance(index, ast.Name):  # Older Pythons wrap it in Index
+            index = getattr(index, 'value', None)
+        if base is not None and isinstance(index, ast.Name):
+            return '{0}[{1}]'.format(base, index.id)
+    return None
+
+
+def _compile(node, keys):
+    if isinstance(node, _literal_types):
+        value = ast.literal_eval(node)
+        return lambda data: value
+
+    if isinstance(node, (ast.Attribute, ast.Subscript)):
+        key = _key_name(node)
+        if key is None:
+            raise ValueError('"{0}" is not an api variable'.format(ast.dump(node)))
+        keys.add(key)
+        return lambda data: data[key]
+
+    if isinstance(node, ast.Name):
+        if node.id in ('True', 'False', 'None'):  # Older Pythons
+            value = ast.literal_eval(node)
+            return lambda data: value
+        raise ValueError('"{0}" is not an api variable'.format(node.id))
+
+    if isinstance(node, ast.BoolOp):
+        operands = [_compile(value, keys) for value in node.values]
+        if isinstance(node.op, ast.And):
+            def and_(data):
+                for operand in operands:
+                    if not operand(data):
+                        return False
+                return True
+            return and_
+
+        def or_(data):
+            for operand in operands:
+                if operand(data):
+                    return True
+            return False
+        return or_
+
+    if isinstance(node, ast.Compare):
+        left = _compile(node.left, keys)
+        comparisons = []
+        for op, comparator in zip(node.ops, node.comparators):
+            try:
+                comparisons.append((_compare_ops[type(op)],
+                                    _compile(comparator, keys)))
+            except KeyError:
+                raise ValueError('unsupported comparison')
+
+        def compare(data):
+            a = left(data)
+            for op, right in comparisons:
+                b = right(data)
+                if not op(a, b):
+                    return False
+                a = b
+            return True
+        return compare
+
+    if isinstance(node, ast.BinOp):
+        try:
+            op = _binary_ops[type(node.op)]
+        except KeyError:
+            raise ValueError('unsupported operator')
+        left, right = _compile(node.left, keys), _compile(node.right, keys)
+        return lambda data: op(left(data), right(data))
+
+    if isinstance(node, ast.UnaryOp):
+        try:
+            op = _unary_ops[type(node.op)]
+        except KeyError:
+            raise ValueError('unsupported operator')
+        operand = _compile(node.operand, keys)
+        return lambda data: op(operand(data))
+
+    raise ValueError('unsupported expression')
+
+
+def compile_condition(text):
+    """
+    Compiles a condition string into a function of the live data dictionary,
+    returning (function, set of referenced api variables). Raises ValueError
+    if the condition cannot be understood.
+    """
+    try:
+        tree = ast.parse(text.strip(), mode='eval')
+    except SyntaxError:
+        raise ValueError('invalid syntax')
+    keys = set()
+    func = _compile(tree.body, keys)
+    if not keys:
+        raise ValueError('condition does not use any api variables')
+    return func, keys
+
+
+class Trigger(object):
+    def __init__(self, number, condition, command, messages, repeat, notify):
+        self.number = number
+        self.condition = condition
+        self.command = command
+        self.messages = messages
+        self.repeat = repeat
+        self.notify = notify
+        self.test, self.keys = compile_condition(condition)
+        self.armed = True
+
+    def check(self, data):
+        """
+        Returns True if the trigger fires given the data. A trigger fires when
+        its condition becomes true; a repeating trigger is re-armed when its
+        condition becomes false again.
+        """
+        try:
+            result = self.test(data)
+        except (KeyError, TypeError, ValueError, ArithmeticError):
+            result = False  # Missing or non-numeric values, e.g. 'None'
+        if result and self.armed:
+            self.armed = False
+            return True
+        elif not result and self.repeat:
+            self.armed = True
+        return False
+
+
+class TriggerEngine(object):
+    """
+    The set of active Triggers with an index from api variable to the
+    triggers which depend on it. Triggers may be added and removed from any
+    thread, `candidates` and `evaluate` are called by the communication thread.
+    """
+    def __init__(self):
+        self.triggers = {}  # number -> Trigger
+        self.index = {}  # api variable -> set of trigger numbers
+        self.counter = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.triggers)
+
+    def add(self, condition, command, messages, repeat=False, notify=None):
+        """
+        Adds a trigger sending messages when the condition becomes true. Raises
+        ValueError if the condition cannot be compiled.
+        """
+        trigger = Trigger(next(self.counter), condition, command, messages,
+                          repeat, notify)
+        with self.lock:
+            self.triggers[trigger.number] = trigger
+            for key in trigger.keys:
+                self.index.setdefault(key, set()).add(trigger.number)
+        return trigger
+
+    def _remove(self, number):
+        trigger = self.triggers.pop(number)
+        for key in trigger.keys:
+            numbers = self.index[key]
+            numbers.discard(number)
+            if not numbers:
+                del self.index[key]
+
+    def remove(self, number):
+        with self.lock:
+            if number not in self.triggers:
+                return False
+            self._remove(number)
+            return True
+
+    def clear(self):
+        with self.lock:
+            self.triggers.clear()
+            self.index.clear()
+
+    def pending(self):
+        with self.lock:
+            return sorted(self.triggers.values(), key=lambda t: t.number)
+
+    def keys(self):
+        with self.lock:
+            return list(self.index)
+
+    def subscribed_keys(self):
+        #Each trigger subscribes to its own inputs
+        with self.lock:
+            return [key for trigger in self.triggers.values() for key in trigger.keys]
+
+    def candidates(self, msg, previous):
+        """
+        Returns the numbers of the triggers with an input in msg whose value
+        differs from that in previous. Must be called before previous is
+        updated with msg.
+        """
+        found = set()
+        with self.lock:
+            for key in self.index.keys() & msg.keys():
+                if msg[key] != previous.get(key):
+                    found.update(self.index[key])
+        return found
+
+    def evaluate(self, numbers, data):
+        """
+        Checks the given triggers against the data and returns those that fire.
+        Triggers which do not repeat are removed once fired.
+        """
+        fired = []
+        with self.lock:
+            for number in numbers:
+                trigger = self.triggers.get(number)
+                if trigger is None or not trigger.check(data):
+                    continue
+                fired.append(trigger)
+                if not trigger.repeat:
+                    self._remove(number)
+        return fired
@@ -1,9 +1,10 @@
 # encoding: utf-8
 
-import collections
+import collections.abc
+import re
 
 
-class OrderedSet(collections.MutableSet):
+class OrderedSet(collections.abc.MutableSet):
     def __init__(self, iterable=None):
         self.end = end = []
         end += [None, end, end]         # sentinel node for doubly linked list
@@ -60,6 +61,25 @@ class OrderedSet(collections.MutableSet):
             return len(self) == len(other) and list(self) == list(other)
         return set(self) == set(other)
 
+_duration_units = {'d': 6 * 3600, 'h': 3600, 'm': 60, 's': 1}  # Kerbin days
+_duration_re = re.compile(r'(\d+(?:\.\d*)?|\.\d+)([dhms])')
+
+
+def parse_duration(text):
+    """
+    Returns a number of seconds from a string like "3600", "1h", or "2d 3h 5.5s"
+    in which days are Kerbin days of 6 hours. Raises ValueError if invalid.
+    """
+    text = text.replace(' ', '').lower()
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    matches = list(_duration_re.finditer(text))
+    if not matches or ''.join(m.group(0) for m in matches) != text:
+        raise ValueError('not a valid time')
+    return sum(float(m.group(1)) * _duration_units[m.group(2)] for m in matches)
+
 launch_text = """Welcome to Kerminal!
 ---
 The Escape Key will toggle your access to the Kerminal Command Line.
@@ -74,4 +94,28 @@ more details.
 
 Developer: Paul Barton (SavinaRoja)
 Project Page and Source Code: https://github.com/SavinaRoja/Kerminal
-"""
\ No newline at end of file
+"""
+
+def format_duration(seconds):
+    """
+    Returns a compact string for a number of seconds, giving the two largest
+    units, as in "2d 3h", "5m 20s" or "45s". Days are Kerbin days of 6 hours.
+    """
+    seconds = int(round(seconds))
+    parts = []
+    for unit in 'dhms':
+        count, seconds = divmod(seconds, _duration_units[unit])
+        if count or parts:
+            parts.append('{0}{1}'.format(count, unit))
+        if len(parts) == 2:
+            break
+    return ' '.join(parts) or '0s'
+
+
+def parse_address(text, default_host='localhost'):
+    """
+    Returns (host, port) from "<host>:<port>" or "<port>". Raises ValueError
+    if the port is not a number.
+    """
+    host, _, port = text.rpartition(':')
+    return host or default_host, int(port)
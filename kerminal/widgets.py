@@ -2,17 +2,20 @@
 
 import npyscreen2
 
-import collections
 import curses
 import weakref
 
+from .history import CommandHistory, DEFAULT_HISTORY_FILE
+
 
 class TextCommandBox(npyscreen2.TextField):
     def __init__(self,
                  form,
                  parent,
                  history=True,
-                 history_max=100,
+                 history_max=10000,
+                 history_file=DEFAULT_HISTORY_FILE,
+                 completion_limit=20,
                  toggle_val=curses.ascii.ESC,
                  *args,
                  **kwargs):
@@ -24,22 +27,27 @@ class TextCommandBox(npyscreen2.TextField):
                                              **kwargs)
 
         self.history = history
-        self._history_store = collections.deque(maxlen=history_max)
+        #The history file is not read until the history is first used
+        self._history_store = CommandHistory(history_file, max_entries=history_max)
         self._current_history_index = None
         self._current_command = ''
+        self._search = None  # [query, match position] during a reverse search
 
         self.toggle_val = toggle_val
+        self.completion_limit = completion_limit
 
     def set_up_handlers(self):
         super(TextCommandBox, self).set_up_handlers()
         self.handlers.update({curses.ascii.NL: self.h_execute_command,
                               curses.ascii.CR: self.h_execute_command,
+                              curses.ascii.TAB: self.h_complete,
                               })
         if self.history:
             self.handlers.update({"^P": self.h_get_previous_history,
                                   "^N": self.h_get_next_history,
                                   curses.KEY_UP: self.h_get_previous_history,
-                                  curses.KEY_DOWN: self.h_get_next_history, })
+                                  curses.KEY_DOWN: self.h_get_next_history,
+                                  "^R": self.h_reverse_search, })
 
     def h_get_previous_history(self, ch):
         if self._current_history_index is None:
@@ -74,6 +82,89 @@ class TextCommandBox(npyscreen2.TextField):
         self._current_history_index = _current_history_index
         self.display()
 
+    def h_reverse_search(self, ch):
+        """
+        Begins an incremental reverse search of the history, or moves to the
+        next older match if one is underway. While searching, typed characters
+        extend the search, Backspace shortens it, ^G restores the original
+        line, and any other key accepts the match and acts as usual.
+        """
+        if self._search is None:
+            self._current_command = self.value
+            self._search = ['', None]
+        elif self._search[1] is not None:
+            #Older matches of the same line are skipped over
+            position = self._search[1]
+            while position is not None and self._history_store[position] == self.value:
+                position = self._history_store.search(self._search[0], before=position)
+            self._show_match(position)
+        self._show_search()
+        return True
+
+    def handle_input(self, inpt):
+        if self._search is None:
+            return super(TextCommandBox, self).handle_input(inpt)
+        #unctrl folds keys beyond ASCII onto control keys, so only ASCII is used
+        if isinstance(inpt, int) and curses.ascii.isascii(inpt):
+            key = curses.ascii.unctrl(inpt)
+        else:
+            key = None
+        if key == '^R':
+            return self.h_reverse_search(inpt)
+        elif key == '^G':
+            self._search = None
+            self.value = self._current_command
+            self.cursor_position = len(self.value)
+            self.form.info('')
+            self.display()
+            return True
+        elif inpt in (curses.KEY_BACKSPACE, curses.ascii.DEL, curses.ascii.BS):
+            self._search = [self._search[0][:-1], None]
+            self._show_match(self._history_store.search(self._search[0]))
+            self._show_search()
+            return True
+        elif isinstance(inpt, int) and curses.ascii.isprint(inpt):
+            query, match = self._search
+            query += chr(inpt)
+            #The current match is searched again, it may still match
+            before = None if match is None else match + 1
+            self._search[0] = query
+            self._show_match(self._history_store.search(query, before=before))
+            self._show_search()
+            return True
+        #Accept the match, then let the key do what it normally does
+        self._search = None
+        self._current_history_index = None
+        return super(TextCommandBox, self).handle_input(inpt)
+
+    def _show_match(self, position):
+        #When nothing matches, the last match is kept on display
+        if position is not None:
+            self._search[1] = position
+            self.value = self._history_store[position]
+        elif not self._search[0]:
+            self.value = self._current_command
+
+    def _show_search(self):
+        query, match = self._search
+        found = bool(query) and match is not None and query in self.value
+        failed = 'failed ' if query and not found else ''
+        self.form.info('({}reverse-i-search)`{}\''.format(failed, query))
+        index = self.value.find(query) if found else -1
+        self.cursor_position = index if index >= 0 else len(self.value)
+        self.display()
+
+    def h_complete(self, ch):
+        completer = self.form.action_controller.completer
+        before = self.value[:self.cursor_position]
+        after = self.value[self.cursor_position:]
+        completed, candidates = completer.complete(before, limit=self.completion_limit)
+        self.value = completed + after
+        self.cursor_position = len(completed)
+        if len(candidates) > 1:  # Show the options when it was ambiguous
+            self.form.info('  '.join(candidates))
+        self.display()
+
     def h_execute_command(self, *args, **kwargs):
         if self.history:
             self._history_store.append(self.value)